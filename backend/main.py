@@ -1,12 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 import subprocess
 import os
 import uuid
 from datetime import datetime
-import threading
+
+from rpa.jobs.batch import generic_dedupe_key
+from rpa.jobs.fairness import PRIORITY_INTERACTIVE
+from rpa.jobs.pool import get_worker_pool
+from rpa.jobs.queue import execution_mode, get_job_queue
+from rpa.jobs.registry import Job, get_job_registry, stream_events
+from rpa.platforms import PLATFORM_RPA_MODULES, get_platform_runner
 
 app = FastAPI(title="RPA実行API")
 
@@ -37,6 +44,64 @@ class RPAResponse(BaseModel):
     platform: str
     status: str
     message: str
+    events_url: Optional[str] = None  # 進捗イベント（SSE）のURL
+    deduplicated: bool = False  # 同じ内容で実行中のジョブ（または同じ冪等キーのジョブ）に合流した場合True
+
+
+def start_job(job: Job, target, spec: dict) -> None:
+    """
+    RPAを実行方法（環境変数RPA_EXECUTION_MODE）に応じて開始する
+    threadの場合はこのプロセスのワーカープールで実行し、queueの場合はキューに登録してワーカープロセス（python -m rpa.worker）に任せる
+    APIからの実行は優先度interactiveとして、バッチ・定期実行より先に空いたブラウザを割り当てる
+    
+    Args:
+        job: get_job_registry()で登録したジョブ
+        target: threadの場合に実行する関数（戻り値がdictの場合はsuccessキー、それ以外は真偽値で成否を判定）
+        spec: queueの場合にワーカーへ渡す実行内容（kind, platform, user_id, login_url, target_urls, headless）
+    """
+    spec = dict(spec, priority=PRIORITY_INTERACTIVE)
+    if execution_mode() == "queue":
+        get_job_queue().enqueue(job, spec)
+    else:
+        get_worker_pool().submit(job, target, spec["priority"])
+
+
+@app.on_event("startup")
+def start_write_spool_replayer():
+    """前回までにSupabaseへ保存できずスプールに残った行の再送を開始"""
+    from rpa.utils.write_spool import get_write_spool
+    get_write_spool()
+
+
+@app.on_event("startup")
+def start_job_queue_relay():
+    """RPA_EXECUTION_MODE=queueの場合、ワーカープロセスの進捗をジョブ一覧に反映するリレーを開始"""
+    if execution_mode() == "queue":
+        get_job_queue().start_relay()
+
+
+@app.on_event("startup")
+def start_scheduler():
+    """定期実行スケジューラーを開始（環境変数RPA_SCHEDULER_ENABLEDがfalseの場合は開始しない）"""
+    if os.getenv("RPA_SCHEDULER_ENABLED", "true").lower() in ("false", "0", "no"):
+        print("[FastAPI] 定期実行スケジューラーは無効です（RPA_SCHEDULER_ENABLED=false）")
+        return
+    from rpa.jobs.scheduler import get_scheduler
+    get_scheduler().start()
+
+
+@app.on_event("startup")
+def start_driver_monitor():
+    """ブラウザのメモリ・CPU使用量の計測を開始（psutilがインストールされていない場合は計測しない）"""
+    from rpa.core.telemetry import get_driver_monitor
+    get_driver_monitor().start()
+
+
+@app.on_event("shutdown")
+def flush_order_exports():
+    """単発の実行で書き出し待ちになっている分析用の注文データをファイルに書き出す"""
+    from rpa.generic.order_export import get_order_exporter
+    get_order_exporter().flush()
 
 
 @app.get("/")
@@ -45,34 +110,37 @@ def read_root():
 
 
 @app.post("/run-rpa-simple")
-async def run_rpa_simple(user_id: Optional[str] = None):
+async def run_rpa_simple(user_id: Optional[str] = None, idempotency_key: Optional[str] = Header(None)):
     """
     シンプルなRPA実行エンドポイント（パラメータ不要）
     新しい構造のRPAを使用
+    同じユーザーのBASE RPAが実行中の場合は、新しく起動せずにそのジョブIDを返す
     """
-    import threading
     from rpa.platforms.base_rpa import run_base_rpa
     
     job_id = str(uuid.uuid4())
     
     try:
         # バックグラウンドでRPAを実行（スレッドで実行）
-        def run_rpa_thread():
-            try:
-                run_base_rpa(job_id=job_id, user_id=user_id)
-            except Exception as e:
-                print(f"[FastAPI] RPA実行エラー: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        thread = threading.Thread(target=run_rpa_thread, daemon=True)
-        thread.start()
+        job, created = get_job_registry().get_or_create(
+            job_id, "rpa", platform="base", user_id=user_id,
+            dedupe_key=("rpa", user_id, "base"), idempotency_key=idempotency_key
+        )
+        if created:
+            start_job(
+                job, lambda: run_base_rpa(job_id=job_id, user_id=user_id),
+                {"kind": "rpa", "platform": "base", "user_id": user_id, "login_url": None, "target_urls": []}
+            )
         
         return {
             "status": "RPA started",
-            "job_id": job_id,
-            "message": "RPAが起動しました。ブラウザが開きますので、ログイン後、注文を取得します。"
+            "job_id": job.job_id,
+            "events_url": f"/jobs/{job.job_id}/events",
+            "deduplicated": not created,
+            "message": "RPAが起動しました。ブラウザが開きますので、ログイン後、注文を取得します。" if created else "同じRPAが実行中のため、そのジョブに合流しました。"
         }
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -81,37 +149,24 @@ async def run_rpa_simple(user_id: Optional[str] = None):
 
 
 @app.post("/run-rpa", response_model=RPAResponse)
-async def run_rpa(request: RPARequest):
+async def run_rpa(request: RPARequest, idempotency_key: Optional[str] = Header(None)):
     """
     RPAスクリプトを実行するエンドポイント（プラットフォーム指定可能）
     新しい構造のRPAを使用
+    同じユーザー・プラットフォームのRPAが実行中の場合、または同じIdempotency-Keyのリクエストがあった場合は
+    新しくブラウザを起動せずに既存のジョブIDを返す
     """
-    import threading
-    
     platform = request.platform.lower()
     job_id = str(uuid.uuid4())
     
-    # プラットフォームとRPA関数のマッピング
-    platform_rpa_map = {
-        "base": "rpa.platforms.base_rpa",
-        "shopify": "rpa.platforms.shopify_rpa",
-        "rakuten": "rpa.platforms.rakuten_rpa",
-        "furusato": "rpa.platforms.furusato_rpa",
-        "tabechoku": "rpa.platforms.tabechoku_rpa",
-    }
-    
-    if platform not in platform_rpa_map:
+    if platform not in PLATFORM_RPA_MODULES:
         raise HTTPException(
             status_code=400,
             detail=f"サポートされていないプラットフォーム: {platform}"
         )
     
     try:
-        # 動的にモジュールをインポート
-        import importlib
-        module_path = platform_rpa_map[platform]
-        module = importlib.import_module(module_path)
-        run_rpa_func = getattr(module, f"run_{platform}_rpa", None)
+        run_rpa_func = get_platform_runner(platform)
         
         if not run_rpa_func:
             raise HTTPException(
@@ -120,26 +175,29 @@ async def run_rpa(request: RPARequest):
             )
         
         # バックグラウンドでRPAを実行（スレッドで実行）
-        def run_rpa_thread():
-            try:
-                run_rpa_func(
-                    job_id=job_id,
-                    user_id=request.user_id
-                )
-            except Exception as e:
-                print(f"[FastAPI] RPA実行エラー: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        thread = threading.Thread(target=run_rpa_thread, daemon=True)
-        thread.start()
+        job, created = get_job_registry().get_or_create(
+            job_id, "rpa", platform=platform, user_id=request.user_id,
+            dedupe_key=("rpa", request.user_id, platform), idempotency_key=idempotency_key
+        )
+        if created:
+            start_job(
+                job, lambda: run_rpa_func(job_id=job_id, user_id=request.user_id),
+                {"kind": "rpa", "platform": platform, "user_id": request.user_id, "login_url": None, "target_urls": []}
+            )
         
         return RPAResponse(
-            job_id=job_id,
+            job_id=job.job_id,
             platform=platform,
             status="started",
-            message=f"{platform.upper()} RPAが起動しました。ブラウザが開きますので、ログイン後、注文を取得します。"
+            events_url=f"/jobs/{job.job_id}/events",
+            deduplicated=not created,
+            message=(
+                f"{platform.upper()} RPAが起動しました。ブラウザが開きますので、ログイン後、注文を取得します。"
+                if created else f"{platform.upper()} RPAが実行中のため、そのジョブに合流しました。"
+            )
         )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -149,7 +207,23 @@ async def run_rpa(request: RPARequest):
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
+    health = {"status": "ok", "timestamp": datetime.now().isoformat(), "execution_mode": execution_mode()}
+    if execution_mode() == "queue":
+        health["queue"] = get_job_queue().counts()
+    return health
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    ブラウザのリソース使用量とジョブ数（Prometheusのテキスト形式）
+    RPA_EXECUTION_MODE=queueの場合、ブラウザはワーカープロセスで動くため、このプロセスのブラウザは計測対象にならない
+    
+    Returns:
+        str: メトリクス
+    """
+    from rpa.core.telemetry import get_driver_monitor
+    return get_driver_monitor().render_metrics()
 
 
 class GenericRPARequest(BaseModel):
@@ -158,15 +232,18 @@ class GenericRPARequest(BaseModel):
     headless: Optional[bool] = False  # ヘッドレスモード
     user_id: Optional[str] = None  # ユーザーID（オプション）
     platform: Optional[str] = None  # プラットフォーム名（base, shopify, rakuten, furusato, tabechoku）
+    wait: Optional[bool] = True  # 完了まで待ってから結果を返すか（Falseの場合はすぐに返し、進捗は/jobs/{job_id}/eventsで受け取る）
 
 
 @app.post("/run-generic-rpa")
-async def run_generic_rpa(request: GenericRPARequest):
+async def run_generic_rpa(request: GenericRPARequest, idempotency_key: Optional[str] = Header(None)):
     """
     汎用RPAを実行するエンドポイント
+    同じユーザー・プラットフォーム・URLのジョブが実行中の場合は、新しく起動せずにそのジョブの結果を返す
     
     Args:
         request: GenericRPARequest（login_url, target_url, headless, platform, user_id）
+        idempotency_key: 冪等キー（Idempotency-Keyヘッダー、同じキーの再送には同じジョブを返す）
     
     Returns:
         Dict: 実行結果
@@ -192,9 +269,6 @@ async def run_generic_rpa(request: GenericRPARequest):
     
     job_id = str(uuid.uuid4())
     
-    # 結果を保持するための変数
-    result_container = {"result": None, "error": None}
-    
     try:
         # バックグラウンドでRPAを実行（スレッドで実行）
         def run_rpa_thread():
@@ -212,36 +286,51 @@ async def run_generic_rpa(request: GenericRPARequest):
                     user_id=request.user_id,
                     job_id=job_id
                 )
-                result_container["result"] = result
                 print(f"[FastAPI] 汎用RPA実行が完了しました: {result}")
+                return result
             except Exception as e:
                 error_msg = f"エラーが発生しました: {str(e)}"
                 print(f"[FastAPI] 汎用RPA実行エラー: {e}")
                 import traceback
                 traceback.print_exc()
-                result_container["result"] = {
+                return {
                     "success": False,
                     "saved_records": {"customers": 0, "orders": 0, "items": 0},
-                    "message": error_msg
+                    "message": error_msg,
+                    "error": str(e)
                 }
-                result_container["error"] = str(e)
         
-        thread = threading.Thread(target=run_rpa_thread, daemon=True)
-        thread.start()
+        # 同じ内容のジョブが実行中であれば、新しく起動せずにその結果を待つ
+        job, created = get_job_registry().get_or_create(
+            job_id, "generic", platform=request.platform, user_id=request.user_id,
+            dedupe_key=generic_dedupe_key(request.user_id, request.platform, request.login_url, [request.target_url]),
+            idempotency_key=idempotency_key
+        )
+        if created:
+            start_job(job, run_rpa_thread, {
+                "kind": "generic",
+                "platform": request.platform,
+                "user_id": request.user_id,
+                "login_url": request.login_url,
+                "target_urls": [request.target_url],
+                "headless": bool(request.headless),
+            })
+        job_id = job.job_id
         
-        # スレッドが完了するまで待機（最大5分）
-        thread.join(timeout=300)
+        # 完了するまで待機（最大5分）。イベントループ上で待つため、待機中も他のリクエストを処理できる
+        if request.wait is not False:
+            await job.wait(timeout=300)
         
-        # 結果を取得
-        if result_container["error"]:
+        # 結果を取得（実行中の場合はNone）
+        result = job.result if job.finished else None
+        if result and result.get("error"):
             # エラーが発生した場合
             raise HTTPException(
                 status_code=500,
-                detail=f"RPA実行中にエラーが発生しました: {result_container['error']}"
+                detail=f"RPA実行中にエラーが発生しました: {result['error']}"
             )
         
-        if result_container["result"]:
-            result = result_container["result"]
+        if result:
             if result.get("success"):
                 return {
                     "status": "success",
@@ -262,11 +351,15 @@ async def run_generic_rpa(request: GenericRPARequest):
             return {
                 "status": "started",
                 "job_id": job_id,
+                "events_url": f"/jobs/{job_id}/events",
+                "deduplicated": not created,
                 "message": f"汎用RPAが起動しました。ターゲットURL ({request.target_url}) からデータを取得します。"
             }
     except HTTPException:
         # HTTPExceptionはそのまま再発生
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         print(f"[FastAPI] 予期しないエラー: {e}")
         import traceback
@@ -276,3 +369,200 @@ async def run_generic_rpa(request: GenericRPARequest):
             detail=f"汎用RPA実行エラー: {str(e)}"
         )
 
+
+class BatchTarget(BaseModel):
+    platform: Optional[str] = None  # プラットフォーム名（target_urlがない場合はプラットフォーム固有RPAで実行）
+    target_url: Optional[str] = None  # データ取得対象のURL（汎用RPA）
+    login_url: Optional[str] = None  # ログイン後のURL（汎用RPA、グループ内で1つ指定すればよい）
+    user_id: Optional[str] = None  # ユーザーID（未指定の場合はリクエストのuser_id）
+
+
+class BatchRequest(BaseModel):
+    targets: List[BatchTarget]
+    user_id: Optional[str] = None  # ユーザーID（オプション）
+    headless: Optional[bool] = False  # ヘッドレスモード（汎用RPAのみ）
+    priority: Optional[str] = "interactive"  # 優先度（interactive, scheduled, backfill、過去分の大量取り込みはbackfill）
+
+
+@app.post("/jobs/batch")
+def submit_batch_jobs(request: BatchRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    複数のターゲットURL・プラットフォームをまとめて実行するエンドポイント
+    (ユーザー, プラットフォーム) ごとに1つのブラウザ（1回のログイン）で処理し、グループはワーカープールで実行する
+    
+    Args:
+        request: BatchRequest（targets, user_id, headless, priority）
+        idempotency_key: 冪等キー（Idempotency-Keyヘッダー、同じキーの再送には同じバッチを返す）
+    
+    Returns:
+        Dict: バッチID・グループごとのジョブID（進捗は/jobs/{batch_id}/eventsで集計される）
+    """
+    from rpa.jobs.batch import submit_batch
+    
+    try:
+        batch, created = submit_batch(
+            [target.dict() for target in request.targets],
+            user_id=request.user_id,
+            headless=bool(request.headless),
+            idempotency_key=idempotency_key,
+            priority=request.priority
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "status": "queued",
+        "batch_id": batch.job_id,
+        "events_url": f"/jobs/{batch.job_id}/events",
+        "deduplicated": not created,
+        "groups": [job.snapshot() for job in batch.children],
+        "message": f"{len(batch.children)}グループのRPAを登録しました。空きができ次第、順に実行します。"
+    }
+
+
+class ScheduleRequest(BaseModel):
+    """定期実行の登録リクエスト（cronとinterval_secondsのどちらか一方を指定）"""
+    platform: str
+    user_id: Optional[str] = None
+    cron: Optional[str] = None  # cron式（例: "0 */3 * * *"、サーバーのローカル時刻）
+    interval_seconds: Optional[float] = None  # 実行間隔（秒、60以上）
+    login_url: Optional[str] = None  # 汎用RPAのログイン後URL（クッキーが有効な状態）
+    target_urls: Optional[List[str]] = None  # 汎用RPAで取得するURL（必須、手動ログインが必要なプラットフォーム固有RPAは定期実行できない）
+    headless: Optional[bool] = True  # ヘッドレスモード
+    jitter: Optional[float] = None  # 実行時刻に加えるランダムな遅延の上限（秒）
+
+
+@app.post("/schedules")
+def create_schedule(request: ScheduleRequest):
+    """
+    定期実行を登録するエンドポイント
+    実行時刻になると同期ジョブをワーカープールに追加する（前回のジョブが実行中の場合はスキップ）
+    
+    Args:
+        request: ScheduleRequest
+    
+    Returns:
+        Dict: 登録した定期実行（id, next_run_at）
+    """
+    from rpa.jobs.scheduler import get_scheduler
+    
+    try:
+        return get_scheduler().add(
+            platform=request.platform,
+            user_id=request.user_id,
+            cron=request.cron,
+            interval_seconds=request.interval_seconds,
+            login_url=request.login_url,
+            target_urls=request.target_urls,
+            headless=request.headless is not False,
+            jitter=request.jitter
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/schedules")
+def list_schedules(user_id: Optional[str] = None):
+    """
+    定期実行の一覧を返すエンドポイント（前回の実行結果・次回の実行時刻を含む）
+    
+    Args:
+        user_id: 指定した場合はそのユーザーの定期実行のみ
+    """
+    from rpa.jobs.scheduler import get_scheduler
+    return {"schedules": get_scheduler().list_schedules(user_id)}
+
+
+@app.post("/schedules/{schedule_id}/{action}")
+def toggle_schedule(schedule_id: str, action: str):
+    """
+    定期実行を一時停止（pause）・再開（resume）するエンドポイント
+    
+    Args:
+        schedule_id: 定期実行ID
+        action: pause または resume
+    """
+    from rpa.jobs.scheduler import get_scheduler
+    
+    if action not in ("pause", "resume"):
+        raise HTTPException(status_code=404, detail=f"不明な操作です: {action}")
+    scheduler = get_scheduler()
+    if not scheduler.set_enabled(schedule_id, action == "resume"):
+        raise HTTPException(status_code=404, detail=f"定期実行が見つかりません: {schedule_id}")
+    return scheduler.get(schedule_id)
+
+
+@app.delete("/schedules/{schedule_id}")
+def delete_schedule(schedule_id: str):
+    """
+    定期実行を削除するエンドポイント（実行中のジョブはキャンセルしない）
+    
+    Args:
+        schedule_id: 定期実行ID
+    """
+    from rpa.jobs.scheduler import get_scheduler
+    
+    if not get_scheduler().remove(schedule_id):
+        raise HTTPException(status_code=404, detail=f"定期実行が見つかりません: {schedule_id}")
+    return {"status": "deleted", "id": schedule_id}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    ジョブの現在の状態を返すエンドポイント
+    
+    Args:
+        job_id: ジョブID
+    
+    Returns:
+        Dict: ジョブの状態（status, stage, counts, result）
+    """
+    job = get_job_registry().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    return job.snapshot()
+
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    ジョブの進捗をServer-Sent Eventsで配信するエンドポイント
+    ステージの遷移（driver_ready, login_detected, orders_extracted, rows_saved）と最終件数（finished）を送る
+    
+    Args:
+        job_id: ジョブID
+        last_event_id: 再接続時に受信済みの最後のイベントID（Last-Event-IDヘッダー）
+    
+    Returns:
+        StreamingResponse: text/event-streamのレスポンス（ジョブが終了したら閉じる）
+    """
+    job = get_job_registry().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(
+        stream_events(job, after=after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """
+    実行中のジョブをキャンセルするエンドポイント
+    ログイン待ち・ブラウザを閉じる待ちなどの待機を中断し、ブラウザを終了してジョブをcancelledにする
+    
+    Args:
+        job_id: ジョブID
+    
+    Returns:
+        Dict: キャンセル要求後のジョブの状態
+    """
+    job = get_job_registry().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    if not job.cancel("ユーザーによってキャンセルされました"):
+        raise HTTPException(status_code=409, detail=f"ジョブはすでに終了しています: {job.status}")
+    return job.snapshot()
@@ -1,10 +1,11 @@
 """
 Seleniumブラウザー起動・共通操作モジュール
 """
+import os
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from typing import Optional
+from typing import Dict, Any, Callable, Optional, Tuple
 
 
 def create_driver(headless: bool = False, user_data_dir: Optional[str] = None) -> webdriver.Chrome:
@@ -58,3 +59,163 @@ def wait_for_page_load(driver: webdriver.Chrome, timeout: int = 10):
     time.sleep(2)  # 基本的な読み込み待機
     # 必要に応じて、より高度な待機処理を追加可能
 
+
+
+def max_driver_restarts() -> int:
+    """
+    ブラウザがクラッシュした場合に起動し直す最大回数（環境変数RPA_DRIVER_RESTARTS、デフォルト: 2）
+    
+    Returns:
+        int: 最大回数（0の場合は起動し直さない）
+    """
+    return int(os.getenv("RPA_DRIVER_RESTARTS", "2"))
+
+
+def is_driver_alive(driver: Optional[webdriver.Chrome]) -> bool:
+    """
+    WebDriverのセッションが生きているか（Chromeのクラッシュ・ウィンドウが閉じられた場合はFalse）
+    
+    Args:
+        driver: WebDriverインスタンス
+    
+    Returns:
+        bool: 操作できる場合True
+    """
+    if driver is None:
+        return False
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+def save_session(driver: webdriver.Chrome) -> Dict[str, Any]:
+    """
+    ログイン済みのセッション（現在のURLとクッキー）を保存
+    ブラウザがクラッシュした場合にrestart_driver()でログイン状態を復元するために使う
+    
+    Args:
+        driver: WebDriverインスタンス
+    
+    Returns:
+        Dict[str, Any]: {url, cookies}
+    """
+    try:
+        return {"url": driver.current_url, "cookies": driver.get_cookies()}
+    except Exception as e:
+        print(f"[Browser] セッションの保存に失敗しました: {e}")
+        return {"url": None, "cookies": []}
+
+
+def restore_session(driver: webdriver.Chrome, session: Optional[Dict[str, Any]]) -> None:
+    """
+    save_session()で保存したクッキーを設定し、保存時のURLを開く
+    
+    Args:
+        driver: 起動し直したWebDriverインスタンス
+        session: save_session()の戻り値
+    """
+    if not session or not session.get("url"):
+        return
+    # クッキーは同じドメインのページを開いてからでないと設定できない
+    driver.get(session["url"])
+    restored = 0
+    for cookie in session.get("cookies") or []:
+        cookie = {key: value for key, value in cookie.items() if key != "sameSite" or value in ("Strict", "Lax", "None")}
+        try:
+            driver.add_cookie(cookie)
+            restored += 1
+        except Exception:
+            # 別ドメインのクッキーは設定できないため無視する
+            continue
+    driver.get(session["url"])
+    print(f"[Browser] セッションを復元しました（クッキー: {restored}件）")
+
+
+def restart_driver(
+    driver: Optional[webdriver.Chrome],
+    session: Optional[Dict[str, Any]] = None,
+    headless: bool = False,
+    job_id: Optional[str] = None
+) -> webdriver.Chrome:
+    """
+    クラッシュしたブラウザを終了して起動し直し、保存したセッションを復元する
+    
+    Args:
+        driver: クラッシュしたWebDriverインスタンス
+        session: save_session()の戻り値（ログイン状態の復元に使う）
+        headless: ヘッドレスモードで起動するか
+        job_id: ジョブID（新しいWebDriverをキャンセル対象として登録する）
+    
+    Returns:
+        webdriver.Chrome: 起動し直したWebDriverインスタンス
+    
+    Raises:
+        JobCancelled: ジョブがキャンセルされている場合
+    """
+    from rpa.jobs.registry import attach_driver, raise_if_cancelled, report
+    
+    raise_if_cancelled(job_id)
+    if driver is not None:
+        try:
+            driver.quit()
+        except Exception:
+            pass
+    print("[Browser] ブラウザを起動し直しています...")
+    new_driver = create_driver(headless=headless)
+    attach_driver(job_id, new_driver)
+    try:
+        restore_session(new_driver, session)
+    except Exception as e:
+        print(f"[Browser] セッションの復元に失敗しました: {e}")
+    report(job_id, "driver_restarted", "ブラウザを起動し直しました")
+    return new_driver
+
+
+def run_with_driver_recovery(
+    driver: webdriver.Chrome,
+    step: Callable[[webdriver.Chrome], Any],
+    session: Optional[Dict[str, Any]] = None,
+    headless: bool = False,
+    job_id: Optional[str] = None,
+    relogin: Optional[Callable[[webdriver.Chrome], Any]] = None
+) -> Tuple[Any, webdriver.Chrome]:
+    """
+    ブラウザを使う処理を実行し、ブラウザのクラッシュで失敗した場合は起動し直して同じ処理をやり直す
+    処理が例外・空の結果で終わり、かつWebDriverのセッションが失われている場合だけやり直す（最大RPA_DRIVER_RESTARTS回）
+    
+    Args:
+        driver: WebDriverインスタンス
+        step: 実行する処理（WebDriverを受け取り、結果を返す）
+        session: save_session()の戻り値（起動し直したときにログイン状態を復元する）
+        headless: ヘッドレスモードで起動し直すか
+        job_id: ジョブID
+        relogin: 起動し直した後、処理の前に呼び出す関数（ログイン完了の確認など）
+    
+    Returns:
+        Tuple[Any, webdriver.Chrome]: (処理の結果, 最後に使ったWebDriverインスタンス)
+    
+    Raises:
+        Exception: やり直しても失敗した場合は処理の例外をそのまま送出
+    """
+    from rpa.jobs.registry import JobCancelled
+    
+    restarts = 0
+    while True:
+        error = None
+        try:
+            result = step(driver)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            result, error = None, e
+        if (error is None and result) or is_driver_alive(driver) or restarts >= max_driver_restarts():
+            if error is not None:
+                raise error
+            return result, driver
+        restarts += 1
+        print(f"[Browser] ブラウザのセッションが失われました。起動し直してやり直します（{restarts}/{max_driver_restarts()}回目）")
+        driver = restart_driver(driver, session, headless=headless, job_id=job_id)
+        if relogin:
+            relogin(driver)
@@ -1,9 +1,12 @@
 """
 共通ログイン処理の抽象クラス
 """
+import os
 from abc import ABC, abstractmethod
 from selenium import webdriver
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from rpa.jobs.registry import JobCancelled, wait_unless_cancelled
 
 
 class LoginBase(ABC):
@@ -11,6 +14,15 @@ class LoginBase(ABC):
     プラットフォームごとのログイン処理を定義する抽象基底クラス
     """
     
+    def __init__(self, job_id: Optional[str] = None):
+        """
+        初期化
+        
+        Args:
+            job_id: ジョブID（キャンセルされたらログイン待機を中断する）
+        """
+        self.job_id = job_id
+    
     @abstractmethod
     def get_login_url(self) -> str:
         """
@@ -35,18 +47,19 @@ class LoginBase(ABC):
         """
         pass
     
-    def wait_for_manual_login(self, driver: webdriver.Chrome, wait_time: int = 120) -> bool:
+    def wait_for_manual_login(self, driver: webdriver.Chrome, wait_time: Optional[int] = None) -> bool:
         """
         手動ログインを待機（デフォルト実装）
+        ジョブがキャンセルされた場合はJobCancelledを送出する
         
         Args:
             driver: WebDriverインスタンス
-            wait_time: 待機時間（秒）
+            wait_time: 待機時間（秒、未指定の場合は環境変数RPA_LOGIN_TIMEOUT、デフォルト: 120）
         
         Returns:
             bool: ログイン成功時True
         """
-        import time
+        wait_time = wait_time or int(os.getenv("RPA_LOGIN_TIMEOUT", "120"))
         
         print("\n" + "="*60)
         print("【重要】ログインページを開きました。")
@@ -61,7 +74,8 @@ class LoginBase(ABC):
             remaining = wait_time - waited_time
             if remaining > 0:
                 print(f"[RPA] 待機中... あと{remaining}秒")
-            time.sleep(check_interval)
+            if wait_unless_cancelled(self.job_id, check_interval):
+                raise JobCancelled("ログイン待機中にキャンセルされました")
         
         print(f"[RPA] {wait_time}秒経過しました。自動的に続行します...")
         return True
@@ -0,0 +1,275 @@
+"""
+ブラウザのメモリ・CPU使用量の監視と自動の再起動
+実行中のジョブのChromeDriverとChromeのプロセスツリーを定期的に計測し、
+/metricsで公開するとともにジョブごとの最大使用量を記録する
+メモリ使用量が上限を超えたブラウザは、ジョブの区切り（バッチのURLの間・ブラウザを閉じる待ち）で再起動・終了させる
+"""
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Set
+
+try:
+    import psutil
+except ImportError:  # psutilは任意依存（未インストールの場合は計測しない）
+    psutil = None
+
+from rpa.jobs.registry import get_job_registry
+
+
+def driver_pid(driver) -> Optional[int]:
+    """
+    WebDriverが起動したChromeDriverのプロセスID
+
+    Args:
+        driver: WebDriverインスタンス
+
+    Returns:
+        Optional[int]: プロセスID（取得できない場合はNone）
+    """
+    process = getattr(getattr(driver, "service", None), "process", None)
+    return getattr(process, "pid", None)
+
+
+class DriverMonitor:
+    """実行中のジョブのブラウザのリソース使用量を計測し、上限を超えたブラウザの再起動を要求する"""
+
+    def __init__(self, interval: Optional[float] = None, max_rss_mb: Optional[float] = None, max_age: Optional[float] = None):
+        """
+        初期化
+
+        Args:
+            interval: 計測間隔（秒、未指定の場合は環境変数RPA_TELEMETRY_INTERVAL、デフォルト: 10）
+            max_rss_mb: 1つのブラウザ（ChromeDriver・Chromeの全プロセス）のメモリ使用量の上限
+                （MB、未指定の場合は環境変数RPA_DRIVER_MAX_RSS_MB、デフォルト: 1536、0は上限なし）
+            max_age: ブラウザを起動してから再起動するまでの時間（秒、未指定の場合は環境変数RPA_DRIVER_MAX_AGE、デフォルト: 0 = 再起動しない）
+        """
+        self.interval = interval or float(os.getenv("RPA_TELEMETRY_INTERVAL", "10"))
+        self.max_rss_mb = max_rss_mb if max_rss_mb is not None else float(os.getenv("RPA_DRIVER_MAX_RSS_MB", "1536"))
+        self.max_age = max_age if max_age is not None else float(os.getenv("RPA_DRIVER_MAX_AGE", "0"))
+        # 最新の計測値: ジョブID → {pid, rss_bytes, cpu_percent, processes, started_at, sampled_at}
+        self.samples: Dict[str, Dict[str, Any]] = {}
+        self.recycled_total = 0
+        self._recycle: Set[str] = set()
+        # cpu_percent()は前回の呼び出しからの使用率を返すため、プロセスのオブジェクトを使い回す
+        self._processes: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def available(self) -> bool:
+        """計測できるか（psutilがインストールされているか）"""
+        return psutil is not None
+
+    def start(self) -> None:
+        """計測を開始（バックグラウンドスレッド、psutilがない場合は開始しない）"""
+        if not self.available:
+            print("[Telemetry] psutilがインストールされていないため、ブラウザのメモリ使用量は計測しません")
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="driver-monitor", daemon=True)
+            self._thread.start()
+        print(f"[Telemetry] ブラウザの計測を開始しました（間隔: {self.interval}秒, メモリ上限: {self.max_rss_mb}MB）")
+
+    def _run(self) -> None:
+        """計測を繰り返す（バックグラウンドスレッド）"""
+        while True:
+            try:
+                self.sample_all()
+            except Exception as e:
+                print(f"[Telemetry] 計測エラー: {e}")
+                import traceback
+                traceback.print_exc()
+            time.sleep(self.interval)
+
+    def sample(self, driver) -> Optional[Dict[str, Any]]:
+        """
+        1つのブラウザのプロセスツリー（ChromeDriverとその子プロセスのChrome）を計測
+
+        Args:
+            driver: WebDriverインスタンス
+
+        Returns:
+            Optional[Dict[str, Any]]: {pid, rss_bytes, cpu_percent, processes}（計測できない場合はNone）
+        """
+        pid = driver_pid(driver)
+        if psutil is None or not pid:
+            return None
+        try:
+            root = self._process(pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+        rss_bytes = 0
+        cpu_percent = 0.0
+        for process in tree:
+            try:
+                process = self._process(process.pid)
+                rss_bytes += process.memory_info().rss
+                cpu_percent += process.cpu_percent(None)
+            except psutil.Error:
+                # 計測中に終了したプロセスは数えない
+                continue
+        return {"pid": pid, "rss_bytes": rss_bytes, "cpu_percent": round(cpu_percent, 1), "processes": len(tree)}
+
+    def _process(self, pid: int):
+        """プロセスIDに対応するpsutil.Process（前回の計測と同じオブジェクト）"""
+        process = self._processes.get(pid)
+        if process is None:
+            process = psutil.Process(pid)
+            self._processes[pid] = process
+        return process
+
+    def sample_all(self) -> Dict[str, Dict[str, Any]]:
+        """
+        実行中のジョブのブラウザをすべて計測し、ジョブの最大使用量を更新して、上限を超えたブラウザの再起動を要求する
+
+        Returns:
+            Dict[str, Dict[str, Any]]: ジョブID → 計測値
+        """
+        if psutil is None:
+            return {}
+        now = time.time()
+        samples: Dict[str, Dict[str, Any]] = {}
+        for job in get_job_registry().running_jobs():
+            driver = job.driver
+            if driver is None:
+                continue
+            sample = self.sample(driver)
+            if sample is None:
+                continue
+            previous = self.samples.get(job.job_id)
+            # ブラウザが起動し直された場合（ChromeDriverのプロセスIDが変わった場合）は起動時刻を更新する
+            started_at = previous["started_at"] if previous and previous["pid"] == sample["pid"] else now
+            sample.update(platform=job.platform, user_id=job.user_id, started_at=started_at, sampled_at=now)
+            samples[job.job_id] = sample
+            job.record_resources(sample["rss_bytes"], sample["cpu_percent"], sample["processes"])
+            reason = self._recycle_reason(sample, now)
+            if reason:
+                self.request_recycle(job.job_id, reason)
+        with self._lock:
+            self.samples = samples
+            live_pids = {pid for pid in self._processes if psutil.pid_exists(pid)}
+            self._processes = {pid: process for pid, process in self._processes.items() if pid in live_pids}
+            self._recycle &= set(samples)
+        return samples
+
+    def _recycle_reason(self, sample: Dict[str, Any], now: float) -> Optional[str]:
+        """上限を超えている場合は再起動の理由を返す"""
+        rss_mb = sample["rss_bytes"] / (1024 * 1024)
+        if self.max_rss_mb and rss_mb > self.max_rss_mb:
+            return f"メモリ使用量 {rss_mb:.0f}MB が上限 {self.max_rss_mb:.0f}MB を超えました"
+        if self.max_age and now - sample["started_at"] > self.max_age:
+            return f"ブラウザの起動から {int(now - sample['started_at'])}秒 が経過しました"
+        return None
+
+    def request_recycle(self, job_id: str, reason: str) -> None:
+        """
+        ジョブのブラウザの再起動を要求（ジョブの区切りでrecycle_requested()がTrueになる）
+
+        Args:
+            job_id: ジョブID
+            reason: 理由
+        """
+        with self._lock:
+            if job_id in self._recycle:
+                return
+            self._recycle.add(job_id)
+        print(f"[Telemetry] ブラウザの再起動を要求します (Job ID: {job_id}): {reason}")
+
+    def recycle_requested(self, job_id: Optional[str]) -> bool:
+        """ジョブのブラウザの再起動が要求されているか"""
+        with self._lock:
+            return job_id in self._recycle
+
+    def recycled(self, job_id: Optional[str]) -> None:
+        """ジョブのブラウザを再起動・終了したことを記録（要求を取り消す）"""
+        with self._lock:
+            if job_id not in self._recycle:
+                return
+            self._recycle.discard(job_id)
+            self.recycled_total += 1
+            self.samples.pop(job_id, None)
+
+    def render_metrics(self) -> str:
+        """
+        計測値をPrometheusのテキスト形式で出力
+
+        Returns:
+            str: /metricsのレスポンス本文
+        """
+        with self._lock:
+            samples = dict(self.samples)
+            recycled_total = self.recycled_total
+        jobs = get_job_registry().status_counts()
+        lines: List[str] = [
+            "# HELP rpa_telemetry_available psutilでブラウザを計測できる場合は1",
+            "# TYPE rpa_telemetry_available gauge",
+            f"rpa_telemetry_available {1 if self.available else 0}",
+            "# HELP rpa_jobs ステータスごとのジョブ数（このプロセスのジョブ一覧）",
+            "# TYPE rpa_jobs gauge",
+        ]
+        lines += [f'rpa_jobs{{status="{status}"}} {count}' for status, count in sorted(jobs.items())]
+        lines += [
+            "# HELP rpa_drivers 計測中のブラウザ数",
+            "# TYPE rpa_drivers gauge",
+            f"rpa_drivers {len(samples)}",
+            "# HELP rpa_driver_recycles_total メモリ使用量などの上限を超えて再起動・終了したブラウザ数",
+            "# TYPE rpa_driver_recycles_total counter",
+            f"rpa_driver_recycles_total {recycled_total}",
+        ]
+        for name, key, help_text in (
+            ("rpa_driver_rss_bytes", "rss_bytes", "ブラウザ（ChromeDriver・Chromeの全プロセス）のメモリ使用量"),
+            ("rpa_driver_cpu_percent", "cpu_percent", "ブラウザのCPU使用率（100で1コア分）"),
+            ("rpa_driver_processes", "processes", "ブラウザのプロセス数"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for job_id, sample in sorted(samples.items()):
+                labels = f'job_id="{job_id}",platform="{sample.get("platform") or ""}"'
+                lines.append(f"{name}{{{labels}}} {sample[key]}")
+        return "\n".join(lines) + "\n"
+
+
+_driver_monitor: Optional[DriverMonitor] = None
+_driver_monitor_lock = threading.Lock()
+
+
+def get_driver_monitor() -> DriverMonitor:
+    """
+    プロセス共通のDriverMonitorを取得
+
+    Returns:
+        DriverMonitor: 共有インスタンス
+    """
+    global _driver_monitor
+    with _driver_monitor_lock:
+        if _driver_monitor is None:
+            _driver_monitor = DriverMonitor()
+        return _driver_monitor
+
+
+def recycle_requested(job_id: Optional[str]) -> bool:
+    """
+    ジョブのブラウザの再起動が要求されているか（RPA側でURLの間・待機中に確認する）
+
+    Args:
+        job_id: ジョブID
+
+    Returns:
+        bool: 再起動・終了すべき場合True
+    """
+    return bool(job_id) and get_driver_monitor().recycle_requested(job_id)
+
+
+def mark_recycled(job_id: Optional[str]) -> None:
+    """
+    ジョブのブラウザを再起動・終了したことを記録
+
+    Args:
+        job_id: ジョブID
+    """
+    if job_id:
+        get_driver_monitor().recycled(job_id)
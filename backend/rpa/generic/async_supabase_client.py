@@ -0,0 +1,229 @@
+"""
+汎用RPA 非同期Supabaseクライアント
+GenericSupabaseClientと同じ行をAsyncPostgrestClientで書き込む
+1ジョブ1スレッドでexecute()を待つ代わりに、共通のイベントループ上で多数の保存を同時に進める
+"""
+import asyncio
+from typing import Dict, Any, List, Optional
+
+from rpa.generic.config import GenericRPAConfig
+from rpa.generic.customer_cache import CustomerCache
+from rpa.generic.fingerprint_index import FingerprintIndex, get_fingerprint_index
+from rpa.generic.supabase_client import GenericSupabaseClient, is_order_item_id
+from rpa.utils.async_postgrest import AsyncPostgrestClient, get_async_postgrest_client, run_coroutine
+from rpa.utils.write_spool import ORDER_GRAPHS_TABLE, WriteSpool, get_write_spool
+
+
+class AsyncGenericSupabaseClient:
+    """汎用Supabaseクライアント（非同期版）"""
+
+    def __init__(
+        self,
+        config: GenericRPAConfig,
+        fingerprint_index: Optional[FingerprintIndex] = None,
+        write_spool: Optional[WriteSpool] = None,
+        postgrest: Optional[AsyncPostgrestClient] = None
+    ):
+        """
+        初期化
+
+        Args:
+            config: GenericRPAConfigインスタンス
+            fingerprint_index: 変更検知に使うフィンガープリント索引（GenericSupabaseClientと同じ）
+            write_spool: 保存に失敗した行を退避するスプール（未指定の場合はプロセス共通のスプール）
+            postgrest: 書き込みに使うクライアント（未指定の場合はURL・Keyごとの共有クライアント）
+        """
+        self.config = config
+        self.postgrest = postgrest or get_async_postgrest_client(config.supabase_url, config.supabase_key)
+        if fingerprint_index is None and config.skip_unchanged:
+            fingerprint_index = get_fingerprint_index(config.supabase_url)
+        self.fingerprint_index = fingerprint_index
+        self.customer_cache = CustomerCache(persistent_index=fingerprint_index)
+        self.write_spool = write_spool or get_write_spool()
+        self.skipped_records = {"customers": 0, "orders": 0, "items": 0}
+        self.spooled_records = {"customers": 0, "orders": 0, "items": 0}
+
+    async def upsert_rows(self, table: str, rows: List[Dict[str, Any]]) -> int:
+        """
+        複数行をまとめてupsert（変更のない行は送信しない、失敗時は例外を送出）
+
+        Args:
+            table: テーブル名（customers, orders, order_items）
+            rows: upsert用の行のリスト
+
+        Returns:
+            int: 保存した行数（変更がなく送信をスキップした行を含む）
+        """
+        if not rows:
+            return 0
+        unchanged_count = 0
+        if self.fingerprint_index:
+            changed_rows = self.fingerprint_index.filter_changed(table, rows)
+            unchanged_count = len(rows) - len(changed_rows)
+            if unchanged_count:
+                self.skipped_records["items" if table == "order_items" else table] += unchanged_count
+            rows = changed_rows
+            if not rows:
+                return unchanged_count
+        saved_count = await self.postgrest.write_rows(table, rows)
+        if self.fingerprint_index:
+            self.fingerprint_index.record(table, rows)
+        if table == "customers":
+            for row in rows:
+                self.customer_cache.store(row, str(row["id"]))
+        return saved_count + unchanged_count
+
+    def known_orphan_item_ids(self, order_id: str, keep_ids: List[str]) -> List[str]:
+        """フィンガープリント索引から、今回の商品一覧にない保存済みの注文商品IDを返す"""
+        if not self.fingerprint_index:
+            return []
+        keep = set(keep_ids)
+        return [
+            row_id for row_id in self.fingerprint_index.known_ids("order_items", f"{order_id}-")
+            if row_id not in keep and is_order_item_id(order_id, row_id)
+        ]
+
+    async def delete_orphan_items(self, order_id: str, keep_ids: List[str]) -> int:
+        """
+        今回の商品一覧にない注文商品を削除（失敗しても次回の同期で再度削除されるため例外は送出しない）
+
+        Args:
+            order_id: 注文ID
+            keep_ids: 今回保存した注文商品IDのリスト（空の場合は何もしない）
+
+        Returns:
+            int: 削除した注文商品数
+        """
+        if not keep_ids:
+            return 0
+        quoted_ids = ",".join('"' + row_id.replace('"', '\\"') + '"' for row_id in keep_ids)
+        try:
+            deleted = await self.postgrest.delete_rows("order_items", {"order_id": f"eq.{order_id}", "id": f"not.in.({quoted_ids})"})
+        except Exception as e:
+            print(f"[Async Supabase Client] 不要な注文商品の削除エラー: {e}")
+            return 0
+        if self.fingerprint_index:
+            self.fingerprint_index.forget("order_items", {row["id"] for row in deleted} | set(self.known_orphan_item_ids(order_id, keep_ids)))
+        return len(deleted)
+
+    async def save_order_data(self, parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, int]:
+        """
+        解析済みの注文データをSupabaseに保存（顧客 → 注文 → 注文商品の順）
+        保存できなかった行はスプールに退避する
+
+        Args:
+            parsed_data: parse_base_order_json()で解析されたデータ
+            platform: プラットフォーム名
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+
+        Returns:
+            Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}
+        """
+        saved_records = {"customers": 0, "orders": 0, "items": 0}
+
+        if self.config.save_mode == "rpc":
+            graph = GenericSupabaseClient.build_order_graph(parsed_data, platform, user_id, job_id)
+            if not graph:
+                return saved_records
+            try:
+                counts = await self.postgrest.rpc("save_order_graphs", {"graphs": [graph]}) or {}
+            except Exception as e:
+                print(f"[Async Supabase Client] 注文の保存エラー（RPC）: {e}")
+                if self.write_spool:
+                    self.write_spool.append(ORDER_GRAPHS_TABLE, [graph], mode="upsert", error=e)
+                    self.spooled_records["orders"] += 1
+                return saved_records
+            if self.fingerprint_index:
+                if graph["customer"]:
+                    self.fingerprint_index.record("customers", [graph["customer"]])
+                self.fingerprint_index.record("orders", [graph["order"]])
+                self.fingerprint_index.record("order_items", graph["items"])
+                if graph["items"]:
+                    # RPC内で商品一覧にない注文商品は削除済み
+                    self.fingerprint_index.forget("order_items", self.known_orphan_item_ids(graph["id"], [row["id"] for row in graph["items"]]))
+            return {key: int(counts.get(key, 0)) for key in saved_records}
+
+        customer_row = None
+        if parsed_data.get("customer"):
+            customer_row = GenericSupabaseClient.build_customer_row(parsed_data["customer"])
+        order_row = None
+        if parsed_data.get("order"):
+            order_row = GenericSupabaseClient.build_order_row(
+                parsed_data["order"], customer_row["id"] if customer_row else None, platform, user_id, job_id
+            )
+        item_rows = []
+        if order_row and parsed_data.get("order_items"):
+            item_rows = GenericSupabaseClient.build_order_item_rows(parsed_data["order_items"], order_row["id"])
+
+        pending = [("customers", [customer_row] if customer_row else []), ("orders", [order_row] if order_row else []), ("order_items", item_rows)]
+        for index, (table, rows) in enumerate(pending):
+            if not rows:
+                continue
+            if table == "customers" and self.customer_cache.lookup(rows[0]):
+                # 同じジョブ内ですでに保存した顧客（内容も同じ）は送信しない
+                self.skipped_records["customers"] += 1
+                saved_records["customers"] = 1
+                continue
+            items_changed = table == "order_items" and (not self.fingerprint_index or bool(self.fingerprint_index.filter_changed(table, rows)))
+            try:
+                count = await self.upsert_rows(table, rows)
+            except Exception as e:
+                print(f"[Async Supabase Client] {table}の保存エラー: {e}")
+                # 以降のテーブルも外部キーの順序を保つためにまとめてスプールへ退避
+                for spool_table, spool_rows in pending[index:]:
+                    if spool_rows and self.write_spool:
+                        self.write_spool.append(spool_table, spool_rows, mode="upsert", error=e)
+                        self.spooled_records["items" if spool_table == "order_items" else spool_table] += len(spool_rows)
+                break
+            saved_records["items" if table == "order_items" else table] = count
+            if table == "order_items" and (items_changed or self.known_orphan_item_ids(order_row["id"], [row["id"] for row in rows])):
+                # 注文商品の保存後に、商品一覧にない注文商品を削除する
+                await self.delete_orphan_items(order_row["id"], [row["id"] for row in rows])
+
+        return saved_records
+
+    async def save_many(self, parsed_list: List[Dict[str, Any]], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None, concurrency: int = 20) -> Dict[str, int]:
+        """
+        複数の注文データを同時に保存
+
+        Args:
+            parsed_list: parse_base_order_json()で解析されたデータのリスト
+            platform: プラットフォーム名
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+            concurrency: 同時に保存する注文数
+
+        Returns:
+            Dict[str, int]: 保存レコード数の合計
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def save(parsed_data):
+            async with semaphore:
+                return await self.save_order_data(parsed_data, platform, user_id, job_id)
+
+        totals = {"customers": 0, "orders": 0, "items": 0}
+        for saved in await asyncio.gather(*(save(parsed_data) for parsed_data in parsed_list)):
+            for key in totals:
+                totals[key] += saved[key]
+        return totals
+
+
+def save_order_data_blocking(config: GenericRPAConfig, parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    非同期クライアントで保存し、完了まで待つ（スレッドで動くRPAジョブから呼び出す用）
+    書き込みは共通のイベントループ・コネクションプールで行われる
+
+    Args:
+        config: GenericRPAConfigインスタンス
+        parsed_data: parse_base_order_json()で解析されたデータ
+        platform: プラットフォーム名
+        user_id: ユーザーID（RLS用）
+        job_id: RPA実行ジョブID
+
+    Returns:
+        Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}
+    """
+    client = AsyncGenericSupabaseClient(config)
+    return run_coroutine(client.save_order_data(parsed_data, platform=platform, user_id=user_id, job_id=job_id))
@@ -19,7 +19,11 @@ class GenericRPAConfig:
         supabase_key: Optional[str] = None,
         platform: Optional[str] = None,
         headless: bool = False,
-        user_id: Optional[str] = None
+        user_id: Optional[str] = None,
+        raw_data_retention: Optional[str] = None,
+        skip_unchanged: Optional[bool] = None,
+        persistence_backend: Optional[str] = None,
+        save_mode: Optional[str] = None
     ):
         """
         初期化
@@ -32,12 +36,26 @@ class GenericRPAConfig:
             platform: プラットフォーム名（base, shopify, rakuten, furusato, tabechoku）
             headless: ヘッドレスモードで実行するか
             user_id: ユーザーID（RLS用）
+            raw_data_retention: 解析結果のraw_dataの保持方法（none, hash, compressed, full）
+                未指定の場合は環境変数RPA_RAW_DATA_RETENTION（デフォルト: full）
+            skip_unchanged: 前回保存時から変更のない行のupsertをスキップするか
+                未指定の場合は環境変数RPA_SKIP_UNCHANGED（デフォルト: true）
+            persistence_backend: Supabaseへの保存方法（sync: supabase-py、async: httpxの非同期クライアント）
+                未指定の場合は環境変数RPA_PERSISTENCE_BACKEND（デフォルト: sync）
+            save_mode: 保存単位（rows: テーブルごとにupsert、rpc: save_order_graphs関数で注文ごとに1トランザクション）
+                未指定の場合は環境変数RPA_SAVE_MODE（デフォルト: rows）
         """
         self.login_url = login_url
         self.target_url = target_url
         self.platform = platform
         self.headless = headless
         self.user_id = user_id
+        self.raw_data_retention = raw_data_retention or os.getenv("RPA_RAW_DATA_RETENTION", "full")
+        if skip_unchanged is None:
+            skip_unchanged = os.getenv("RPA_SKIP_UNCHANGED", "true").lower() in ("1", "true", "yes")
+        self.skip_unchanged = skip_unchanged
+        self.persistence_backend = (persistence_backend or os.getenv("RPA_PERSISTENCE_BACKEND", "sync")).lower()
+        self.save_mode = (save_mode or os.getenv("RPA_SAVE_MODE", "rows")).lower()
         self.supabase_url = supabase_url or os.getenv("SUPABASE_URL")
         self.supabase_key = supabase_key or os.getenv("SUPABASE_KEY")
         
@@ -0,0 +1,107 @@
+"""
+顧客解決キャッシュ
+同じ同期処理の中で何度も現れるリピーターの顧客について、
+(顧客ID・メールアドレス) → (解決済みの顧客ID, 内容のハッシュ) をメモリに保持し、
+内容が変わっていない顧客のupsertを省略する
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from rpa.generic.fingerprint_index import FingerprintIndex, row_fingerprint
+
+
+class CustomerCache:
+    """サイズ上限・有効期限付きのLRUキャッシュ（任意でフィンガープリント索引を永続層として使う）"""
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        persistent_index: Optional[FingerprintIndex] = None
+    ):
+        """
+        初期化
+
+        Args:
+            max_size: 保持する最大件数（未指定の場合は環境変数RPA_CUSTOMER_CACHE_SIZE、デフォルト: 1000）
+            ttl: 有効期限（秒、環境変数RPA_CUSTOMER_CACHE_TTL、デフォルト: 600）
+            persistent_index: メモリにない場合に参照するフィンガープリント索引（前回までの実行で保存済みの顧客）
+        """
+        self.max_size = max_size or int(os.getenv("RPA_CUSTOMER_CACHE_SIZE", "1000"))
+        self.ttl = ttl or float(os.getenv("RPA_CUSTOMER_CACHE_TTL", "600"))
+        self.persistent_index = persistent_index
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _identities(customer_row: Dict[str, Any]) -> Tuple[str, ...]:
+        """顧客を識別するキー（顧客IDとメールアドレス）"""
+        keys = []
+        if customer_row.get("id"):
+            keys.append(f"id:{customer_row['id']}")
+        if customer_row.get("email"):
+            keys.append(f"email:{str(customer_row['email']).lower()}")
+        return tuple(keys)
+
+    def lookup(self, customer_row: Dict[str, Any]) -> Optional[str]:
+        """
+        内容が変わっていない保存済みの顧客であれば、解決済みの顧客IDを返す
+
+        Args:
+            customer_row: build_customer_row()で作成した行
+
+        Returns:
+            Optional[str]: 顧客ID（キャッシュにない・内容が変わった・期限切れの場合はNone）
+        """
+        fingerprint = row_fingerprint("customers", customer_row)
+        now = time.monotonic()
+        with self._lock:
+            for key in self._identities(customer_row):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                customer_id, cached_fingerprint, expires_at = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                if cached_fingerprint == fingerprint:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return customer_id
+
+        # メモリにない場合は永続層（前回までの実行で保存した内容）を確認
+        if self.persistent_index and customer_row.get("id") and not self.persistent_index.is_changed("customers", customer_row):
+            self.store(customer_row, str(customer_row["id"]), fingerprint)
+            self.hits += 1
+            return str(customer_row["id"])
+
+        self.misses += 1
+        return None
+
+    def store(self, customer_row: Dict[str, Any], customer_id: str, fingerprint: Optional[str] = None) -> None:
+        """
+        保存に成功した顧客をキャッシュに登録
+
+        Args:
+            customer_row: 保存した行
+            customer_id: Supabaseが返した顧客ID
+            fingerprint: 行のハッシュ（計算済みの場合）
+        """
+        fingerprint = fingerprint or row_fingerprint("customers", customer_row)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in self._identities(customer_row):
+                self._entries[key] = (customer_id, fingerprint, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """キャッシュを空にする"""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,308 @@
+"""
+Supabase保存済み行のフィンガープリント索引
+(SupabaseプロジェクトのURL, テーブル, ID) → 正規化した行のハッシュ をローカルのSQLiteに保持し、
+新規または変更のあった行だけをupsertするために使用する
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional, Iterable
+
+
+# ハッシュ対象の列（Supabaseのテーブル定義に合わせる）
+# job_idは実行ごとに変わるため対象外（内容が同じ注文は再送しない）
+TABLE_COLUMNS: Dict[str, tuple] = {
+    "customers": ("id", "name", "email", "phone", "postal_code", "address", "platform", "user_id"),
+    "orders": ("id", "order_number", "platform", "customer_id", "order_date", "status", "total_amount",
+               "payment_method", "shipping_fee", "tax", "user_id"),
+    "order_items": ("id", "order_id", "product_id", "product_name", "quantity", "unit", "price", "subtotal", "sku"),
+}
+
+
+def row_fingerprint(table: str, row: Dict[str, Any]) -> str:
+    """
+    行の内容からフィンガープリントを計算
+    数値は型（int/float）の違いを吸収し、Noneの列は無視する
+
+    Args:
+        table: テーブル名
+        row: 行データ
+
+    Returns:
+        str: SHA-1のハッシュ値
+    """
+    normalized = {}
+    for column in TABLE_COLUMNS.get(table, tuple(sorted(row))):
+        value = row.get(column)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = repr(float(value))
+        normalized[column] = value
+    serialized = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def supabase_scope(supabase_url: Optional[str]) -> str:
+    """
+    索引を分けるためのSupabaseプロジェクトの識別子（URLの表記ゆれを吸収）
+
+    Args:
+        supabase_url: SupabaseのURL
+
+    Returns:
+        str: 識別子（URLが未設定の場合は空文字）
+    """
+    return (supabase_url or "").strip().rstrip("/").lower()
+
+
+class FingerprintIndex:
+    """SQLiteに保存するフィンガープリント索引（Supabaseプロジェクトごとに分ける）"""
+
+    def __init__(self, db_path: Optional[str] = None, supabase_url: Optional[str] = None):
+        """
+        初期化
+
+        Args:
+            db_path: SQLiteファイルのパス（未指定の場合は環境変数RPA_FINGERPRINT_DB、デフォルト: fingerprints.sqlite3）
+            supabase_url: 保存先のSupabaseのURL（未指定の場合は環境変数SUPABASE_URL）
+                別のプロジェクト（作り直したプロジェクトなど）に保存した行は、このプロジェクトでは未保存として扱う
+        """
+        self.db_path = db_path or os.getenv("RPA_FINGERPRINT_DB", "fingerprints.sqlite3")
+        self.scope = supabase_scope(supabase_url or os.getenv("SUPABASE_URL"))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(fingerprints)").fetchall()]
+        if columns and "scope" not in columns:
+            # 以前の形式の索引はどのプロジェクトに保存した行か分からないため破棄する（次回は全行を送信する）
+            print("[FingerprintIndex] SupabaseのURLを含まない以前の索引を破棄します")
+            self._conn.execute("DROP TABLE fingerprints")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " scope TEXT NOT NULL,"
+            " table_name TEXT NOT NULL,"
+            " row_id TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (scope, table_name, row_id))"
+        )
+        self._conn.commit()
+
+    def filter_changed(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        新規または内容が変わった行だけを返す
+
+        Args:
+            table: テーブル名
+            rows: upsert予定の行（idを含む）
+
+        Returns:
+            List[Dict[str, Any]]: 送信が必要な行
+        """
+        if not rows:
+            return []
+        ids = [str(row["id"]) for row in rows]
+        known: Dict[str, str] = {}
+        with self._lock:
+            # SQLiteのパラメータ上限を超えないように分割して取得
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._conn.execute(
+                    f"SELECT row_id, hash FROM fingerprints WHERE scope = ? AND table_name = ? AND row_id IN ({placeholders})",
+                    [self.scope, table] + chunk
+                )
+                known.update(cursor.fetchall())
+        return [row for row in rows if known.get(str(row["id"])) != row_fingerprint(table, row)]
+
+    def is_changed(self, table: str, row: Dict[str, Any]) -> bool:
+        """
+        1行が新規または変更ありかどうか
+
+        Args:
+            table: テーブル名
+            row: upsert予定の行（idを含む）
+
+        Returns:
+            bool: 送信が必要な場合True
+        """
+        return bool(self.filter_changed(table, [row]))
+
+    def record(self, table: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        保存に成功した行のフィンガープリントを記録
+
+        Args:
+            table: テーブル名
+            rows: 保存した行（idを含む）
+        """
+        now = time.time()
+        values = [(self.scope, table, str(row["id"]), row_fingerprint(table, row), now) for row in rows if row.get("id") is not None]
+        if not values:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (scope, table_name, row_id, hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                values
+            )
+            self._conn.commit()
+
+    def known_ids(self, table: str, prefix: str) -> List[str]:
+        """
+        指定した接頭辞で始まる行IDを返す（注文に属する保存済みの注文商品の取得などに使用）
+
+        Args:
+            table: テーブル名
+            prefix: 行IDの接頭辞
+
+        Returns:
+            List[str]: 行IDのリスト
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT row_id FROM fingerprints WHERE scope = ? AND table_name = ? AND substr(row_id, 1, ?) = ?",
+                (self.scope, table, len(prefix), prefix)
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def forget(self, table: str, row_ids: Iterable[str]) -> None:
+        """
+        行のフィンガープリントを削除（次回は必ず送信される）
+
+        Args:
+            table: テーブル名
+            row_ids: 行IDのリスト
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM fingerprints WHERE scope = ? AND table_name = ? AND row_id = ?",
+                [(self.scope, table, str(row_id)) for row_id in row_ids]
+            )
+            self._conn.commit()
+
+    def clear(self, table: Optional[str] = None) -> None:
+        """
+        このプロジェクトの索引を削除
+
+        Args:
+            table: テーブル名（未指定の場合はすべて）
+        """
+        with self._lock:
+            if table:
+                self._conn.execute("DELETE FROM fingerprints WHERE scope = ? AND table_name = ?", (self.scope, table))
+            else:
+                self._conn.execute("DELETE FROM fingerprints WHERE scope = ?", (self.scope,))
+            self._conn.commit()
+
+    def rebuild_from_supabase(self, supabase, user_id: Optional[str] = None, page_size: int = 1000) -> Dict[str, int]:
+        """
+        Supabaseの現在の内容から索引を作り直す
+
+        Args:
+            supabase: SupabaseのClient
+            user_id: 指定した場合はそのユーザーの行のみ登録し直す（order_itemsはそのユーザーの注文に紐づくもの）
+                他のユーザーの行の索引は削除しない（Supabaseから削除された行の索引も残るため、削除を反映する場合は全体を作り直す）
+            page_size: 1回に取得する行数
+
+        Returns:
+            Dict[str, int]: テーブルごとの登録件数
+        """
+        counts = {}
+        order_ids: List[str] = []
+        for table, columns in TABLE_COLUMNS.items():
+            if not user_id:
+                self.clear(table)
+            counts[table] = 0
+            if user_id and table == "order_items":
+                # そのユーザーの注文IDで絞り込んで取得する（URLが長くなりすぎないように注文IDを分割する）
+                queries = [
+                    lambda chunk=order_ids[start:start + 100]: supabase.table(table).select(",".join(columns)).in_("order_id", chunk)
+                    for start in range(0, len(order_ids), 100)
+                ]
+            elif user_id:
+                queries = [lambda: supabase.table(table).select(",".join(columns)).eq("user_id", user_id)]
+            else:
+                queries = [lambda: supabase.table(table).select(",".join(columns))]
+            for query in queries:
+                for rows in self._fetch_pages(query, page_size):
+                    if table == "orders" and user_id:
+                        order_ids.extend(str(row["id"]) for row in rows)
+                    self.record(table, rows)
+                    counts[table] += len(rows)
+            print(f"[FingerprintIndex] {table}: {counts[table]}件のフィンガープリントを登録しました")
+        return counts
+
+    @staticmethod
+    def _fetch_pages(query, page_size: int):
+        """
+        クエリの結果をpage_size行ずつ取得する
+
+        Args:
+            query: 絞り込み済みのクエリビルダーを返す関数（ページごとに作り直す）
+            page_size: 1回に取得する行数
+
+        Yields:
+            List[Dict[str, Any]]: 1ページ分の行
+        """
+        start = 0
+        while True:
+            rows = query().range(start, start + page_size - 1).execute().data or []
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            start += page_size
+
+    def close(self) -> None:
+        """SQLite接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+_fingerprint_indexes: Dict[str, FingerprintIndex] = {}
+_fingerprint_index_lock = threading.Lock()
+
+
+def get_fingerprint_index(supabase_url: Optional[str] = None) -> FingerprintIndex:
+    """
+    プロセス共通のFingerprintIndexを取得（SupabaseのURLごと）
+
+    Args:
+        supabase_url: 保存先のSupabaseのURL（未指定の場合は環境変数SUPABASE_URL）
+
+    Returns:
+        FingerprintIndex: 共有インスタンス
+    """
+    scope = supabase_scope(supabase_url or os.getenv("SUPABASE_URL"))
+    with _fingerprint_index_lock:
+        if scope not in _fingerprint_indexes:
+            _fingerprint_indexes[scope] = FingerprintIndex(supabase_url=scope)
+        return _fingerprint_indexes[scope]
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv:
+        print("使用方法:")
+        print("  python -m rpa.generic.fingerprint_index --rebuild [--user-id ID]")
+        sys.exit(1)
+
+    from supabase import create_client
+    from rpa.utils.config_loader import get_supabase_config
+
+    user_id = None
+    for i, arg in enumerate(sys.argv):
+        if arg == "--user-id" and i + 1 < len(sys.argv):
+            user_id = sys.argv[i + 1]
+
+    supabase_config = get_supabase_config()
+    if not supabase_config["url"] or not supabase_config["key"]:
+        print("[FingerprintIndex] Supabaseの設定が見つかりません。環境変数を確認してください。")
+        sys.exit(1)
+
+    client = create_client(supabase_config["url"], supabase_config["key"])
+    get_fingerprint_index(supabase_config["url"]).rebuild_from_supabase(client, user_id=user_id)
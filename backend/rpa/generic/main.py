@@ -1,15 +1,87 @@
 """
 汎用RPA実行スクリプト
 """
-import sys
-import time
-import json
 import os
-from typing import Optional, Dict, Any
+import sys
+from typing import Optional, Dict, Any, List
 from rpa.generic.config import GenericRPAConfig
-from rpa.generic.scraper import GenericScraper
+from rpa.generic.scraper import GenericScraper, max_tabs
 from rpa.generic.parser import GenericParser
 from rpa.generic.supabase_client import GenericSupabaseClient
+from rpa.generic.order_export import get_order_exporter
+from rpa.utils.artifact_store import get_artifact_store
+from rpa.core.browser import is_driver_alive
+from rpa.core.telemetry import mark_recycled, recycle_requested
+from rpa.jobs.checkpoint import Checkpoint, STAGE_EXTRACTED, STAGE_LOGGED_IN, STAGE_SAVED, checkpoint_key
+from rpa.jobs.registry import JobCancelled, browser_close_timeout, cancelled_by_user, is_cancelled, raise_if_cancelled, report, wait_unless_cancelled
+
+
+def _save_parsed_data(
+    config: GenericRPAConfig,
+    parsed_data: Dict[str, Any],
+    platform: Optional[str],
+    user_id: Optional[str],
+    job_id: Optional[str]
+) -> Dict[str, int]:
+    """
+    解析済みの注文データをSupabaseに保存（RPA_PERSISTENCE_BACKENDに応じた保存方法を使う）
+    RPA_EXPORT_FORMATが設定されている場合は、保存できた注文を分析用のファイルの書き出し待ちに追加する
+    （単発の実行の行は他の実行の行とまとめて書き出す）
+    
+    Returns:
+        Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}
+    """
+    print("\n" + "="*60)
+    print("【ステップ4】Supabaseに保存します")
+    print("="*60)
+    
+    print(f"[Generic RPA] Platform: {platform}, User ID: {user_id}, Job ID: {job_id}")
+    if config.persistence_backend == "async":
+        from rpa.generic.async_supabase_client import save_order_data_blocking
+        saved_records = save_order_data_blocking(config, parsed_data, platform=platform, user_id=user_id, job_id=job_id)
+    else:
+        supabase_client = GenericSupabaseClient(config)
+        saved_records = supabase_client.save_order_data(parsed_data, platform=platform, user_id=user_id, job_id=job_id)
+    if saved_records.get("orders", 0) > 0:
+        get_order_exporter().add(parsed_data, platform=platform, user_id=user_id, job_id=job_id)
+    return saved_records
+
+
+def _saved_result(saved_records: Dict[str, int], job_id: Optional[str]) -> Dict[str, Any]:
+    """
+    保存結果から実行結果を作成
+    
+    Returns:
+        Dict[str, Any]: 実行結果 {success: bool, saved_records: Dict[str, int], message: str}
+    """
+    total_saved = sum(saved_records.values())
+    report(job_id, "rows_saved", f"{total_saved}件のレコードを保存しました", **saved_records)
+    if total_saved > 0:
+        print("\n" + "="*60)
+        print("【完了】汎用RPAの実行が正常に完了しました")
+        print("="*60)
+        print(f"✓ 保存レコード:")
+        print(f"  - 顧客: {saved_records['customers']}件")
+        print(f"  - 注文: {saved_records['orders']}件")
+        print(f"  - 商品: {saved_records['items']}件")
+        print("="*60)
+        print("ブラウザは開いたままです。結果を確認してから、手動で閉じてください。")
+        print("="*60 + "\n")
+        return {
+            "success": True,
+            "saved_records": saved_records,
+            "message": f"RPA実行が完了しました。保存レコード: 顧客={saved_records['customers']}, 注文={saved_records['orders']}, 商品={saved_records['items']}"
+        }
+    print("\n" + "="*60)
+    print("【エラー】汎用RPAの実行中にエラーが発生しました（データが保存されませんでした）")
+    print("="*60)
+    print("ブラウザは開いたままです。ページを確認して、問題を特定してください。")
+    print("="*60 + "\n")
+    return {
+        "success": False,
+        "saved_records": saved_records,
+        "message": "データが保存されませんでした"
+    }
 
 
 def run_generic_rpa(
@@ -24,6 +96,9 @@ def run_generic_rpa(
 ) -> Dict[str, Any]:
     """
     汎用RPAを実行
+    ログイン後・データ取得後にチェックポイントを記録し、ブラウザがクラッシュした場合は起動し直して続きから実行する
+    前回の同じ実行がデータ取得後にクラッシュ・エラー・制限時間の超過で中断していた場合は、ブラウザを起動せずに取得済みのデータを保存する
+    （ユーザーがキャンセルした実行のチェックポイントは削除するため再開しない）
     
     Args:
         login_url: ログイン後のURL（クッキーが有効な状態）
@@ -47,6 +122,7 @@ def run_generic_rpa(
     print("="*60)
     
     scraper = None
+    checkpoint = None
     try:
         # 1. 設定の初期化
         config = GenericRPAConfig(
@@ -67,14 +143,23 @@ def run_generic_rpa(
                 "message": "設定の検証に失敗しました"
             }
         
+        checkpoint = Checkpoint(checkpoint_key("generic", user_id, platform, config.login_url, config.target_url), job_id)
+        if checkpoint.stage == STAGE_EXTRACTED and checkpoint.state.get("parsed_data"):
+            # 前回はデータの取得後に中断したため、取得済みのデータを保存する
+            print("[Generic RPA] 前回取得したデータを保存します（ブラウザは起動しません）")
+            saved_records = _save_parsed_data(config, checkpoint.state["parsed_data"], platform, user_id, job_id)
+            checkpoint.clear()
+            return _saved_result(saved_records, job_id)
+        
         # 2. スクレイパーの起動（可視化のため、ヘッドレスモードは強制的にfalse）
         # ユーザーがブラウザの動作を見られるようにする
         actual_headless = False  # 可視化のため、常にfalseにする
         if headless:
             print("[Generic RPA] ⚠ ヘッドレスモードが指定されましたが、可視化のためブラウザを表示します")
         
-        scraper = GenericScraper(headless=actual_headless)
+        scraper = GenericScraper(headless=actual_headless, job_id=job_id)
         scraper.start()
+        report(job_id, "driver_ready", "ブラウザを起動しました")
         
         print("\n" + "="*60)
         print("【RPA実行開始】ブラウザが開きました")
@@ -85,17 +170,43 @@ def run_generic_rpa(
         print("3. データを取得してSupabaseに保存")
         print("="*60 + "\n")
         
-        # 3. ログイン後URLに移動し、ユーザーがログインするまで待機（120秒）
-        if not scraper.navigate_to_login(config.login_url, wait_time=120):
+        # 3. ログイン後URLに移動し、ユーザーがログインするまで待機（環境変数RPA_LOGIN_TIMEOUT、デフォルト: 120秒）
+        login_wait = int(os.getenv("RPA_LOGIN_TIMEOUT", "120"))
+        if not scraper.navigate_to_login(config.login_url, wait_time=login_wait):
             print("[Generic RPA] ✗ ログイン後URLへの移動に失敗しました")
             return {
                 "success": False,
                 "saved_records": {"customers": 0, "orders": 0, "items": 0},
                 "message": "ログイン後URLへの移動に失敗しました"
             }
+        report(job_id, "login_detected", "ログイン後URLに移動しました")
+        scraper.save_session()
+        checkpoint.mark(STAGE_LOGGED_IN)
+        raise_if_cancelled(job_id)
         
-        # 4. ターゲットURLに移動
-        if not scraper.navigate_to_target(config.target_url):
+        # 4-5. ターゲットURLに移動してJSONデータを抽出（ブラウザがクラッシュした場合は起動し直してやり直す）
+        navigation = {"ok": False}
+        
+        def navigate_and_extract():
+            # 4. ターゲットURLに移動
+            navigation["ok"] = scraper.navigate_to_target(config.target_url)
+            if not navigation["ok"]:
+                return None
+            
+            # 5. JSONデータを抽出（プラットフォームに応じた抽出方法を使用）
+            print("\n" + "="*60)
+            print("【ステップ3】データを取得します")
+            print("="*60)
+            
+            # BASEの場合は専用の抽出ロジックを使用
+            if platform == "base":
+                return scraper.extract_base_order_json(config.target_url)
+            return GenericParser(scraper.driver, raw_data_retention=config.raw_data_retention).extract_json_from_page(platform=platform)
+        
+        json_data = scraper.run_with_recovery(navigate_and_extract, config.login_url, login_wait)
+        parser = GenericParser(scraper.driver, raw_data_retention=config.raw_data_retention)
+        
+        if not navigation["ok"]:
             print("[Generic RPA] ✗ ターゲットURLへの移動に失敗しました")
             return {
                 "success": False,
@@ -103,26 +214,13 @@ def run_generic_rpa(
                 "message": "ターゲットURLへの移動に失敗しました"
             }
         
-        # 5. JSONデータを抽出（プラットフォームに応じた抽出方法を使用）
-        print("\n" + "="*60)
-        print("【ステップ3】データを取得します")
-        print("="*60)
-        
-        parser = GenericParser(scraper.driver)
-        
-        # BASEの場合は専用の抽出ロジックを使用
-        if platform == "base":
-            json_data = scraper.extract_base_order_json(config.target_url)
-        else:
-            json_data = parser.extract_json_from_page(platform=platform)
-        
         if not json_data:
             print("[Generic RPA] ページからJSONデータを取得できませんでした")
             print("[Generic RPA] ページのソースを確認してください")
-            # デバッグ用にページソースを保存
-            with open("debug_page_source.html", "w", encoding="utf-8") as f:
-                f.write(scraper.get_page_source())
-            print("[Generic RPA] ページソースを debug_page_source.html に保存しました")
+            # デバッグ用にページソースを保存（job_id単位で圧縮、書き込みはバックグラウンド）
+            artifact_path = get_artifact_store().save_text(job_id, "page_source.html", scraper.get_page_source())
+            if artifact_path:
+                print(f"[Generic RPA] ページソースを {artifact_path} に保存しました")
             return {
                 "success": False,
                 "saved_records": {"customers": 0, "orders": 0, "items": 0},
@@ -132,13 +230,10 @@ def run_generic_rpa(
         print("[Generic RPA] JSONデータの抽出が完了しました")
         print(f"[Generic RPA] 取得したJSONデータ（最初の500文字）: {str(json_data)[:500]}")
         
-        # デバッグ用にJSONデータをファイルに保存
-        debug_dir = "debug_json"
-        os.makedirs(debug_dir, exist_ok=True)
-        debug_file = os.path.join(debug_dir, f"order_data_{int(time.time())}.json")
-        with open(debug_file, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
-        print(f"[Generic RPA] JSONデータを {debug_file} に保存しました")
+        # デバッグ用にJSONデータを保存（サンプリング対象、書き込みはバックグラウンド）
+        artifact_path = get_artifact_store().save_json(job_id, "order_data", json_data)
+        if artifact_path:
+            print(f"[Generic RPA] JSONデータを {artifact_path} に保存します")
         
         # 6. JSONデータを解析
         parsed_data = parser.parse_base_order_json(json_data)
@@ -147,44 +242,30 @@ def run_generic_rpa(
         print(f"  - 顧客情報: {parsed_data.get('customer', {})}")
         print(f"  - 注文情報: {parsed_data.get('order', {})}")
         print(f"  - 商品数: {len(parsed_data.get('order_items', []))}")
+        report(
+            job_id, "orders_extracted", "注文データを取得しました",
+            orders=1 if parsed_data.get("order") else 0, items=len(parsed_data.get("order_items", []))
+        )
+        # 保存前に中断した場合は、次の実行でブラウザを使わずに保存する
+        checkpoint.mark(STAGE_EXTRACTED, parsed_data=parsed_data)
+        raise_if_cancelled(job_id)
         
-        # 7. Supabaseに保存
-        print("\n" + "="*60)
-        print("【ステップ4】Supabaseに保存します")
-        print("="*60)
-        
-        supabase_client = GenericSupabaseClient(config)
-        print(f"[Generic RPA] Platform: {platform}, User ID: {user_id}, Job ID: {job_id}")
-        saved_records = supabase_client.save_order_data(parsed_data, platform=platform, user_id=user_id, job_id=job_id)
+        # 7. Supabaseに保存（保存できなかった行はスプールから再送されるため、チェックポイントは削除する）
+        saved_records = _save_parsed_data(config, parsed_data, platform, user_id, job_id)
+        checkpoint.clear()
+        return _saved_result(saved_records, job_id)
         
-        total_saved = sum(saved_records.values())
-        if total_saved > 0:
-            print("\n" + "="*60)
-            print("【完了】汎用RPAの実行が正常に完了しました")
-            print("="*60)
-            print(f"✓ 保存レコード:")
-            print(f"  - 顧客: {saved_records['customers']}件")
-            print(f"  - 注文: {saved_records['orders']}件")
-            print(f"  - 商品: {saved_records['items']}件")
-            print("="*60)
-            print("ブラウザは開いたままです。結果を確認してから、手動で閉じてください。")
-            print("="*60 + "\n")
-            return {
-                "success": True,
-                "saved_records": saved_records,
-                "message": f"RPA実行が完了しました。保存レコード: 顧客={saved_records['customers']}, 注文={saved_records['orders']}, 商品={saved_records['items']}"
-            }
-        else:
-            print("\n" + "="*60)
-            print("【エラー】汎用RPAの実行中にエラーが発生しました（データが保存されませんでした）")
-            print("="*60)
-            print("ブラウザは開いたままです。ページを確認して、問題を特定してください。")
-            print("="*60 + "\n")
-            return {
-                "success": False,
-                "saved_records": saved_records,
-                "message": "データが保存されませんでした"
-            }
+    except JobCancelled as e:
+        print(f"\n[Generic RPA] ジョブがキャンセルされました: {e}")
+        if checkpoint and cancelled_by_user(job_id):
+            # ユーザーがキャンセルした実行は再開しない（次の実行で取得済みの古いデータを保存しないようにする）
+            # 制限時間の超過で中断した実行はチェックポイントを残し、次の実行で続きから処理する
+            checkpoint.clear()
+        return {
+            "success": False,
+            "saved_records": {"customers": 0, "orders": 0, "items": 0},
+            "message": f"ジョブがキャンセルされました: {e}"
+        }
         
     except KeyboardInterrupt:
         print("\n[Generic RPA] ユーザーによって中断されました")
@@ -205,6 +286,12 @@ def run_generic_rpa(
         }
         
     finally:
+        if scraper and scraper.driver and is_cancelled(job_id):
+            # キャンセルされたジョブはブラウザを閉じて解放する
+            try:
+                scraper.close()
+            except Exception:
+                scraper.driver = None
         if scraper and scraper.driver:
             # 可視化のため、常にブラウザを開いたままにする
             print("\n" + "="*60)
@@ -214,16 +301,25 @@ def run_generic_rpa(
             print("結果を確認してから、手動でブラウザを閉じてください。")
             print("="*60 + "\n")
             
-            # ブラウザが閉じられるまで待機（最大10分）
+            # ブラウザが閉じられるまで待機（RPA_BROWSER_CLOSE_TIMEOUT、キャンセルされたら終了）
+            close_timeout = browser_close_timeout()
+            report(job_id, "waiting_for_browser", f"ブラウザが閉じられるまで待機しています（最大{close_timeout}秒）")
             try:
-                print("[Generic RPA] ブラウザが閉じられるまで待機します（最大10分）...")
-                for i in range(600):
+                print(f"[Generic RPA] ブラウザが閉じられるまで待機します（最大{close_timeout}秒）...")
+                for i in range(close_timeout):
                     try:
                         scraper.driver.current_url
                         if i % 60 == 0 and i > 0:  # 1分ごとに表示
-                            remaining_minutes = (600 - i) // 60
+                            remaining_minutes = (close_timeout - i) // 60
                             print(f"[Generic RPA] ブラウザは開いています... あと約{remaining_minutes}分待機します")
-                        time.sleep(1)
+                        if wait_unless_cancelled(job_id, 1):
+                            break
+                        if recycle_requested(job_id):
+                            # 確認用に開いているだけのブラウザは、メモリ使用量などの上限を超えたら閉じる
+                            print("[Generic RPA] ブラウザのリソース使用量が上限を超えたため、ブラウザを閉じます。")
+                            scraper.close()
+                            mark_recycled(job_id)
+                            break
                     except:
                         print("[Generic RPA] ✓ ブラウザが閉じられました。")
                         break
@@ -231,6 +327,260 @@ def run_generic_rpa(
                 pass
 
 
+def run_generic_rpa_batch(
+    login_url: str,
+    target_urls: List[str],
+    headless: bool = False,
+    platform: Optional[str] = None,
+    user_id: Optional[str] = None,
+    job_id: Optional[str] = None,
+    unattended: bool = False
+) -> Dict[str, Any]:
+    """
+    1つのブラウザ（1回のログイン）で複数のターゲットURLからデータを取得して保存
+    保存は書き込みキューでまとめて行い、最後にブラウザを閉じる
+    ターゲットURLは同じブラウザの最大RPA_MAX_TABS個（デフォルト: 4）のタブで並行して読み込む
+    ブラウザのメモリ使用量などが上限を超えた場合は、URLの間でセッションを復元したブラウザに起動し直す
+    RPA_CHECKPOINT_EVERY件（デフォルト: 10）のURLごとに保存を完了してチェックポイントを記録し、
+    クラッシュ・エラー・制限時間の超過で中断した場合は次の実行で保存済みのURLを飛ばして続きから処理する（ユーザーがキャンセルした場合は最初から）
+    ブラウザがクラッシュした場合は起動し直し、同じURLからやり直す
+    
+    Args:
+        login_url: ログイン後のURL
+        target_urls: データ取得対象のURLのリスト
+        headless: ヘッドレスモードで実行するか
+        platform: プラットフォーム名（base, shopify, rakuten, furusato, tabechoku）
+        user_id: ユーザーID（RLS用）
+        job_id: RPA実行ジョブID
+        unattended: 定期実行など操作する人がいない実行か（Trueの場合は手動ログインを待機しない）
+    
+    Returns:
+        Dict[str, Any]: 実行結果 {success: bool, saved_records: Dict[str, int], failed_targets: List[str], message: str}
+    """
+    saved_records = {"customers": 0, "orders": 0, "items": 0}
+    failed_targets: List[str] = []
+    # 保存済みのURL（チェックポイントに記録済み）と、前回のチェックポイント以降に保存したURL
+    done_targets: List[str] = []
+    processed_targets: List[str] = []
+    scraper = None
+    supabase_client = None
+    checkpoint = None
+    # 書き込みキューに積んだ注文（書き込みが完了してから分析用のファイルの書き出し待ちに追加する）
+    pending_exports: List[Dict[str, Any]] = []
+    
+    def export_saved() -> None:
+        # 書き込みが完了した注文のうち、書き込みに失敗しなかったものを分析用のファイルの書き出し待ちに追加する
+        if supabase_client.write_queue is not None and supabase_client.write_queue.pending():
+            return
+        for parsed_data in pending_exports:
+            order_id = (parsed_data.get("order") or {}).get("order_id")
+            if order_id and str(order_id) not in supabase_client.failed_order_ids:
+                get_order_exporter().add(parsed_data, platform=platform, user_id=user_id, job_id=job_id, batch=True)
+        pending_exports.clear()
+    
+    try:
+        config = GenericRPAConfig(
+            login_url=login_url,
+            target_url=target_urls[0],
+            platform=platform,
+            headless=headless,
+            user_id=user_id
+        )
+        
+        checkpoint = Checkpoint(checkpoint_key("generic_batch", user_id, platform, login_url, list(target_urls)), job_id)
+        done_targets = list(checkpoint.state.get("done_targets") or [])
+        pending_targets = [target_url for target_url in target_urls if target_url not in done_targets]
+        if not pending_targets:
+            checkpoint.clear()
+            return {
+                "success": True,
+                "saved_records": saved_records,
+                "failed_targets": failed_targets,
+                "message": f"{len(target_urls)}件のURLはすべて前回の実行で保存済みです"
+            }
+        # 保存を完了してチェックポイントを記録する間隔（URL数、環境変数RPA_CHECKPOINT_EVERY、デフォルト: 10）
+        checkpoint_every = max(1, int(os.getenv("RPA_CHECKPOINT_EVERY", "10")))
+        
+        scraper = GenericScraper(headless=headless, job_id=job_id)
+        scraper.start()
+        report(job_id, "driver_ready", "ブラウザを起動しました", targets=len(target_urls))
+        
+        # 操作する人がいない実行は、ログイン後URLのクッキーが切れていても手動ログインを待たない
+        login_wait = 0 if unattended else int(os.getenv("RPA_LOGIN_TIMEOUT", "120"))
+        if not scraper.navigate_to_login(config.login_url, wait_time=login_wait):
+            return {
+                "success": False,
+                "saved_records": saved_records,
+                "failed_targets": list(target_urls),
+                "message": "ログイン後URLへの移動に失敗しました"
+            }
+        report(job_id, "login_detected", "ログイン後URLに移動しました")
+        scraper.save_session()
+        checkpoint.mark(STAGE_LOGGED_IN)
+        
+        parser = GenericParser(scraper.driver, raw_data_retention=config.raw_data_retention)
+        if config.persistence_backend != "async":
+            supabase_client = GenericSupabaseClient(config)
+        
+        fetched_targets: List[str] = []
+        
+        def save_target(target_url: str, json_data: Optional[Dict[str, Any]]) -> None:
+            # 取得したデータを保存し、進捗とチェックポイントを記録する
+            fetched_targets.append(target_url)
+            try:
+                if not json_data:
+                    print(f"[Generic RPA] ページからJSONデータを取得できませんでした: {target_url}")
+                    failed_targets.append(target_url)
+                else:
+                    get_artifact_store().save_json(job_id, "order_data", json_data)
+                    parsed_data = parser.parse_base_order_json(json_data)
+                    if supabase_client:
+                        # 書き込みキューに積み、バッチでまとめて保存する
+                        if supabase_client.enqueue_order_data(parsed_data, platform=platform, user_id=user_id, job_id=job_id):
+                            pending_exports.append(parsed_data)
+                        else:
+                            failed_targets.append(target_url)
+                    else:
+                        from rpa.generic.async_supabase_client import save_order_data_blocking
+                        saved = save_order_data_blocking(config, parsed_data, platform=platform, user_id=user_id, job_id=job_id)
+                        for key in saved_records:
+                            saved_records[key] += saved[key]
+                        # 分析用のファイルへの書き出し（RPA_EXPORT_FORMATが設定されている場合、バッチの終了時にまとめて書き出す）
+                        if saved["orders"] > 0:
+                            get_order_exporter().add(parsed_data, platform=platform, user_id=user_id, job_id=job_id, batch=True)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"[Generic RPA] ターゲットURLの処理エラー ({target_url}): {e}")
+                import traceback
+                traceback.print_exc()
+                failed_targets.append(target_url)
+            targets_done = len(done_targets) + len(fetched_targets)
+            report(
+                job_id, "target_done", f"{targets_done}/{len(target_urls)}件のURLを処理しました",
+                targets=len(target_urls), targets_done=targets_done, failed=len(failed_targets)
+            )
+            if target_url not in failed_targets:
+                processed_targets.append(target_url)
+            if len(processed_targets) >= checkpoint_every:
+                # ここまでの保存を完了してから保存済みのURLを記録する
+                if supabase_client:
+                    supabase_client.flush_writes()
+                    export_saved()
+                done_targets.extend(processed_targets)
+                processed_targets.clear()
+                checkpoint.mark(STAGE_SAVED, done_targets=done_targets)
+        
+        def extract_loaded(target_url: str) -> Optional[Dict[str, Any]]:
+            # 読み込み済みのページ（現在のタブ）からJSONデータを抽出
+            if platform == "base":
+                return scraper.extract_base_order_json(target_url)
+            return GenericParser(scraper.driver, raw_data_retention=config.raw_data_retention).extract_json_from_page(platform=platform)
+        
+        if max_tabs() > 1 and len(pending_targets) > 1:
+            # 同じブラウザの複数のタブで並行して読み込む（ブラウザを追加で起動しない）
+            try:
+                while True:
+                    remaining_targets = [target_url for target_url in pending_targets if target_url not in fetched_targets]
+                    for target_url, json_data in scraper.fetch_in_tabs(remaining_targets, extract_loaded):
+                        save_target(target_url, json_data)
+                    # リソース使用量の上限で中断した場合は、ブラウザを起動し直して残りのURLを読み込む
+                    if len(fetched_targets) == len(pending_targets) or not scraper.recycle_if_requested(config.login_url, login_wait):
+                        break
+            except JobCancelled:
+                raise
+            except Exception as e:
+                if is_driver_alive(scraper.driver):
+                    raise
+                # ブラウザがクラッシュした場合は、残りのURLを1件ずつ（起動し直して）取得する
+                print(f"[Generic RPA] タブでの読み込み中にブラウザがクラッシュしました。残りのURLは1件ずつ取得します: {e}")
+        
+        for target_url in pending_targets:
+            if target_url in fetched_targets:
+                continue
+            raise_if_cancelled(job_id)
+            scraper.recycle_if_requested(config.login_url, login_wait)
+            print(f"[Generic RPA] ({len(done_targets) + len(fetched_targets) + 1}/{len(target_urls)}) {target_url}")
+            
+            def navigate_and_extract():
+                if not scraper.navigate_to_target(target_url):
+                    return None
+                return extract_loaded(target_url)
+            
+            try:
+                # ブラウザがクラッシュした場合は起動し直して同じURLからやり直す
+                json_data = scraper.run_with_recovery(navigate_and_extract, config.login_url, login_wait)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"[Generic RPA] ターゲットURLの処理エラー ({target_url}): {e}")
+                import traceback
+                traceback.print_exc()
+                json_data = None
+            save_target(target_url, json_data)
+        
+        if supabase_client:
+            saved_records = supabase_client.flush_writes()
+        report(job_id, "rows_saved", f"{sum(saved_records.values())}件のレコードを保存しました", **saved_records)
+        if failed_targets:
+            # 失敗したURLだけを次の実行でやり直せるように、保存済みのURLを記録しておく
+            done_targets.extend(processed_targets)
+            checkpoint.mark(STAGE_SAVED, done_targets=done_targets)
+        else:
+            checkpoint.clear()
+        
+        return {
+            "success": len(failed_targets) < len(target_urls),
+            "saved_records": saved_records,
+            "failed_targets": failed_targets,
+            "message": f"{len(target_urls) - len(failed_targets)}/{len(target_urls)}件のURLからデータを保存しました。保存レコード: 顧客={saved_records['customers']}, 注文={saved_records['orders']}, 商品={saved_records['items']}"
+        }
+    
+    except JobCancelled as e:
+        print(f"\n[Generic RPA] ジョブがキャンセルされました: {e}")
+        if checkpoint and cancelled_by_user(job_id):
+            # ユーザーがキャンセルした実行は再開しない（次の実行で取得済みの古いデータを保存しないようにする）
+            checkpoint.clear()
+            checkpoint = None
+        if supabase_client:
+            # 取得済みの注文は保存しておく
+            saved_records = supabase_client.flush_writes()
+        if checkpoint and processed_targets:
+            # 制限時間の超過で中断した実行は、ここまでに保存したURLを記録し、次の実行で続きから処理する
+            done_targets.extend(processed_targets)
+            checkpoint.mark(STAGE_SAVED, done_targets=done_targets)
+        return {
+            "success": False,
+            "saved_records": saved_records,
+            "failed_targets": failed_targets,
+            "message": f"ジョブがキャンセルされました: {e}"
+        }
+    
+    except Exception as e:
+        print(f"\n[Generic RPA] エラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "success": False,
+            "saved_records": saved_records,
+            "failed_targets": failed_targets,
+            "message": f"エラーが発生しました: {str(e)}"
+        }
+    
+    finally:
+        if supabase_client:
+            supabase_client.close()
+            export_saved()
+        # このバッチで追加した行のみを書き出す（他のジョブの書き出し待ちの行は書き出さない）
+        get_order_exporter().flush(job_id)
+        if scraper and scraper.driver:
+            # バッチ実行では結果の確認を待たずにブラウザを閉じ、次のグループに枠を空ける
+            try:
+                scraper.close()
+            except Exception:
+                scraper.driver = None
+
+
 if __name__ == "__main__":
     # コマンドライン引数からパラメータを取得
     login_url = None
@@ -257,6 +607,7 @@ if __name__ == "__main__":
         target_url=target_url,
         headless=headless
     )
+    get_order_exporter().flush()
     
     sys.exit(0 if success else 1)
 
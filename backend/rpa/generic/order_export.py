@@ -0,0 +1,260 @@
+"""
+保存した注文の分析用エクスポート（Parquet / CSV）
+保存ステージの副出力として、注文と注文商品を列指向のファイルにまとめて書き出す
+分析ではPostgRESTで1行ずつページングせずに、書き出したファイルをまとめて読み込める（DuckDB・pandas・pyarrow.datasetなど）
+
+出力先: <RPA_EXPORT_DIR>/<orders|order_items>/<job=...|date=YYYY-MM-DD>/part-<時刻>-<連番>.<parquet|csv>
+"""
+import csv
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrowは任意依存（未インストールの場合はCSVで書き出す）
+    pyarrow = None
+
+from rpa.generic.records import Order, OrderItem
+
+
+# 列の定義（数値列はfloatに揃え、それ以外は文字列として書き出す）
+ORDER_COLUMNS: Tuple[str, ...] = Order.__slots__ + ("exported_at",)
+ORDER_ITEM_COLUMNS: Tuple[str, ...] = OrderItem.__slots__ + ("platform", "order_date", "user_id", "job_id", "exported_at")
+NUMERIC_COLUMNS = frozenset(("total_amount", "shipping_fee", "tax", "quantity", "price", "subtotal"))
+TABLE_COLUMNS = {"orders": ORDER_COLUMNS, "order_items": ORDER_ITEM_COLUMNS}
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """数値列の値をfloatに変換（"1,200円"のような文字列も数字部分を使う、変換できない場合はNone）"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    digits = re.sub(r"[^0-9.\-]", "", str(value))
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+def _normalize(row: Dict[str, Any], columns: Tuple[str, ...]) -> Dict[str, Any]:
+    """列の型を揃える（Parquetのスキーマを注文ごとに変えない）"""
+    return {
+        column: _to_float(row.get(column)) if column in NUMERIC_COLUMNS else (None if row.get(column) is None else str(row.get(column)))
+        for column in columns
+    }
+
+
+class OrderExporter:
+    """注文・注文商品を列指向のファイルに書き出す（書き込みはバックグラウンドスレッドで行う）"""
+
+    def __init__(
+        self,
+        base_dir: Optional[str] = None,
+        file_format: Optional[str] = None,
+        partition: Optional[str] = None,
+        chunk_rows: Optional[int] = None,
+        flush_interval: Optional[float] = None
+    ):
+        """
+        初期化
+
+        Args:
+            base_dir: 出力先ディレクトリ（未指定の場合は環境変数RPA_EXPORT_DIR、デフォルト: exports）
+            file_format: 形式（parquet, csv, off、未指定の場合は環境変数RPA_EXPORT_FORMAT、デフォルト: off = 書き出さない）
+                parquetでpyarrowがインストールされていない場合はcsv
+            partition: ファイルの分け方（job = ジョブごと, date = 注文日ごと、未指定の場合は環境変数RPA_EXPORT_PARTITION、デフォルト: job）
+            chunk_rows: 1ファイルの最大行数（未指定の場合は環境変数RPA_EXPORT_CHUNK_ROWS、デフォルト: 5000）
+            flush_interval: 単発の実行の行をまとめて書き出すまでの最大待機時間
+                （秒、未指定の場合は環境変数RPA_EXPORT_FLUSH_INTERVAL、デフォルト: 300）
+        """
+        self.base_dir = base_dir or os.getenv("RPA_EXPORT_DIR", "exports")
+        file_format = (file_format or os.getenv("RPA_EXPORT_FORMAT", "off")).lower()
+        if file_format == "parquet" and pyarrow is None:
+            print("[OrderExport] pyarrowがインストールされていないため、CSVで書き出します")
+            file_format = "csv"
+        self.file_format = file_format
+        self.partition = (partition or os.getenv("RPA_EXPORT_PARTITION", "job")).lower()
+        self.chunk_rows = chunk_rows or int(os.getenv("RPA_EXPORT_CHUNK_ROWS", "5000"))
+        self.flush_interval = flush_interval or float(os.getenv("RPA_EXPORT_FLUSH_INTERVAL", "300"))
+        # 書き出し待ちの行: (書き出すジョブのID（単発の実行で共有する場合はNone）, テーブル名, パーティション) → 行のリスト
+        self._buffers: Dict[Tuple[Optional[str], str, str], List[Dict[str, Any]]] = {}
+        # 共有の書き出し待ちに最初の行を追加した時刻
+        self._shared_since: Optional[float] = None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._sequence = 0
+
+    @property
+    def enabled(self) -> bool:
+        """書き出すか"""
+        return self.file_format in ("parquet", "csv")
+
+    def add(
+        self,
+        parsed_data: Dict[str, Any],
+        platform: Optional[str] = None,
+        user_id: Optional[str] = None,
+        job_id: Optional[str] = None,
+        batch: bool = False
+    ) -> bool:
+        """
+        Supabaseに保存した注文データを書き出し待ちに追加（chunk_rows行たまったパーティションはファイルに書き出す）
+
+        Args:
+            parsed_data: parse_base_order_json()で解析されたデータ
+            platform: プラットフォーム名
+            user_id: ユーザーID
+            job_id: RPA実行ジョブID
+            batch: Trueの場合はジョブの終了時にflush(job_id)で書き出す
+                Falseの場合（単発の実行）は他の実行の行とまとめ、flush_interval秒ごとにまとめて書き出す
+
+        Returns:
+            bool: 追加した場合True（無効な場合・注文IDがない場合はFalse）
+        """
+        if not self.enabled or not parsed_data.get("order"):
+            return False
+        customer = parsed_data.get("customer") or {}
+        order = Order.from_dict(parsed_data["order"], customer.get("id") or customer.get("email"), platform, user_id, job_id)
+        if order is None:
+            return False
+        exported_at = datetime.now().isoformat()
+        order_row = {column: getattr(order, column) for column in Order.__slots__}
+        order_row["exported_at"] = exported_at
+        item_rows = []
+        for item in OrderItem.list_from_dicts(parsed_data.get("order_items") or [], order.id):
+            item_row = {column: getattr(item, column) for column in OrderItem.__slots__}
+            item_row.update(platform=order.platform, order_date=order.order_date, user_id=order.user_id, job_id=order.job_id, exported_at=exported_at)
+            item_rows.append(item_row)
+
+        partition = self._partition_name(order)
+        owner = job_id if batch else None
+        with self._lock:
+            for table, rows in (("orders", [order_row]), ("order_items", item_rows)):
+                if not rows:
+                    continue
+                buffer = self._buffers.setdefault((owner, table, partition), [])
+                buffer.extend(_normalize(row, TABLE_COLUMNS[table]) for row in rows)
+                if len(buffer) >= self.chunk_rows:
+                    self._submit(table, partition, self._buffers.pop((owner, table, partition)))
+            if not batch and self._shared_since is None:
+                self._shared_since = time.time()
+            self._ensure_thread()
+        return True
+
+    def flush(self, job_id: Optional[str] = None, timeout: float = 30.0) -> None:
+        """
+        書き出し待ちの行をファイルに書き出す
+
+        Args:
+            job_id: 指定した場合はそのジョブがadd(batch=True)で追加した行のみ（バッチの終了時）、
+                未指定の場合は単発の実行の行も含めてすべて（プロセスの終了時）
+            timeout: 最大待機時間（秒）
+        """
+        with self._lock:
+            for key in [key for key in self._buffers if job_id is None or key[0] == job_id]:
+                self._submit(key[1], key[2], self._buffers.pop(key))
+            if job_id is None:
+                self._shared_since = None
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def _partition_name(self, order: Order) -> str:
+        """注文を書き出すパーティションのディレクトリ名（Hive形式、ファイル内の列名と重ならない job= / date=）"""
+        if self.partition == "date":
+            date = str(order.order_date or "")[:10].replace("/", "-")
+            if not _DATE.match(date):
+                date = "unknown"
+            return f"date={date}"
+        return f"job={self._safe_name(order.job_id or 'no_job')}"
+
+    def _submit(self, table: str, partition: str, rows: List[Dict[str, Any]]) -> None:
+        """1ファイル分の行を書き込みスレッドに渡す（_lockを保持した状態で呼び出す）"""
+        self._sequence += 1
+        extension = "parquet" if self.file_format == "parquet" else "csv"
+        path = os.path.join(self.base_dir, table, partition, f"part-{int(time.time() * 1000)}-{self._sequence:05d}.{extension}")
+        self._ensure_thread()
+        self._queue.put((path, table, rows))
+
+    def _ensure_thread(self) -> None:
+        """書き込みスレッドを起動（_lockを保持した状態で呼び出す）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="order-export-writer", daemon=True)
+            self._thread.start()
+
+    def _flush_shared(self) -> None:
+        """単発の実行の行がflush_interval秒以上たまっていれば書き出す"""
+        with self._lock:
+            if self._shared_since is None or time.time() - self._shared_since < self.flush_interval:
+                return
+            for key in [key for key in self._buffers if key[0] is None]:
+                self._submit(key[1], key[2], self._buffers.pop(key))
+            self._shared_since = None
+
+    def _run(self) -> None:
+        """書き込みスレッドのメインループ（書き出すファイルがない間は、単発の実行の行の待機時間を確認する）"""
+        while True:
+            try:
+                path, table, rows = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                self._flush_shared()
+                continue
+            try:
+                self._write(path, table, rows)
+            except Exception as e:
+                print(f"[OrderExport] 書き出しエラー ({path}): {e}")
+                import traceback
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: str, table: str, rows: List[Dict[str, Any]]) -> None:
+        """行をファイルに書き出す（一時ファイルに書いてから置き換え、読み込み側に書きかけのファイルを見せない）"""
+        columns = TABLE_COLUMNS[table]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        if self.file_format == "parquet":
+            schema = pyarrow.schema([
+                (column, pyarrow.float64() if column in NUMERIC_COLUMNS else pyarrow.string()) for column in columns
+            ])
+            arrays = [pyarrow.array([row[column] for row in rows], type=schema.field(column).type) for column in columns]
+            pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, schema=schema), tmp_path)
+        else:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        os.replace(tmp_path, path)
+        print(f"[OrderExport] {len(rows)}行を書き出しました: {path}")
+
+    @staticmethod
+    def _safe_name(name: str) -> str:
+        """ディレクトリ名に使えない文字を置換"""
+        return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+
+
+_order_exporter: Optional[OrderExporter] = None
+_order_exporter_lock = threading.Lock()
+
+
+def get_order_exporter() -> OrderExporter:
+    """
+    プロセス共通のOrderExporterを取得
+
+    Returns:
+        OrderExporter: 共有インスタンス
+    """
+    global _order_exporter
+    with _order_exporter_lock:
+        if _order_exporter is None:
+            _order_exporter = OrderExporter()
+        return _order_exporter
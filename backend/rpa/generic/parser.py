@@ -1,25 +1,100 @@
 """
 汎用RPAパーサー（JSON/HTML解析）
 """
+import hashlib
+import html
 import json
+import os
 import re
 import time
-from typing import Dict, Any, List, Optional
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Iterable
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
 
+RAW_DATA_RETENTION_POLICIES = ("none", "hash", "compressed", "full")
+
+# BASEのステータス・決済方法の表示名（注文ごとに作り直さない）
+BASE_STATUS_MAP = {
+    "unpaid": "入金待ち",
+    "pending": "未対応",
+    "dealing": "対応中",
+    "dispatched": "対応済",
+    "cancelled": "キャンセル",
+}
+
+BASE_PAYMENT_MAP = {
+    "base_bt": "BASE銀行振込",
+    "creditcard": "クレジットカード",
+    "cvs": "コンビニ決済",
+    "bnpl": "BNPL",
+    "carrier": "キャリア決済",
+    "paypal": "PayPal",
+    "amazon_pay": "AmazonPay",
+}
+
+
+def retain_raw_data(json_data: Any, policy: str) -> Any:
+    """
+    解析後の元JSONデータを保持方法に応じて変換
+    
+    Args:
+        json_data: 元のJSONデータ
+        policy: 保持方法
+            - none: 保持しない（None）
+            - hash: SHA-256のフィンガープリントのみ保持 {"sha256": str, "size": int}
+            - compressed: zlib圧縮したJSONを保持 {"encoding": "zlib", "data": bytes}（restore_raw_data()で復元）
+            - full: そのまま保持
+    
+    Returns:
+        Any: 変換後のraw_data
+    """
+    if policy == "full":
+        return json_data
+    if policy == "none":
+        return None
+    
+    serialized = json.dumps(json_data, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    if policy == "hash":
+        return {"sha256": hashlib.sha256(serialized).hexdigest(), "size": len(serialized)}
+    return {"encoding": "zlib", "data": zlib.compress(serialized, 6)}
+
+
+def restore_raw_data(raw_data: Any) -> Any:
+    """
+    retain_raw_data()で圧縮したraw_dataを元のJSONデータに戻す
+    
+    Args:
+        raw_data: 解析結果のraw_data
+    
+    Returns:
+        Any: 元のJSONデータ（圧縮されていない場合はそのまま、ハッシュのみの場合は復元できないためそのまま）
+    """
+    if isinstance(raw_data, dict) and raw_data.get("encoding") == "zlib" and isinstance(raw_data.get("data"), bytes):
+        return json.loads(zlib.decompress(raw_data["data"]).decode("utf-8"))
+    return raw_data
+
+
 class GenericParser:
     """汎用パーサー（BASEの注文詳細JSONに対応）"""
     
-    def __init__(self, driver: webdriver.Chrome):
+    def __init__(self, driver: Optional[webdriver.Chrome] = None, verbose: bool = True, raw_data_retention: Optional[str] = None):
         """
         初期化
         
         Args:
-            driver: WebDriverインスタンス
+            driver: WebDriverインスタンス（JSONの解析のみを行う場合は不要）
+            verbose: 解析結果のデバッグ情報を出力するか
+            raw_data_retention: 解析結果のraw_dataの保持方法（none, hash, compressed, full）
+                未指定の場合は環境変数RPA_RAW_DATA_RETENTION（デフォルト: full）
         """
         self.driver = driver
+        self.verbose = verbose
+        self.raw_data_retention = (raw_data_retention or os.getenv("RPA_RAW_DATA_RETENTION", "full")).lower()
+        if self.raw_data_retention not in RAW_DATA_RETENTION_POLICIES:
+            raise ValueError(f"サポートされていないraw_dataの保持方法: {self.raw_data_retention}")
     
     def extract_json_from_page(self, platform: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
@@ -222,6 +297,56 @@ class GenericParser:
             traceback.print_exc()
             return None
     
+    @staticmethod
+    def extract_json_from_html(page_source: str) -> Optional[Dict[str, Any]]:
+        """
+        保存済みのHTMLソースからJSONデータを抽出（ブラウザ不要、リプレイ用）
+
+        Args:
+            page_source: ページのHTMLソース
+
+        Returns:
+            Optional[Dict[str, Any]]: 抽出したJSONデータ、見つからない場合はNone
+        """
+        # APIレスポンスをそのまま保存したものはJSONとして読める
+        stripped = page_source.strip()
+        if stripped.startswith("{"):
+            try:
+                return json.loads(stripped)
+            except json.JSONDecodeError:
+                pass
+
+        # <script id="__NEXT_DATA__">
+        match = re.search(r'<script[^>]*id=["\']__NEXT_DATA__["\'][^>]*>(.+?)</script>', page_source, re.DOTALL)
+        if match:
+            try:
+                json_data = json.loads(match.group(1))
+                page_props = json_data.get("props", {}).get("pageProps", {})
+                if "order" in page_props or "order_header" in page_props:
+                    return page_props
+                return json_data
+            except json.JSONDecodeError:
+                pass
+
+        # ブラウザのJSONビューア（<pre>タグ）に表示されたAPIレスポンス
+        match = re.search(r'<pre[^>]*>(\{.+?\})</pre>', page_source, re.DOTALL)
+        if match:
+            try:
+                return json.loads(html.unescape(match.group(1)))
+            except json.JSONDecodeError:
+                pass
+
+        # window.__INITIAL_STATE__ / var orderData
+        for pattern in (r'window\.__INITIAL_STATE__\s*=\s*({.+?});', r'var\s+orderData\s*=\s*({.+?});'):
+            match = re.search(pattern, page_source, re.DOTALL)
+            if match:
+                try:
+                    return json.loads(match.group(1))
+                except json.JSONDecodeError:
+                    continue
+
+        return None
+
     def parse_base_order_json(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         BASEの注文詳細JSONを解析して標準形式に変換
@@ -234,15 +359,8 @@ class GenericParser:
         """
         try:
             # BASEのAPIレスポンス構造: {"status": 200, "order_header": {...}}
-            # order_headerを取得
-            if "order_header" in json_data:
-                order_header = json_data["order_header"]
-            elif "status" in json_data and json_data.get("status") == 200:
-                # statusが200でorder_headerがない場合は、json_data自体がorder_header
-                order_header = json_data
-            else:
-                # その他の構造の場合は、json_data自体をorder_headerとして扱う
-                order_header = json_data
+            # order_headerがない場合は、json_data自体をorder_headerとして扱う
+            order_header = json_data.get("order_header", json_data)
             
             # 顧客情報（BASEのJSON構造に対応）
             customer_data = {}
@@ -275,9 +393,6 @@ class GenericParser:
                     "address": self._format_address(buyer_address) if buyer_address else "",
                 }
             
-            # 注文情報（BASEのJSON構造に対応）
-            order_data = {}
-            
             # order_headerから注文情報を抽出
             time_info = order_header.get("time_info", {})
             price_info = order_header.get("price_info", {})
@@ -287,29 +402,13 @@ class GenericParser:
             
             # ステータス: orders配列の最初のアイテムのstatusを確認
             status = "未処理"
-            if "orders" in order_header and isinstance(order_header["orders"], list) and len(order_header["orders"]) > 0:
-                first_order_status = order_header["orders"][0].get("status", "")
-                status_map = {
-                    "unpaid": "入金待ち",
-                    "pending": "未対応",
-                    "dealing": "対応中",
-                    "dispatched": "対応済",
-                    "cancelled": "キャンセル",
-                }
-                status = status_map.get(first_order_status, first_order_status or "未処理")
+            orders = order_header.get("orders")
+            if isinstance(orders, list) and orders:
+                first_order_status = orders[0].get("status", "")
+                status = BASE_STATUS_MAP.get(first_order_status, first_order_status or "未処理")
             
             # 決済方法のマッピング
             payment_method = order_header.get("payment", "")
-            payment_map = {
-                "base_bt": "BASE銀行振込",
-                "creditcard": "クレジットカード",
-                "cvs": "コンビニ決済",
-                "bnpl": "BNPL",
-                "carrier": "キャリア決済",
-                "paypal": "PayPal",
-                "amazon_pay": "AmazonPay",
-            }
-            payment_method_name = payment_map.get(payment_method, payment_method)
             
             order_data = {
                 "order_id": str(order_id),
@@ -317,65 +416,36 @@ class GenericParser:
                 "order_date": time_info.get("ordered") or order_header.get("order_date") or "",
                 "status": status,
                 "total_amount": float(price_info.get("total") or order_header.get("total_amount") or 0),
-                "payment_method": payment_method_name,
+                "payment_method": BASE_PAYMENT_MAP.get(payment_method, payment_method),
                 "shipping_fee": float(price_info.get("shipping_fee") or order_header.get("shipping_fee") or 0),
                 "tax": float(price_info.get("tax") or order_header.get("tax_amount") or 0),
             }
             
-            # 商品情報
-            order_items = []
-            # BASEのJSON構造: order_header.orders配列
-            if "orders" in order_header and isinstance(order_header["orders"], list):
-                for item in order_header["orders"]:
-                    # 数量: amountフィールドを使用
-                    quantity = float(item.get("amount") or item.get("quantity") or 1)
-                    # 単価: priceフィールドを使用
-                    price = float(item.get("price") or item.get("unit_price") or 0)
-                    # 小計: 単価 × 数量
-                    subtotal = float(item.get("subtotal") or item.get("price_total") or (price * quantity))
-                    
-                    order_items.append({
-                        "product_id": str(item.get("item_id") or item.get("id") or ""),
-                        "product_name": item.get("name") or "商品名不明",
-                        "quantity": quantity,
-                        "unit": item.get("unit") or "個",  # BASEのデフォルト単位
-                        "price": price,
-                        "subtotal": subtotal,
-                        "sku": item.get("variation_id") or item.get("item_identifier") or item.get("barcode") or "",
-                    })
-            # フォールバック: items配列
-            elif "items" in order_header and isinstance(order_header["items"], list):
-                for item in order_header["items"]:
-                    quantity = float(item.get("amount") or item.get("quantity") or 1)
-                    price = float(item.get("price") or item.get("unit_price") or 0)
-                    subtotal = float(item.get("subtotal") or item.get("price_total") or (price * quantity))
-                    
-                    order_items.append({
-                        "product_id": str(item.get("item_id") or item.get("id") or ""),
-                        "product_name": item.get("name") or "商品名不明",
-                        "quantity": quantity,
-                        "unit": item.get("unit") or "個",
-                        "price": price,
-                        "subtotal": subtotal,
-                        "sku": item.get("variation_id") or item.get("item_identifier") or "",
-                    })
+            # 商品情報: order_header.orders配列（BASEのJSON構造）、なければitems配列
+            items = orders if isinstance(orders, list) else order_header.get("items")
+            order_items = [_parse_base_item(item) for item in items] if isinstance(items, list) else []
             
             result = {
                 "customer": customer_data,
                 "order": order_data,
                 "order_items": order_items,
-                "raw_data": json_data,  # 元のJSONデータも保持
+                "raw_data": retain_raw_data(json_data, self.raw_data_retention),  # 元のJSONデータ（保持方法に応じて破棄・ハッシュ化・圧縮）
             }
             
             # デバッグ情報を出力
-            print(f"[Generic Parser] 解析結果:")
-            print(f"  - 顧客ID: {customer_data.get('id')}")
-            print(f"  - 顧客名: {customer_data.get('name')}")
-            print(f"  - メール: {customer_data.get('email')}")
-            print(f"  - 注文ID: {order_data.get('order_id')}")
-            print(f"  - 注文日時: {order_data.get('order_date')}")
-            print(f"  - 合計金額: {order_data.get('total_amount')}")
-            print(f"  - 商品数: {len(order_items)}")
+            if not self.verbose:
+                return result
+            # 1回のprintにまとめて出力する（行ごとのprintは注文ごとの解析コストの大半を占めていた）
+            print(
+                "[Generic Parser] 解析結果:\n"
+                f"  - 顧客ID: {customer_data.get('id')}\n"
+                f"  - 顧客名: {customer_data.get('name')}\n"
+                f"  - メール: {customer_data.get('email')}\n"
+                f"  - 注文ID: {order_data.get('order_id')}\n"
+                f"  - 注文日時: {order_data.get('order_date')}\n"
+                f"  - 合計金額: {order_data.get('total_amount')}\n"
+                f"  - 商品数: {len(order_items)}"
+            )
             
             return result
             
@@ -388,7 +458,7 @@ class GenericParser:
                 "customer": {},
                 "order": {},
                 "order_items": [],
-                "raw_data": json_data,
+                "raw_data": retain_raw_data(json_data, self.raw_data_retention),
             }
     
     def _format_address(self, address: Dict[str, Any]) -> str:
@@ -410,3 +480,109 @@ class GenericParser:
             parts.append(address["address_2"])
         return " ".join(parts) if parts else ""
 
+
+def _parse_base_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """BASEの商品情報（order_header.orders / order_header.items の両方に共通）を標準形式に変換"""
+    # 数量: amountフィールドを使用
+    quantity = float(item.get("amount") or item.get("quantity") or 1)
+    # 単価: priceフィールドを使用
+    price = float(item.get("price") or item.get("unit_price") or 0)
+    return {
+        "product_id": str(item.get("item_id") or item.get("id") or ""),
+        "product_name": item.get("name") or "商品名不明",
+        "quantity": quantity,
+        "unit": item.get("unit") or "個",  # BASEのデフォルト単位
+        "price": price,
+        # 小計: 単価 × 数量
+        "subtotal": float(item.get("subtotal") or item.get("price_total") or (price * quantity)),
+        "sku": item.get("variation_id") or item.get("item_identifier") or item.get("barcode") or "",
+    }
+
+
+def parse_orders(
+    json_payloads: Iterable[Dict[str, Any]],
+    workers: Optional[int] = None,
+    chunk_size: int = 500
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    複数の注文JSONをまとめて解析し、テーブル単位のレコードに正規化（ブラウザ不要）
+    
+    Args:
+        json_payloads: BASEの注文詳細JSONのイテラブル
+        workers: 2以上の場合はProcessPoolExecutorでプロセス並列に解析（大量バックフィル用）
+        chunk_size: プロセスに渡す1チャンクあたりの注文数
+    
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: {customers, orders, order_items, errors}
+            - customers: 顧客レコード（顧客ID/メールで重複排除）
+            - orders: 注文レコード（customer_idで顧客と紐付け）
+            - order_items: 注文商品レコード（order_idで注文と紐付け）
+            - errors: 解析できなかった注文の位置と構造
+    """
+    batch = {"customers": [], "orders": [], "order_items": [], "errors": []}
+    customers_by_key: Dict[str, Dict[str, Any]] = {}
+    
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = executor.map(_parse_chunk, _iter_chunks(json_payloads, chunk_size))
+            _merge_parsed_chunks(chunk_results, batch, customers_by_key)
+    else:
+        _merge_parsed_chunks(map(_parse_chunk, _iter_chunks(json_payloads, chunk_size)), batch, customers_by_key)
+    
+    batch["customers"] = list(customers_by_key.values())
+    return batch
+
+
+def _iter_chunks(json_payloads: Iterable[Dict[str, Any]], chunk_size: int):
+    """イテラブルを(開始位置, チャンク)に分割"""
+    chunk = []
+    start = 0
+    for index, json_data in enumerate(json_payloads):
+        if not chunk:
+            start = index
+        chunk.append(json_data)
+        if len(chunk) >= chunk_size:
+            yield start, chunk
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+def _parse_chunk(indexed_chunk) -> List[Dict[str, Any]]:
+    """1チャンク分の注文JSONを解析（ワーカープロセスで実行、raw_dataは返さない）"""
+    start, chunk = indexed_chunk
+    parser = GenericParser(verbose=False, raw_data_retention="none")
+    results = []
+    for offset, json_data in enumerate(chunk):
+        parsed = parser.parse_base_order_json(json_data)
+        if not parsed.get("order", {}).get("order_id"):
+            results.append({
+                "index": start + offset,
+                "error": list(json_data.keys()) if isinstance(json_data, dict) else type(json_data).__name__,
+            })
+            continue
+        results.append({
+            "customer": parsed.get("customer") or {},
+            "order": parsed["order"],
+            "order_items": parsed.get("order_items") or [],
+        })
+    return results
+
+
+def _merge_parsed_chunks(chunk_results, batch: Dict[str, List[Dict[str, Any]]], customers_by_key: Dict[str, Dict[str, Any]]) -> None:
+    """チャンクごとの解析結果をテーブル単位のレコードにまとめる"""
+    for results in chunk_results:
+        for parsed in results:
+            if "error" in parsed:
+                batch["errors"].append(parsed)
+                continue
+            
+            customer = parsed["customer"]
+            customer_key = customer.get("id") or customer.get("email")
+            if customer_key:
+                customers_by_key[customer_key] = customer
+            
+            order = dict(parsed["order"], customer_id=customer_key or None)
+            batch["orders"].append(order)
+            for item in parsed["order_items"]:
+                batch["order_items"].append(dict(item, order_id=order["order_id"]))
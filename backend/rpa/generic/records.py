@@ -0,0 +1,279 @@
+"""
+Supabaseに保存する顧客・注文・注文商品のレコード型
+解析済みの注文データ（dict）から1回だけ値を取り出し、None以外の列だけでPostgRESTの行（upsert用のdict）を作る
+属性は__slots__で定義し、大量の注文を同期する場合の1行あたりのメモリとコピーを減らす
+"""
+import hashlib
+import re
+from typing import Dict, Any, List, Optional
+
+
+# 注文商品IDの注文ID以降の部分（商品キーのハッシュ12桁 + 重複時の連番、または旧形式の並び順）
+_ORDER_ITEM_SUFFIX = re.compile(r"^(?:[0-9a-f]{12}(?:x\d+)?|\d+)$")
+
+
+def order_item_id(order_id: str, item: Dict[str, Any], occurrence: int = 1) -> str:
+    """
+    注文商品の安定したIDを作成（並び順ではなく商品ID・SKUから決める）
+
+    Args:
+        order_id: 注文ID
+        item: 注文商品データ
+        occurrence: 同じ注文内で同じ商品キーが何回目か（2回目以降はIDに連番を付ける）
+
+    Returns:
+        str: "<注文ID>-<ハッシュ12桁>"（重複時は末尾に"x<連番>"）
+    """
+    product_id = str(item.get("product_id") or "")
+    sku = str(item.get("sku") or "")
+    # 商品ID・SKUのどちらもない場合は商品名で識別する
+    key = f"{product_id}|{sku}" if product_id or sku else f"name|{item.get('product_name') or ''}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    return f"{order_id}-{digest}" if occurrence == 1 else f"{order_id}-{digest}x{occurrence}"
+
+
+def is_order_item_id(order_id: str, row_id: str) -> bool:
+    """行IDが指定した注文の注文商品ID（現在の形式または旧形式）かどうか"""
+    prefix = f"{order_id}-"
+    return row_id.startswith(prefix) and bool(_ORDER_ITEM_SUFFIX.match(row_id[len(prefix):]))
+
+
+class Customer:
+    """customersテーブルの1行"""
+
+    __slots__ = ("id", "name", "email", "phone", "postal_code", "address")
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        email: Optional[str] = None,
+        phone: Optional[str] = None,
+        postal_code: Optional[str] = None,
+        address: Optional[str] = None
+    ):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.postal_code = postal_code
+        self.address = address
+
+    @classmethod
+    def from_dict(cls, customer_data: Dict[str, Any]) -> Optional["Customer"]:
+        """
+        解析済みの顧客データから作成
+
+        Args:
+            customer_data: 顧客データ
+
+        Returns:
+            Optional[Customer]: 顧客（IDもメールアドレスもない場合はNone）
+        """
+        customer_id = customer_data.get("id")
+        email = customer_data.get("email")
+        if not customer_id and not email:
+            print("[Supabase Client] 顧客IDまたはメールアドレスが必要です")
+            return None
+        if not customer_id:
+            # IDがない場合はemailをIDとして使用
+            customer_id = email
+            print(f"[Supabase Client] 顧客IDがないため、emailをIDとして使用します: {email}")
+        get = customer_data.get
+        return cls(customer_id, get("name"), email, get("phone"), get("postal_code"), get("address"))
+
+    def to_row(self) -> Dict[str, Any]:
+        """upsert用の行（Noneの列は含めない）"""
+        row: Dict[str, Any] = {"id": self.id}
+        if self.name is not None:
+            row["name"] = self.name
+        if self.email is not None:
+            row["email"] = self.email
+        if self.phone is not None:
+            row["phone"] = self.phone
+        if self.postal_code is not None:
+            row["postal_code"] = self.postal_code
+        if self.address is not None:
+            row["address"] = self.address
+        return row
+
+
+class Order:
+    """ordersテーブルの1行"""
+
+    __slots__ = (
+        "id", "order_number", "platform", "customer_id", "order_date", "status",
+        "total_amount", "payment_method", "shipping_fee", "tax", "user_id", "job_id",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        order_number: Optional[str] = None,
+        platform: Optional[str] = None,
+        customer_id: Optional[str] = None,
+        order_date: Optional[str] = None,
+        status: str = "未処理",
+        total_amount: Any = None,
+        payment_method: Optional[str] = None,
+        shipping_fee: Any = 0,
+        tax: Any = 0,
+        user_id: Optional[str] = None,
+        job_id: Optional[str] = None
+    ):
+        self.id = id
+        self.order_number = order_number
+        self.platform = platform
+        self.customer_id = customer_id
+        self.order_date = order_date
+        self.status = status
+        self.total_amount = total_amount
+        self.payment_method = payment_method
+        self.shipping_fee = shipping_fee
+        self.tax = tax
+        self.user_id = user_id
+        self.job_id = job_id
+
+    @classmethod
+    def from_dict(
+        cls,
+        order_data: Dict[str, Any],
+        customer_id: Optional[str] = None,
+        platform: Optional[str] = None,
+        user_id: Optional[str] = None,
+        job_id: Optional[str] = None
+    ) -> Optional["Order"]:
+        """
+        解析済みの注文データから作成
+
+        Args:
+            order_data: 注文データ
+            customer_id: 顧客ID（オプション）
+            platform: プラットフォーム名（未指定の場合は注文データの値）
+            user_id: ユーザーID（RLS用、未指定の場合は注文データの値）
+            job_id: RPA実行ジョブID（未指定の場合は注文データの値）
+
+        Returns:
+            Optional[Order]: 注文（注文IDがない場合はNone）
+        """
+        get = order_data.get
+        order_id = get("order_id")
+        if not order_id:
+            print("[Supabase Client] 注文IDが必要です")
+            return None
+        return cls(
+            order_id,
+            get("order_number"),
+            platform or get("platform"),
+            customer_id,
+            get("order_date"),
+            get("status") or "未処理",
+            get("total_amount"),
+            get("payment_method"),
+            get("shipping_fee") or 0,
+            get("tax") or 0,
+            user_id or get("user_id"),
+            job_id or get("job_id"),
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        """upsert用の行（Noneの列は含めない）"""
+        row: Dict[str, Any] = {"id": self.id}
+        if self.order_number is not None:
+            row["order_number"] = self.order_number
+        if self.platform is not None:
+            row["platform"] = self.platform
+        if self.customer_id is not None:
+            row["customer_id"] = self.customer_id
+        if self.order_date is not None:
+            row["order_date"] = self.order_date
+        row["status"] = self.status
+        if self.total_amount is not None:
+            row["total_amount"] = self.total_amount
+        if self.payment_method is not None:
+            row["payment_method"] = self.payment_method
+        row["shipping_fee"] = self.shipping_fee
+        row["tax"] = self.tax
+        if self.user_id is not None:
+            row["user_id"] = self.user_id
+        if self.job_id is not None:
+            row["job_id"] = self.job_id
+        return row
+
+
+class OrderItem:
+    """order_itemsテーブルの1行"""
+
+    __slots__ = ("id", "order_id", "product_id", "product_name", "quantity", "unit", "price", "subtotal", "sku")
+
+    def __init__(
+        self,
+        id: str,
+        order_id: str,
+        product_id: Optional[str] = None,
+        product_name: Optional[str] = None,
+        quantity: Any = 1,
+        unit: str = "kg",
+        price: Any = None,
+        subtotal: Any = None,
+        sku: Optional[str] = None
+    ):
+        self.id = id
+        self.order_id = order_id
+        self.product_id = product_id
+        self.product_name = product_name
+        self.quantity = quantity
+        self.unit = unit
+        self.price = price
+        self.subtotal = subtotal
+        self.sku = sku
+
+    @classmethod
+    def list_from_dicts(cls, order_items: List[Dict[str, Any]], order_id: str) -> List["OrderItem"]:
+        """
+        解析済みの注文商品データのリストから作成（同じ商品が複数ある場合はIDに連番を付ける）
+
+        Args:
+            order_items: 注文商品データのリスト
+            order_id: 注文ID
+
+        Returns:
+            List[OrderItem]: 注文商品のリスト
+        """
+        records = []
+        occurrences: Dict[str, int] = {}
+        for item in order_items:
+            item_id = order_item_id(order_id, item)
+            occurrences[item_id] = occurrences.get(item_id, 0) + 1
+            if occurrences[item_id] > 1:
+                item_id = order_item_id(order_id, item, occurrences[item_id])
+            get = item.get
+            records.append(cls(
+                item_id,  # 注文ID + 商品ID・SKUから決める（並び替えてもIDは変わらない）
+                order_id,
+                get("product_id"),
+                get("product_name"),
+                get("quantity") or 1,
+                get("unit") or "kg",  # 単位（デフォルトはkg）
+                get("price"),
+                get("subtotal"),
+                get("sku"),
+            ))
+        return records
+
+    def to_row(self) -> Dict[str, Any]:
+        """upsert用の行（Noneの列は含めない）"""
+        row: Dict[str, Any] = {"id": self.id, "order_id": self.order_id}
+        if self.product_id is not None:
+            row["product_id"] = self.product_id
+        if self.product_name is not None:
+            row["product_name"] = self.product_name
+        row["quantity"] = self.quantity
+        row["unit"] = self.unit
+        if self.price is not None:
+            row["price"] = self.price
+        if self.subtotal is not None:
+            row["subtotal"] = self.subtotal
+        if self.sku is not None:
+            row["sku"] = self.sku
+        return row
@@ -0,0 +1,289 @@
+"""
+汎用RPAリプレイスクリプト
+保存済みの注文JSON（またはHTML）をブラウザなしでパーサー・Supabaseクライアントに流し込み、
+スループットを計測する
+"""
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Optional, Dict, Any, Iterator, Tuple
+
+from rpa.generic.parser import GenericParser, parse_orders
+from rpa.utils.artifact_store import read_artifact
+
+
+PAYLOAD_SUFFIXES = (".json", ".html", ".htm")
+
+
+def iter_captured_payloads(path: str) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    保存済みペイロードを順に読み込む（artifacts/やdebug_json/のディレクトリ、または単一ファイル）
+
+    Args:
+        path: ディレクトリまたはファイルのパス
+
+    Yields:
+        Tuple[str, Optional[Dict[str, Any]]]: (ファイルパス, JSONデータ。抽出できなかった場合はNone)
+    """
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                files.append(os.path.join(root, name))
+        files.sort()
+    else:
+        files = [path]
+
+    for file_path in files:
+        base_name = file_path
+        for suffix in (".gz", ".zst"):
+            if base_name.endswith(suffix):
+                base_name = base_name[:-len(suffix)]
+        if not base_name.endswith(PAYLOAD_SUFFIXES):
+            continue
+
+        text = read_artifact(file_path).decode("utf-8")
+        if base_name.endswith(".json"):
+            try:
+                yield file_path, json.loads(text)
+            except json.JSONDecodeError:
+                yield file_path, None
+        else:
+            yield file_path, GenericParser.extract_json_from_html(text)
+
+
+def replay_payloads(
+    path: str,
+    save: bool = False,
+    platform: Optional[str] = "base",
+    user_id: Optional[str] = None,
+    job_id: Optional[str] = None,
+    repeat: int = 1,
+    quiet: bool = True,
+    workers: Optional[int] = None,
+    write_behind: bool = False,
+    async_save: bool = False
+) -> Dict[str, Any]:
+    """
+    保存済みペイロードを解析（と保存）してスループットを計測
+
+    Args:
+        path: ペイロードのディレクトリまたはファイル
+        save: TrueのときGenericSupabaseClientで保存まで行う
+        platform: プラットフォーム名
+        user_id: ユーザーID（RLS用）
+        job_id: 保存時に付与するジョブID（未指定の場合は "replay-<時刻>"）
+        repeat: 解析を繰り返す回数（ベンチマーク用）
+        quiet: Trueのとき解析・保存中の標準出力を抑制
+        workers: 指定した場合はparse_orders()のプロセス並列解析で計測
+        write_behind: Trueのとき書き込みキュー経由でバッチ保存
+        async_save: Trueのとき非同期クライアント（AsyncGenericSupabaseClient）で同時に保存
+
+    Returns:
+        Dict[str, Any]: スループットレポート
+    """
+    payloads = list(iter_captured_payloads(path))
+    valid = [(file_path, data) for file_path, data in payloads if data is not None]
+
+    parser = GenericParser(verbose=not quiet)
+    supabase_client = None
+    if save:
+        from rpa.generic.config import GenericRPAConfig
+        from rpa.generic.supabase_client import GenericSupabaseClient
+        config = GenericRPAConfig(login_url="replay", target_url=path, platform=platform, user_id=user_id)
+        supabase_client = GenericSupabaseClient(config)
+        job_id = job_id or f"replay-{int(time.time())}"
+
+    parse_latencies = []
+    parse_errors = 0
+    parsed_results = []
+    output = io.StringIO() if quiet else sys.stdout
+
+    with contextlib.redirect_stdout(output):
+        parse_started = time.perf_counter()
+        if workers:
+            json_payloads = [json_data for _, json_data in valid]
+            batch = parse_orders(itertools.chain.from_iterable(itertools.repeat(json_payloads, max(repeat, 1))), workers=workers)
+            parsed_count = len(batch["orders"]) + len(batch["errors"])
+            parse_errors = len(batch["errors"]) // max(repeat, 1)
+        for round_index in range(0 if workers else max(repeat, 1)):
+            for _, json_data in valid:
+                started = time.perf_counter()
+                parsed = parser.parse_base_order_json(json_data)
+                parse_latencies.append(time.perf_counter() - started)
+                if round_index == 0:
+                    if not parsed.get("order", {}).get("order_id"):
+                        parse_errors += 1
+                    parsed_results.append(parsed)
+        parse_seconds = time.perf_counter() - parse_started
+
+        saved_records = {"customers": 0, "orders": 0, "items": 0}
+        save_seconds = 0.0
+        if supabase_client:
+            if workers:
+                # 保存はparse_base_order_json()の形式で1件ずつ行う
+                parsed_results = [parser.parse_base_order_json(json_data) for _, json_data in valid]
+            save_started = time.perf_counter()
+            # 保存は1回分のみ（repeatは解析のベンチマーク用）
+            if async_save:
+                from rpa.generic.async_supabase_client import AsyncGenericSupabaseClient
+                from rpa.utils.async_postgrest import run_coroutine
+                async_client = AsyncGenericSupabaseClient(supabase_client.config)
+                saved_records = run_coroutine(async_client.save_many(parsed_results, platform=platform, user_id=user_id, job_id=job_id))
+            elif write_behind:
+                for parsed in parsed_results:
+                    supabase_client.enqueue_order_data(parsed, platform=platform, user_id=user_id, job_id=job_id)
+                saved_records = supabase_client.flush_writes()
+                supabase_client.close()
+            else:
+                for parsed in parsed_results:
+                    saved = supabase_client.save_order_data(parsed, platform=platform, user_id=user_id, job_id=job_id)
+                    for key in saved_records:
+                        saved_records[key] += saved.get(key, 0)
+            save_seconds = time.perf_counter() - save_started
+
+    parse_latencies.sort()
+    if not workers:
+        parsed_count = len(parse_latencies)
+    return {
+        "files": len(payloads),
+        "unreadable_files": len(payloads) - len(valid),
+        "parsed_orders": parsed_count,
+        "parse_errors": parse_errors,
+        "parse_seconds": parse_seconds,
+        "parse_orders_per_sec": parsed_count / parse_seconds if parse_seconds > 0 else 0.0,
+        "parse_p50_ms": _percentile(parse_latencies, 0.50) * 1000,
+        "parse_p95_ms": _percentile(parse_latencies, 0.95) * 1000,
+        "saved_records": saved_records,
+        "save_seconds": save_seconds,
+        "save_orders_per_sec": len(valid) / save_seconds if save_seconds > 0 else 0.0,
+        "job_id": job_id,
+    }
+
+
+def benchmark_parse(path: str, rounds: int = 20) -> Dict[str, Any]:
+    """
+    1注文あたりの解析コストを計測（parse_base_order_json()、デバッグ出力ありのparse_base_order_json()）
+    ラウンドごとに全ペイロードを解析し、ばらつきを抑えるため最小値と中央値を返す
+
+    Args:
+        path: ペイロードのディレクトリまたはファイル
+        rounds: 計測を繰り返す回数
+
+    Returns:
+        Dict[str, Any]: {orders, rounds, <ステージ>_min_us, <ステージ>_median_us}（ステージ: parse, parse_verbose）
+    """
+    payloads = [json_data for _, json_data in iter_captured_payloads(path) if json_data is not None]
+    if not payloads:
+        return {"orders": 0, "rounds": 0}
+
+    stages = {
+        "parse": GenericParser(verbose=False).parse_base_order_json,
+        "parse_verbose": GenericParser(verbose=True).parse_base_order_json,
+    }
+    timings: Dict[str, list] = {name: [] for name in stages}
+    # 解析結果のデバッグ出力（RPA実行時のデフォルト）はファイルへの書き込みとして計測する
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for _ in range(max(rounds, 1)):
+            # 各ステージを交互に計測して、計測中の負荷の変化を全ステージに均等にかける
+            for name, stage in stages.items():
+                started = time.perf_counter()
+                for json_data in payloads:
+                    stage(json_data)
+                timings[name].append((time.perf_counter() - started) / len(payloads) * 1e6)
+
+    report: Dict[str, Any] = {"orders": len(payloads), "rounds": max(rounds, 1)}
+    for name, values in timings.items():
+        values.sort()
+        report[f"{name}_min_us"] = values[0]
+        report[f"{name}_median_us"] = values[len(values) // 2]
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """
+    スループットレポートを表示
+
+    Args:
+        report: replay_payloads()の戻り値
+    """
+    print("="*60)
+    print("【リプレイ結果】")
+    print("="*60)
+    print(f"ファイル数: {report['files']}（読み込み不可: {report['unreadable_files']}）")
+    print(f"解析件数: {report['parsed_orders']}（解析失敗: {report['parse_errors']}）")
+    print(f"解析時間: {report['parse_seconds']:.3f}秒 ({report['parse_orders_per_sec']:.1f}件/秒)")
+    print(f"解析レイテンシ: p50={report['parse_p50_ms']:.3f}ms, p95={report['parse_p95_ms']:.3f}ms")
+    if report["save_seconds"] > 0:
+        saved = report["saved_records"]
+        print(f"保存時間: {report['save_seconds']:.3f}秒 ({report['save_orders_per_sec']:.1f}件/秒)")
+        print(f"保存レコード: 顧客={saved['customers']}, 注文={saved['orders']}, 商品={saved['items']} (Job ID: {report['job_id']})")
+    print("="*60)
+
+
+def _percentile(sorted_values, ratio: float) -> float:
+    """ソート済みリストのパーセンタイル値を返す"""
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * ratio), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("使用方法:")
+        print("  python -m rpa.generic.replay <PAYLOAD_DIR> [--save] [--platform base] [--user-id ID] [--repeat N] [--workers N] [--write-behind | --async] [--verbose]")
+        print("  python -m rpa.generic.replay <PAYLOAD_DIR> --benchmark [--repeat ROUNDS]")
+        print("")
+        print("例:")
+        print("  python -m rpa.generic.replay artifacts/")
+        print("  python -m rpa.generic.replay artifacts/ --repeat 100")
+        print("  python -m rpa.generic.replay artifacts/ --repeat 100 --workers 4")
+        print("  python -m rpa.generic.replay artifacts/ --benchmark")
+        print("  python -m rpa.generic.replay artifacts/ --save --user-id 00000000-0000-0000-0000-000000000000")
+        sys.exit(1)
+
+    payload_path = sys.argv[1]
+    platform = "base"
+    user_id = None
+    repeat = None
+    workers = None
+
+    for i, arg in enumerate(sys.argv):
+        if arg == "--platform" and i + 1 < len(sys.argv):
+            platform = sys.argv[i + 1]
+        elif arg == "--user-id" and i + 1 < len(sys.argv):
+            user_id = sys.argv[i + 1]
+        elif arg == "--repeat" and i + 1 < len(sys.argv):
+            repeat = int(sys.argv[i + 1])
+        elif arg == "--workers" and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+
+    if "--benchmark" in sys.argv:
+        benchmark = benchmark_parse(payload_path, rounds=repeat or 20)
+        if not benchmark["orders"]:
+            print(f"解析できるペイロードがありません: {payload_path}")
+            sys.exit(1)
+        print(f"【解析ベンチマーク】{benchmark['orders']}件 × {benchmark['rounds']}ラウンド（1注文あたり）")
+        print(f"parse_base_order_json: 最小 {benchmark['parse_min_us']:.2f}µs, 中央値 {benchmark['parse_median_us']:.2f}µs")
+        print(f"parse_base_order_json（デバッグ出力あり）: 最小 {benchmark['parse_verbose_min_us']:.2f}µs, 中央値 {benchmark['parse_verbose_median_us']:.2f}µs")
+        sys.exit(0)
+
+    report = replay_payloads(
+        payload_path,
+        save="--save" in sys.argv,
+        platform=platform,
+        user_id=user_id,
+        repeat=repeat or 1,
+        quiet="--verbose" not in sys.argv,
+        workers=workers,
+        write_behind="--write-behind" in sys.argv,
+        async_save="--async" in sys.argv
+    )
+    print_report(report)
+
+    sys.exit(0 if report["parsed_orders"] > 0 and report["parse_errors"] == 0 else 1)
@@ -1,36 +1,55 @@
 """
 汎用RPAスクレイパー（Selenium）
 """
+import os
 import time
 import json
 import re
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 
-from rpa.core.browser import create_driver
+from rpa.core.browser import create_driver, restart_driver, run_with_driver_recovery, save_session
+from rpa.core.telemetry import mark_recycled, recycle_requested
+from rpa.jobs.registry import JobCancelled, attach_driver, is_cancelled, raise_if_cancelled, wait_unless_cancelled
+
+
+def max_tabs() -> int:
+    """
+    1つのブラウザで同時に読み込むタブ数（環境変数RPA_MAX_TABS、デフォルト: 4）
+    
+    Returns:
+        int: タブ数（1の場合はタブを開かず、1ページずつ読み込む）
+    """
+    return max(1, int(os.getenv("RPA_MAX_TABS", "4")))
 
 
 class GenericScraper:
     """汎用スクレイパー"""
     
-    def __init__(self, headless: bool = False):
+    def __init__(self, headless: bool = False, job_id: Optional[str] = None):
         """
         初期化
         
         Args:
             headless: ヘッドレスモードで実行するか
+            job_id: ジョブID（キャンセルされたら待機を中断し、ブラウザを終了する）
         """
         self.headless = headless
+        self.job_id = job_id
         self.driver: Optional[webdriver.Chrome] = None
+        # ログイン後のセッション（ブラウザを起動し直したときに復元する）
+        self.session: Optional[Dict[str, Any]] = None
     
     def start(self) -> None:
         """ブラウザを起動"""
         print("[Generic Scraper] ChromeDriverを起動しています...")
         self.driver = create_driver(headless=self.headless)
+        attach_driver(self.job_id, self.driver)
         print("[Generic Scraper] ChromeDriverの起動に成功しました")
     
     def navigate_to_login(self, login_url: str, wait_time: int = 120) -> bool:
@@ -43,7 +62,7 @@ class GenericScraper:
             wait_time: 最大ログイン待機時間（秒、デフォルト120秒）
         
         Returns:
-            bool: 移動成功時True
+            bool: 移動成功時True（ジョブがキャンセルされた場合はJobCancelledを送出）
         """
         if not self.driver:
             raise RuntimeError("ブラウザが起動していません。start()を先に呼び出してください。")
@@ -95,7 +114,7 @@ class GenericScraper:
             waited_time = 0
             login_detected = False
             
-            while waited_time < wait_time:
+            while waited_time < wait_time and not is_cancelled(self.job_id):
                 try:
                     current_url = self.driver.current_url
                     lower_url = current_url.lower()
@@ -131,19 +150,24 @@ class GenericScraper:
                         remaining = wait_time - waited_time
                         print(f"[Generic Scraper] ⏳ ログイン待機中... あと最大{remaining}秒（ログイン完了を検知したら即座に進みます）")
                     
-                    time.sleep(check_interval)
+                    wait_unless_cancelled(self.job_id, check_interval)
                     waited_time += check_interval
                     
                 except Exception as e:
                     # エラーが発生しても続行
-                    time.sleep(check_interval)
+                    wait_unless_cancelled(self.job_id, check_interval)
                     waited_time += check_interval
             
+            if is_cancelled(self.job_id):
+                raise JobCancelled("ログイン待機中にキャンセルされました")
+            
             if not login_detected:
                 print(f"\n[Generic Scraper] ⚠ {wait_time}秒経過しました。タイムアウトですが、次のステップに進みます...")
                 print(f"[Generic Scraper] 現在のURL: {self.driver.current_url}")
             
             return True
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"[Generic Scraper] ✗ ログイン後URLへの移動エラー: {e}")
             import traceback
@@ -524,6 +548,160 @@ class GenericScraper:
         print("[Generic Scraper] ページ内のscriptタグからJSONを抽出します...")
         return self.extract_json_from_script_tags()
     
+    def save_session(self) -> None:
+        """ログイン後のセッション（URL・クッキー）を保存（ブラウザのクラッシュ時に復元する）"""
+        if self.driver:
+            self.session = save_session(self.driver)
+    
+    def run_with_recovery(self, step: Callable[[], Any], login_url: Optional[str] = None, login_wait: int = 120) -> Any:
+        """
+        ブラウザを使う処理を実行し、ブラウザがクラッシュした場合は起動し直してやり直す
+        起動し直した後は保存したセッションを復元し、login_urlでログイン状態を確認してから処理を実行する
+        
+        Args:
+            step: 実行する処理（self.driverを使う）
+            login_url: 起動し直した後に開くログイン後URL
+            login_wait: ログインが切れていた場合の最大ログイン待機時間（秒）
+        
+        Returns:
+            Any: 処理の結果
+        """
+        def run_step(driver):
+            self.driver = driver
+            return step()
+        
+        def relogin(driver):
+            self.driver = driver
+            if login_url:
+                self.navigate_to_login(login_url, wait_time=login_wait)
+        
+        result, self.driver = run_with_driver_recovery(
+            self.driver, run_step, self.session, headless=self.headless, job_id=self.job_id, relogin=relogin
+        )
+        return result
+    
+    def recycle_if_requested(self, login_url: Optional[str] = None, login_wait: int = 120) -> bool:
+        """
+        メモリ使用量などの上限を超えてブラウザの再起動が要求されている場合、保存したセッションで起動し直す
+        
+        Args:
+            login_url: 起動し直した後に開くログイン後URL
+            login_wait: ログインが切れていた場合の最大ログイン待機時間（秒）
+        
+        Returns:
+            bool: 起動し直した場合True
+        """
+        if not self.driver or not recycle_requested(self.job_id):
+            return False
+        print("[Generic Scraper] リソース使用量が上限を超えたため、ブラウザを起動し直します")
+        self.driver = restart_driver(self.driver, self.session, headless=self.headless, job_id=self.job_id)
+        mark_recycled(self.job_id)
+        if login_url:
+            self.navigate_to_login(login_url, wait_time=login_wait)
+        return True
+    
+    def fetch_in_tabs(
+        self,
+        target_urls: List[str],
+        extract: Callable[[str], Any],
+        tabs: Optional[int] = None,
+        settle_time: Optional[float] = None,
+        load_timeout: float = 30.0
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        ログイン済みのブラウザで複数のタブを開き、ターゲットURLを並行して読み込んでデータを取得
+        ブラウザを追加で起動せずに、同じセッション（クッキー）で複数のページの読み込みを待つ時間を重ねる
+        WebDriverの操作は1つずつしか実行できないため、読み込みが終わったタブに切り替えて順にextractを呼び出す
+        
+        Args:
+            target_urls: データ取得対象のURLのリスト
+            extract: 読み込みが終わったタブで呼び出す関数（URLを受け取り、取得したデータを返す）
+            tabs: 同時に読み込むタブ数の上限（未指定の場合は環境変数RPA_MAX_TABS、デフォルト: 4）
+            settle_time: 読み込み開始から最低限待つ時間（秒、SPAのJavaScriptの実行を待つ。未指定の場合は環境変数RPA_TAB_SETTLE、デフォルト: 3）
+            load_timeout: 1ページの読み込みの最大待機時間（秒、超えた場合は読み込み途中のページから取得する）
+        
+        Returns:
+            Iterator[Tuple[str, Any]]: 読み込みが終わった順の (URL, extractの結果)（extractが失敗した場合の結果はNone）
+        
+        Raises:
+            JobCancelled: ジョブがキャンセルされた場合
+        """
+        if not self.driver:
+            raise RuntimeError("ブラウザが起動していません。start()を先に呼び出してください。")
+        
+        tabs = tabs or max_tabs()
+        settle_time = settle_time if settle_time is not None else float(os.getenv("RPA_TAB_SETTLE", "3"))
+        main_handle = self.driver.current_window_handle
+        pending = deque(target_urls)
+        # 読み込み中のタブ {ウィンドウハンドル: (URL, 読み込み開始時刻)}
+        in_flight: Dict[str, Tuple[str, float]] = {}
+        idle_handles: List[str] = [main_handle]
+        opened_handles: List[str] = []
+        print(f"[Generic Scraper] {len(target_urls)}件のURLを最大{tabs}タブで読み込みます")
+        try:
+            while pending or in_flight:
+                raise_if_cancelled(self.job_id)
+                # 空いているタブで次のURLの読み込みを開始（読み込みの完了は待たない）
+                while pending and len(in_flight) < tabs:
+                    if idle_handles:
+                        handle = idle_handles.pop()
+                        self.driver.switch_to.window(handle)
+                    else:
+                        self.driver.switch_to.new_window("tab")
+                        handle = self.driver.current_window_handle
+                        opened_handles.append(handle)
+                    target_url = pending.popleft()
+                    self.driver.execute_script("window.location.href = arguments[0];", target_url)
+                    in_flight[handle] = (target_url, time.time())
+                
+                handle = self._next_loaded_tab(in_flight, settle_time, load_timeout)
+                if handle is None:
+                    wait_unless_cancelled(self.job_id, 0.2)
+                    continue
+                target_url, _ = in_flight.pop(handle)
+                try:
+                    result = extract(target_url)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    print(f"[Generic Scraper] タブからのデータ取得エラー ({target_url}): {e}")
+                    result = None
+                idle_handles.append(handle)
+                yield target_url, result
+                if recycle_requested(self.job_id):
+                    # ブラウザを起動し直せるように、読み込み中のタブを残して終了する（残りのURLは呼び出し側で再度読み込む）
+                    print("[Generic Scraper] ブラウザの再起動が要求されたため、タブでの読み込みを中断します")
+                    return
+        finally:
+            # 開いたタブを閉じて最初のタブに戻す（ブラウザがクラッシュしている場合は何もしない）
+            try:
+                for handle in opened_handles:
+                    self.driver.switch_to.window(handle)
+                    self.driver.close()
+                self.driver.switch_to.window(main_handle)
+            except Exception:
+                pass
+    
+    def _next_loaded_tab(self, in_flight: Dict[str, Tuple[str, float]], settle_time: float, load_timeout: float) -> Optional[str]:
+        """
+        読み込みが終わったタブに切り替えて、そのウィンドウハンドルを返す
+        
+        Returns:
+            Optional[str]: ウィンドウハンドル（読み込みが終わったタブがない場合はNone）
+        """
+        now = time.time()
+        for handle, (target_url, started_at) in sorted(in_flight.items(), key=lambda item: item[1][1]):
+            elapsed = now - started_at
+            if elapsed < settle_time:
+                continue
+            self.driver.switch_to.window(handle)
+            if elapsed >= load_timeout:
+                print(f"[Generic Scraper] ⚠ {load_timeout}秒以内に読み込みが完了しませんでした ({target_url})")
+                return handle
+            if self.driver.execute_script("return document.readyState") == "complete":
+                return handle
+        return None
+    
     def quit(self) -> None:
         """ブラウザを閉じる（close()のエイリアス）"""
         self.close()
@@ -1,23 +1,265 @@
 """
 汎用RPA Supabaseクライアント
 """
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Set
 from supabase import create_client, Client
 from rpa.generic.config import GenericRPAConfig
+from rpa.generic.customer_cache import CustomerCache
+from rpa.generic.fingerprint_index import FingerprintIndex, get_fingerprint_index
+from rpa.generic.records import Customer, Order, OrderItem, is_order_item_id
+from rpa.generic.write_queue import WriteBehindQueue
+from rpa.utils.request_policy import RequestPolicy, get_request_policy
+from rpa.utils.write_spool import ORDER_GRAPHS_TABLE, WriteSpool, get_write_spool
+
+
+# 書き込みキューで注文ごとの不要な注文商品の削除を表すテーブル名（実テーブルではない）
+ORPHAN_ITEMS_TABLE = "order_item_orphans"
 
 
 class GenericSupabaseClient:
     """汎用Supabaseクライアント"""
     
-    def __init__(self, config: GenericRPAConfig):
+    def __init__(self, config: GenericRPAConfig, fingerprint_index: Optional[FingerprintIndex] = None, write_spool: Optional[WriteSpool] = None, request_policy: Optional[RequestPolicy] = None):
         """
         初期化
         
         Args:
             config: GenericRPAConfigインスタンス
+            fingerprint_index: 変更検知に使うフィンガープリント索引
+                未指定の場合、config.skip_unchangedがTrueならプロセス共通の索引を使用
+            write_spool: 保存に失敗した行を退避するスプール（未指定の場合はプロセス共通のスプール）
+            request_policy: リトライ・流量制限のポリシー（未指定の場合はプロセス共通のポリシー）
         """
         self.config = config
         self.supabase: Client = create_client(config.supabase_url, config.supabase_key)
+        self.request_policy = request_policy or get_request_policy()
+        if fingerprint_index is None and config.skip_unchanged:
+            fingerprint_index = get_fingerprint_index(config.supabase_url)
+        self.fingerprint_index = fingerprint_index
+        # 変更がなかったため送信をスキップした行数
+        self.skipped_records = {"customers": 0, "orders": 0, "items": 0}
+        self.write_queue: Optional[WriteBehindQueue] = None
+        # 同じジョブ内で繰り返し現れる顧客のupsertを省略する（インスタンスごと = ジョブごと）
+        self.customer_cache = CustomerCache(persistent_index=fingerprint_index)
+        self.write_spool = write_spool or get_write_spool()
+        # 保存に失敗してスプールに退避した行数（バックグラウンドで再送される）
+        self.spooled_records = {"customers": 0, "orders": 0, "items": 0}
+        # save_order_graphs RPCで保存した件数（書き込みキュー経由の場合の集計用）
+        self.graph_saved_records = {"customers": 0, "orders": 0, "items": 0}
+        # 書き込みキューで注文・注文商品の書き込みに失敗した注文ID（分析用の書き出しから除く）
+        self.failed_order_ids: Set[str] = set()
+    
+    def spool_rows(self, table: str, rows: List[Dict[str, Any]], error: Optional[Exception] = None) -> bool:
+        """
+        保存に失敗した行をスプールに退避
+        
+        Args:
+            table: テーブル名（customers, orders, order_items, order_graphs）
+            rows: upsert用の行（または注文グラフ）のリスト
+            error: 失敗の原因となった例外
+        
+        Returns:
+            bool: スプールに退避できた場合True
+        """
+        if not self.write_spool or not rows or table == ORPHAN_ITEMS_TABLE:
+            # 不要な注文商品の削除は次回の同期で再度行われるためスプールしない
+            return False
+        try:
+            self.write_spool.append(table, rows, mode="upsert", error=error)
+        except Exception as e:
+            print(f"[Supabase Client] スプールへの退避に失敗しました: {e}")
+            return False
+        spooled_key = {"order_items": "items", ORDER_GRAPHS_TABLE: "orders"}.get(table, table)
+        self.spooled_records[spooled_key] += len(rows)
+        return True
+    
+    def rebuild_fingerprint_index(self, user_id: Optional[str] = None) -> Dict[str, int]:
+        """
+        Supabaseの現在の内容からフィンガープリント索引を作り直す
+        
+        Args:
+            user_id: 指定した場合はそのユーザーの行のみ
+        
+        Returns:
+            Dict[str, int]: テーブルごとの登録件数
+        """
+        if not self.fingerprint_index:
+            self.fingerprint_index = get_fingerprint_index(self.config.supabase_url)
+        return self.fingerprint_index.rebuild_from_supabase(self.supabase, user_id=user_id)
+    
+    @staticmethod
+    def build_customer_row(customer_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        顧客情報からcustomersテーブルの行を作成
+        
+        Args:
+            customer_data: 顧客データ
+        
+        Returns:
+            Optional[Dict[str, Any]]: upsert用の行、IDもメールアドレスもない場合はNone
+        """
+        customer = Customer.from_dict(customer_data)
+        return customer.to_row() if customer else None
+    
+    @staticmethod
+    def build_order_row(order_data: Dict[str, Any], customer_id: Optional[str] = None, platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        注文情報からordersテーブルの行を作成
+        
+        Args:
+            order_data: 注文データ
+            customer_id: 顧客ID（オプション）
+            platform: プラットフォーム名（base, shopify, rakuten, furusato, tabechoku）
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+        
+        Returns:
+            Optional[Dict[str, Any]]: upsert用の行、注文IDがない場合はNone
+        """
+        order = Order.from_dict(order_data, customer_id, platform, user_id, job_id)
+        return order.to_row() if order else None
+    
+    @staticmethod
+    def build_order_item_rows(order_items: List[Dict[str, Any]], order_id: str) -> List[Dict[str, Any]]:
+        """
+        注文商品情報からorder_itemsテーブルの行を作成
+        
+        Args:
+            order_items: 注文商品データのリスト
+            order_id: 注文ID
+        
+        Returns:
+            List[Dict[str, Any]]: upsert用の行のリスト
+        """
+        return [item.to_row() for item in OrderItem.list_from_dicts(order_items, order_id)]
+    
+    @staticmethod
+    def build_order_graph(parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        解析済みの注文データからsave_order_graphs RPCに渡す注文グラフを作成
+        
+        Args:
+            parsed_data: parse_base_order_json()で解析されたデータ
+            platform: プラットフォーム名
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+        
+        Returns:
+            Optional[Dict[str, Any]]: {id, customer, order, items}、注文IDがない場合はNone
+        """
+        customer_row = GenericSupabaseClient.build_customer_row(parsed_data["customer"]) if parsed_data.get("customer") else None
+        order_row = GenericSupabaseClient.build_order_row(
+            parsed_data.get("order") or {}, customer_row["id"] if customer_row else None, platform, user_id, job_id
+        )
+        if not order_row:
+            return None
+        return {
+            "id": order_row["id"],  # 書き込みキューでの重複排除用（RPC側では使用しない）
+            "customer": customer_row,
+            "order": order_row,
+            "items": GenericSupabaseClient.build_order_item_rows(parsed_data.get("order_items") or [], order_row["id"]),
+        }
+    
+    def save_order_graphs(self, graphs: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        注文グラフのリストをsave_order_graphs RPCで1トランザクションで保存（1バッチ1往復）
+        失敗時は例外をそのまま送出する（どの注文も保存されない）
+        
+        Args:
+            graphs: build_order_graph()で作成した注文グラフのリスト
+        
+        Returns:
+            Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}（変更がなく送信をスキップした行を含む）
+        """
+        saved_records = {"customers": 0, "orders": 0, "items": 0}
+        changed_graphs = []
+        for graph in graphs:
+            customer_row = graph.get("customer")
+            if customer_row and self.customer_cache.lookup(customer_row):
+                # 保存済みで内容も同じ顧客はRPCに含めない
+                self.skipped_records["customers"] += 1
+                saved_records["customers"] += 1
+                graph = dict(graph, customer=None)
+            if self.fingerprint_index and not graph.get("customer"):
+                order_changed = self.fingerprint_index.is_changed("orders", graph["order"])
+                items_changed = bool(self.fingerprint_index.filter_changed("order_items", graph["items"]))
+                # 削除が必要な注文商品が索引にある場合もRPCに含める（RPC内で削除される）
+                keep_ids = [row["id"] for row in graph["items"]]
+                if keep_ids and self.known_orphan_item_ids(graph["id"], keep_ids):
+                    items_changed = True
+                if not order_changed and not items_changed:
+                    self.skipped_records["orders"] += 1
+                    self.skipped_records["items"] += len(graph["items"])
+                    saved_records["orders"] += 1
+                    saved_records["items"] += len(graph["items"])
+                    continue
+            changed_graphs.append(graph)
+        if not changed_graphs:
+            return saved_records
+        
+        result = self.request_policy.execute(
+            self.supabase.rpc("save_order_graphs", {"graphs": changed_graphs}),
+            f"save_order_graphs（{len(changed_graphs)}件）"
+        )
+        counts = result.data[0] if isinstance(result.data, list) and result.data else result.data or {}
+        for key in saved_records:
+            saved_records[key] += int(counts.get(key, 0))
+        
+        for graph in changed_graphs:
+            if graph.get("customer"):
+                self.customer_cache.store(graph["customer"], str(graph["customer"]["id"]))
+            if self.fingerprint_index:
+                if graph.get("customer"):
+                    self.fingerprint_index.record("customers", [graph["customer"]])
+                self.fingerprint_index.record("orders", [graph["order"]])
+                self.fingerprint_index.record("order_items", graph["items"])
+                if graph["items"]:
+                    # RPC内で商品一覧にない注文商品は削除済み
+                    self.fingerprint_index.forget("order_items", self.known_orphan_item_ids(graph["id"], [row["id"] for row in graph["items"]]))
+        return saved_records
+    
+    def upsert_rows(self, table: str, rows: List[Dict[str, Any]]) -> int:
+        """
+        複数行をまとめてupsert（書き込みキューからのバッチ保存用）
+        失敗時は例外をそのまま送出する
+        
+        Args:
+            table: テーブル名（customers, orders, order_items、order_graphsの場合はsave_order_graphs()、
+                   order_item_orphansの場合は{"id": 注文ID, "keep": 注文商品IDのリスト}ごとにdelete_orphan_items()）
+            rows: upsert用の行のリスト
+        
+        Returns:
+            int: 保存した行数（変更がなく送信をスキップした行を含む）
+        """
+        if not rows:
+            return 0
+        if table == ORDER_GRAPHS_TABLE:
+            saved = self.save_order_graphs(rows)
+            for key in self.graph_saved_records:
+                self.graph_saved_records[key] += saved[key]
+            return len(rows)
+        if table == ORPHAN_ITEMS_TABLE:
+            return sum(self.delete_orphan_items(row["id"], row["keep"]) for row in rows)
+        
+        unchanged_count = 0
+        if self.fingerprint_index:
+            changed_rows = self.fingerprint_index.filter_changed(table, rows)
+            unchanged_count = len(rows) - len(changed_rows)
+            if unchanged_count:
+                skipped_key = "items" if table == "order_items" else table
+                self.skipped_records[skipped_key] += unchanged_count
+            rows = changed_rows
+            if not rows:
+                return unchanged_count
+        
+        result = self.request_policy.execute(self.supabase.table(table).upsert(rows), f"{table}のupsert")
+        saved_count = len(result.data) if result.data else 0
+        if saved_count and self.fingerprint_index:
+            self.fingerprint_index.record(table, rows)
+        if saved_count and table == "customers":
+            for row in rows:
+                self.customer_cache.store(row, str(row["id"]))
+        return saved_count + unchanged_count
     
     def upsert_customer(self, customer_data: Dict[str, Any]) -> Optional[str]:
         """
@@ -29,38 +271,27 @@ class GenericSupabaseClient:
         Returns:
             Optional[str]: 顧客ID、失敗時はNone
         """
+        upsert_data = None
         try:
-            # IDまたはemailが必要
-            customer_id = customer_data.get("id")
-            email = customer_data.get("email")
-            
-            if not customer_id and not email:
-                print("[Supabase Client] 顧客IDまたはメールアドレスが必要です")
+            upsert_data = self.build_customer_row(customer_data)
+            if not upsert_data:
                 return None
+            customer_id = upsert_data["id"]
             
-            # IDがない場合はemailをIDとして使用（emailが存在する場合）
-            if not customer_id and email:
-                customer_id = email
-                print(f"[Supabase Client] 顧客IDがないため、emailをIDとして使用します: {email}")
-            
-            # upsert用のデータを準備
-            upsert_data = {
-                "id": customer_id,
-                "name": customer_data.get("name"),
-                "email": email,
-                "phone": customer_data.get("phone"),
-                "postal_code": customer_data.get("postal_code"),
-                "address": customer_data.get("address"),
-            }
-            
-            # None値を削除
-            upsert_data = {k: v for k, v in upsert_data.items() if v is not None}
+            cached_customer_id = self.customer_cache.lookup(upsert_data)
+            if cached_customer_id:
+                self.skipped_records["customers"] += 1
+                print(f"[Supabase Client] 顧客情報に変更がないため、保存をスキップしました (ID: {cached_customer_id})")
+                return cached_customer_id
             
             print(f"[Supabase Client] 顧客情報を保存しています... (ID: {upsert_data.get('id')}, Email: {upsert_data.get('email')})")
-            result = self.supabase.table("customers").upsert(upsert_data).execute()
+            result = self.request_policy.execute(self.supabase.table("customers").upsert(upsert_data), "customersのupsert")
             
             if result.data:
                 customer_id = result.data[0].get("id") if isinstance(result.data, list) else result.data.get("id")
+                if self.fingerprint_index:
+                    self.fingerprint_index.record("customers", [upsert_data])
+                self.customer_cache.store(upsert_data, customer_id)
                 print(f"[Supabase Client] 顧客情報の保存が完了しました (ID: {customer_id})")
                 return customer_id
             else:
@@ -71,6 +302,8 @@ class GenericSupabaseClient:
             print(f"[Supabase Client] 顧客情報の保存エラー: {e}")
             import traceback
             traceback.print_exc()
+            if upsert_data:
+                self.spool_rows("customers", [upsert_data], e)
             return None
     
     def upsert_order(self, order_data: Dict[str, Any], customer_id: Optional[str] = None, platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Optional[str]:
@@ -87,35 +320,24 @@ class GenericSupabaseClient:
         Returns:
             Optional[str]: 注文ID、失敗時はNone
         """
+        upsert_data = None
         try:
-            if not order_data.get("order_id"):
-                print("[Supabase Client] 注文IDが必要です")
+            upsert_data = self.build_order_row(order_data, customer_id, platform, user_id, job_id)
+            if not upsert_data:
                 return None
             
-            # upsert用のデータを準備
-            upsert_data = {
-                "id": order_data.get("order_id"),
-                "order_number": order_data.get("order_number"),
-                "platform": platform or order_data.get("platform"),
-                "customer_id": customer_id,
-                "order_date": order_data.get("order_date"),
-                "status": order_data.get("status") or "未処理",
-                "total_amount": order_data.get("total_amount"),
-                "payment_method": order_data.get("payment_method"),
-                "shipping_fee": order_data.get("shipping_fee") or 0,
-                "tax": order_data.get("tax") or 0,
-                "user_id": user_id or order_data.get("user_id"),
-                "job_id": job_id or order_data.get("job_id"),
-            }
-            
-            # None値を削除
-            upsert_data = {k: v for k, v in upsert_data.items() if v is not None}
+            if self.fingerprint_index and not self.fingerprint_index.is_changed("orders", upsert_data):
+                self.skipped_records["orders"] += 1
+                print(f"[Supabase Client] 注文情報に変更がないため、保存をスキップしました (ID: {upsert_data['id']})")
+                return upsert_data["id"]
             
             print(f"[Supabase Client] 注文情報を保存しています... (Order ID: {upsert_data.get('id')})")
-            result = self.supabase.table("orders").upsert(upsert_data).execute()
+            result = self.request_policy.execute(self.supabase.table("orders").upsert(upsert_data), "ordersのupsert")
             
             if result.data:
                 order_id = result.data[0].get("id") if isinstance(result.data, list) else result.data.get("id")
+                if self.fingerprint_index:
+                    self.fingerprint_index.record("orders", [upsert_data])
                 print(f"[Supabase Client] 注文情報の保存が完了しました (ID: {order_id})")
                 return order_id
             else:
@@ -126,6 +348,8 @@ class GenericSupabaseClient:
             print(f"[Supabase Client] 注文情報の保存エラー: {e}")
             import traceback
             traceback.print_exc()
+            if upsert_data:
+                self.spool_rows("orders", [upsert_data], e)
             return None
     
     def upsert_order_items(self, order_items: List[Dict[str, Any]], order_id: str) -> int:
@@ -137,44 +361,99 @@ class GenericSupabaseClient:
             order_id: 注文ID
         
         Returns:
-            int: 保存した商品数
+            int: 保存した商品数（変更がなく送信をスキップした商品を含む）
         """
+        upsert_data_list = []
         try:
             if not order_items:
                 print("[Supabase Client] 注文商品がありません")
                 return 0
             
-            upsert_data_list = []
-            for idx, item in enumerate(order_items):
-                upsert_data = {
-                    "id": f"{order_id}-{idx+1}",  # 複合キーとして使用
-                    "order_id": order_id,
-                    "product_id": item.get("product_id"),
-                    "product_name": item.get("product_name"),
-                    "quantity": item.get("quantity") or 1,
-                    "unit": item.get("unit") or "kg",  # 単位（デフォルトはkg）
-                    "price": item.get("price"),
-                    "subtotal": item.get("subtotal"),
-                    "sku": item.get("sku"),
-                }
-                
-                # None値を削除
-                upsert_data = {k: v for k, v in upsert_data.items() if v is not None}
-                upsert_data_list.append(upsert_data)
+            upsert_data_list = self.build_order_item_rows(order_items, order_id)
+            keep_ids = [row["id"] for row in upsert_data_list]
+            
+            unchanged_count = 0
+            if self.fingerprint_index:
+                changed_list = self.fingerprint_index.filter_changed("order_items", upsert_data_list)
+                unchanged_count = len(upsert_data_list) - len(changed_list)
+                if unchanged_count:
+                    self.skipped_records["items"] += unchanged_count
+                    print(f"[Supabase Client] {unchanged_count}件の注文商品に変更がないため、保存をスキップします")
+                if not changed_list:
+                    self.delete_orphan_items(order_id, keep_ids, items_changed=False)
+                    return unchanged_count
+                upsert_data_list = changed_list
             
             print(f"[Supabase Client] {len(upsert_data_list)}件の注文商品を保存しています...")
-            result = self.supabase.table("order_items").upsert(upsert_data_list).execute()
+            result = self.request_policy.execute(self.supabase.table("order_items").upsert(upsert_data_list), "order_itemsのupsert")
             
             saved_count = len(result.data) if result.data else 0
+            if saved_count and self.fingerprint_index:
+                self.fingerprint_index.record("order_items", upsert_data_list)
             print(f"[Supabase Client] {saved_count}件の注文商品の保存が完了しました")
-            return saved_count
+            self.delete_orphan_items(order_id, keep_ids)
+            return saved_count + unchanged_count
             
         except Exception as e:
             print(f"[Supabase Client] 注文商品の保存エラー: {e}")
             import traceback
             traceback.print_exc()
+            self.spool_rows("order_items", upsert_data_list, e)
             return 0
     
+    def known_orphan_item_ids(self, order_id: str, keep_ids: List[str]) -> List[str]:
+        """
+        フィンガープリント索引から、今回の商品一覧にない保存済みの注文商品IDを返す
+        
+        Args:
+            order_id: 注文ID
+            keep_ids: 今回保存する注文商品IDのリスト
+        
+        Returns:
+            List[str]: 削除が必要な注文商品ID（索引がない場合は空）
+        """
+        if not self.fingerprint_index:
+            return []
+        keep = set(keep_ids)
+        return [
+            row_id for row_id in self.fingerprint_index.known_ids("order_items", f"{order_id}-")
+            if row_id not in keep and is_order_item_id(order_id, row_id)
+        ]
+    
+    def delete_orphan_items(self, order_id: str, keep_ids: List[str], items_changed: bool = True) -> int:
+        """
+        今回の商品一覧にない注文商品（BASE側で削除・変更された商品、旧形式のID）を削除
+        商品に変更がなく、索引にも不要な商品がない場合はリクエストを送らない
+        
+        Args:
+            order_id: 注文ID
+            keep_ids: 今回保存した注文商品IDのリスト（空の場合は何もしない）
+            items_changed: 今回upsertした商品があるか
+        
+        Returns:
+            int: 削除した注文商品数
+        """
+        if not keep_ids:
+            return 0
+        known_orphans = self.known_orphan_item_ids(order_id, keep_ids)
+        if self.fingerprint_index and not items_changed and not known_orphans:
+            return 0
+        try:
+            result = self.request_policy.execute(
+                self.supabase.table("order_items").delete().eq("order_id", order_id).not_.in_("id", keep_ids),
+                "order_itemsの削除"
+            )
+            deleted_ids = [row.get("id") for row in result.data or []]
+        except Exception as e:
+            # 削除に失敗しても次回の同期で再度削除されるため、保存処理は続行する
+            print(f"[Supabase Client] 不要な注文商品の削除エラー: {e}")
+            return 0
+        if self.fingerprint_index:
+            self.fingerprint_index.forget("order_items", set(deleted_ids) | set(known_orphans))
+        if deleted_ids:
+            print(f"[Supabase Client] 商品一覧にない注文商品を{len(deleted_ids)}件削除しました (Order ID: {order_id})")
+        return len(deleted_ids)
+    
     def save_order_data(self, parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, int]:
         """
         解析済みの注文データをSupabaseに保存
@@ -194,6 +473,9 @@ class GenericSupabaseClient:
             "items": 0
         }
         
+        if self.config.save_mode == "rpc":
+            return self.save_order_data_rpc(parsed_data, platform, user_id, job_id)
+        
         try:
             # 1. 顧客情報を保存
             customer_id = None
@@ -201,10 +483,15 @@ class GenericSupabaseClient:
                 customer_data = parsed_data["customer"].copy()
                 customer_data["platform"] = platform
                 customer_data["user_id"] = user_id
+                spooled_before = self.spooled_records["customers"]
                 customer_id = self.upsert_customer(customer_data)
                 if customer_id:
                     saved_records["customers"] = 1
                     print(f"[Supabase Client] ✓ 顧客情報を保存しました (ID: {customer_id})")
+                elif self.spooled_records["customers"] > spooled_before:
+                    # スプールに退避した顧客に注文を紐づけておく（再送は顧客 → 注文の順）
+                    customer_id = self.build_customer_row(customer_data)["id"]
+                    print(f"[Supabase Client] ⚠ 顧客情報をスプールに退避しました (ID: {customer_id})")
                 else:
                     print("[Supabase Client] ⚠ 顧客情報の保存をスキップしました")
             else:
@@ -212,18 +499,27 @@ class GenericSupabaseClient:
             
             # 2. 注文情報を保存
             order_id = None
+            order_spooled = False
             if parsed_data.get("order") and parsed_data["order"]:
+                spooled_before = self.spooled_records["orders"]
                 order_id = self.upsert_order(parsed_data["order"], customer_id, platform, user_id, job_id)
                 if order_id:
                     saved_records["orders"] = 1
                     print(f"[Supabase Client] ✓ 注文情報を保存しました (ID: {order_id})")
+                elif self.spooled_records["orders"] > spooled_before:
+                    order_spooled = True
+                    print("[Supabase Client] ⚠ 注文情報をスプールに退避しました")
                 else:
                     print("[Supabase Client] ⚠ 注文情報の保存をスキップしました")
             else:
                 print("[Supabase Client] ⚠ 注文情報がありません。スキップします")
             
             # 3. 注文商品を保存
-            if order_id and parsed_data.get("order_items") and parsed_data["order_items"]:
+            if order_spooled and parsed_data.get("order_items"):
+                # 注文が未保存のため、注文商品も保存を試みずにスプールへ退避（再送は注文の後）
+                spooled_order_id = self.build_order_row(parsed_data["order"], customer_id, platform, user_id, job_id)["id"]
+                self.spool_rows("order_items", self.build_order_item_rows(parsed_data["order_items"], spooled_order_id))
+            elif order_id and parsed_data.get("order_items") and parsed_data["order_items"]:
                 item_count = self.upsert_order_items(parsed_data["order_items"], order_id)
                 if item_count > 0:
                     saved_records["items"] = item_count
@@ -240,6 +536,13 @@ class GenericSupabaseClient:
             if total_saved > 0:
                 print(f"\n[Supabase Client] ✓ 合計 {total_saved}件のデータをSupabaseに保存しました")
                 print(f"[Supabase Client] 保存内訳: 顧客={saved_records['customers']}, 注文={saved_records['orders']}, 商品={saved_records['items']}")
+                if any(self.skipped_records.values()):
+                    skipped = self.skipped_records
+                    print(f"[Supabase Client] うち変更なしで送信をスキップ: 顧客={skipped['customers']}, 注文={skipped['orders']}, 商品={skipped['items']}")
+            elif any(self.spooled_records.values()):
+                spooled = self.spooled_records
+                print(f"\n[Supabase Client] ⚠ Supabaseに保存できなかったため、スプールに退避しました: 顧客={spooled['customers']}, 注文={spooled['orders']}, 商品={spooled['items']}")
+                print("[Supabase Client] バックグラウンドで再送されます（python -m rpa.utils.write_spool --status で確認）")
             else:
                 print("\n[Supabase Client] ⚠ 保存されたデータがありません")
                 print("[Supabase Client] デバッグ情報:")
@@ -256,4 +559,125 @@ class GenericSupabaseClient:
             print("[Supabase Client] デバッグ情報:")
             print(f"  - 解析データ: {parsed_data}")
             return saved_records
-
+    
+    def save_order_data_rpc(self, parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> Dict[str, int]:
+        """
+        解析済みの注文データをsave_order_graphs RPCで保存（顧客・注文・注文商品を1トランザクションで保存）
+        
+        Args:
+            parsed_data: parse_base_order_json()で解析されたデータ
+            platform: プラットフォーム名
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+        
+        Returns:
+            Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}
+        """
+        graph = self.build_order_graph(parsed_data, platform, user_id, job_id)
+        if not graph:
+            print("[Supabase Client] ⚠ 注文IDがないため、保存をスキップします")
+            return {"customers": 0, "orders": 0, "items": 0}
+        try:
+            saved_records = self.save_order_graphs([graph])
+            print(f"[Supabase Client] ✓ 注文を保存しました (ID: {graph['id']}, 顧客={saved_records['customers']}, 注文={saved_records['orders']}, 商品={saved_records['items']})")
+            return saved_records
+        except Exception as e:
+            print(f"[Supabase Client] 注文の保存エラー（RPC）: {e}")
+            import traceback
+            traceback.print_exc()
+            if self.spool_rows(ORDER_GRAPHS_TABLE, [graph], e):
+                print("[Supabase Client] ⚠ 注文をスプールに退避しました（バックグラウンドで再送されます）")
+            return {"customers": 0, "orders": 0, "items": 0}
+    
+    def get_write_queue(self) -> WriteBehindQueue:
+        """
+        書き込みキューを取得（初回呼び出し時に書き込みスレッドを起動）
+        
+        Returns:
+            WriteBehindQueue: このクライアントのupsert_rows()で書き込むキュー
+        """
+        if self.write_queue is None:
+            self.write_queue = WriteBehindQueue(self.upsert_rows)
+            # バッチの書き込みに失敗した行はスプールに退避する
+            self.write_queue.on_failure = self._on_write_failure
+        return self.write_queue
+    
+    def _on_write_failure(self, table: str, rows: List[Dict[str, Any]], error: Exception) -> None:
+        """書き込みキューで書き込めなかった行の注文IDを記録し、スプールに退避"""
+        for row in rows:
+            if table == "order_items":
+                order_id = row.get("order_id")
+            elif table in ("orders", ORDER_GRAPHS_TABLE):
+                order_id = row.get("id")
+            else:
+                continue
+            if order_id:
+                self.failed_order_ids.add(str(order_id))
+        self.spool_rows(table, rows, error)
+    
+    def enqueue_order_data(self, parsed_data: Dict[str, Any], platform: Optional[str] = None, user_id: Optional[str] = None, job_id: Optional[str] = None) -> bool:
+        """
+        解析済みの注文データを書き込みキューに追加（Supabaseへの書き込みを待たずに戻る）
+        書き込み結果はflush_writes()で確認する
+        
+        Args:
+            parsed_data: parse_base_order_json()で解析されたデータ
+            platform: プラットフォーム名（base, shopify, rakuten, furusato, tabechoku）
+            user_id: ユーザーID（RLS用）
+            job_id: RPA実行ジョブID
+        
+        Returns:
+            bool: キューに追加できた場合True（注文IDがない場合はFalse）
+        """
+        customer_row = self.build_customer_row(parsed_data["customer"]) if parsed_data.get("customer") else None
+        customer_id = customer_row["id"] if customer_row else None
+        order_row = self.build_order_row(parsed_data.get("order") or {}, customer_id, platform, user_id, job_id)
+        if not order_row:
+            return False
+        
+        write_queue = self.get_write_queue()
+        if self.config.save_mode == "rpc":
+            # 注文グラフ単位でキューに積み、バッチごとに1回のRPCで保存
+            write_queue.put(ORDER_GRAPHS_TABLE, [self.build_order_graph(parsed_data, platform, user_id, job_id)])
+            return True
+        if customer_row and not self.customer_cache.lookup(customer_row):
+            write_queue.put("customers", [customer_row])
+        write_queue.put("orders", [order_row])
+        if parsed_data.get("order_items"):
+            item_rows = self.build_order_item_rows(parsed_data["order_items"], order_row["id"])
+            keep_ids = [row["id"] for row in item_rows]
+            items_changed = not self.fingerprint_index or bool(self.fingerprint_index.filter_changed("order_items", item_rows))
+            write_queue.put("order_items", item_rows)
+            if items_changed or self.known_orphan_item_ids(order_row["id"], keep_ids):
+                # 注文商品の書き込み後に、商品一覧にない注文商品を削除する
+                write_queue.put(ORPHAN_ITEMS_TABLE, [{"id": order_row["id"], "keep": keep_ids}])
+        return True
+    
+    def flush_writes(self, timeout: float = 60.0) -> Dict[str, int]:
+        """
+        書き込みキューの内容をすべて書き込み、保存件数を返す
+        
+        Args:
+            timeout: 最大待機時間（秒）
+        
+        Returns:
+            Dict[str, int]: 保存レコード数 {customers: int, orders: int, items: int}
+        """
+        if self.write_queue is None:
+            return {"customers": 0, "orders": 0, "items": 0}
+        if not self.write_queue.flush(timeout):
+            print(f"[Supabase Client] ⚠ {timeout}秒以内に書き込みが完了しませんでした（残り{self.write_queue.pending()}件）")
+        if self.config.save_mode == "rpc":
+            return dict(self.graph_saved_records)
+        written = self.write_queue.written
+        return {"customers": written["customers"], "orders": written["orders"], "items": written["order_items"]}
+    
+    def close(self, timeout: float = 60.0) -> None:
+        """
+        書き込みキューを閉じる（残りの行を書き込んでから書き込みスレッドを終了）
+        
+        Args:
+            timeout: 最大待機時間（秒）
+        """
+        if self.write_queue is not None:
+            self.write_queue.close(timeout)
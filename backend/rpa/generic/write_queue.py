@@ -0,0 +1,152 @@
+"""
+Supabase書き込みキュー（write-behind）
+スクレイピング側は行をキューに積むだけで次の処理に進み、
+専用の書き込みスレッドがテーブルごとにバッチにまとめてupsertする
+"""
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, List, Optional, Callable
+
+
+# 外部キーの順序（顧客 → 注文 → 注文商品）でフラッシュする
+TABLE_ORDER = ("customers", "orders", "order_items")
+
+
+class WriteBehindQueue:
+    """バッチ化・バックプレッシャー付きの書き込みキュー"""
+
+    def __init__(
+        self,
+        writer: Callable[[str, List[Dict[str, Any]]], int],
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        name: str = "supabase-writer"
+    ):
+        """
+        初期化
+
+        Args:
+            writer: (テーブル名, 行のリスト) を受け取って保存件数を返す関数（失敗時は例外を送出）
+            batch_size: 1回のupsertにまとめる最大行数（未指定の場合は環境変数RPA_WRITE_BATCH_SIZE、デフォルト: 200）
+            flush_interval: バッチがたまらなくても書き込むまでの最大待機時間（秒、環境変数RPA_WRITE_FLUSH_INTERVAL、デフォルト: 1.0）
+            max_pending: 書き込み待ちの最大件数。超えるとput()が待機する（環境変数RPA_WRITE_MAX_PENDING、デフォルト: 5000）
+            name: 書き込みスレッド名
+        """
+        self.writer = writer
+        self.batch_size = batch_size or int(os.getenv("RPA_WRITE_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("RPA_WRITE_FLUSH_INTERVAL", "1.0"))
+        max_pending = max_pending or int(os.getenv("RPA_WRITE_MAX_PENDING", "5000"))
+
+        self.written: Dict[str, int] = {table: 0 for table in TABLE_ORDER}
+        self.failed: Dict[str, int] = {table: 0 for table in TABLE_ORDER}
+        self.on_failure: Optional[Callable[[str, List[Dict[str, Any]], Exception], None]] = None
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._buffers: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, table: str, rows: List[Dict[str, Any]], timeout: Optional[float] = None) -> None:
+        """
+        行をキューに追加（キューが満杯の場合は空くまで待機 = バックプレッシャー）
+
+        Args:
+            table: テーブル名
+            rows: upsert用の行のリスト
+            timeout: 最大待機時間（秒、Noneの場合は無制限）
+
+        Raises:
+            RuntimeError: close()後に呼び出した場合
+            queue.Full: timeout内にキューが空かなかった場合
+        """
+        if self._closed:
+            raise RuntimeError("書き込みキューはすでに閉じられています")
+        for row in rows:
+            self._queue.put((table, row), timeout=timeout)
+
+    def pending(self) -> int:
+        """書き込み待ちの行数を返す"""
+        return self._queue.qsize() + sum(len(buffer) for buffer in self._buffers.values())
+
+    def flush(self, timeout: float = 60.0) -> bool:
+        """
+        キューに積まれた行がすべて書き込まれるまで待機
+
+        Args:
+            timeout: 最大待機時間（秒）
+
+        Returns:
+            bool: すべて書き込まれた場合True
+        """
+        marker = threading.Event()
+        self._queue.put((None, marker))
+        return marker.wait(timeout)
+
+    def close(self, timeout: float = 60.0) -> bool:
+        """
+        残りの行を書き込んでから書き込みスレッドを終了
+
+        Args:
+            timeout: 最大待機時間（秒）
+
+        Returns:
+            bool: すべて書き込まれた場合True
+        """
+        if self._closed:
+            return True
+        flushed = self.flush(timeout)
+        self._closed = True
+        self._queue.put((None, None))
+        self._thread.join(timeout=5)
+        return flushed
+
+    def _run(self) -> None:
+        """書き込みスレッドのメインループ"""
+        buffered = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                table, item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                table, item = None, False
+
+            if table is not None:
+                # 同じIDの行は最後のものだけ残す（1回のupsertで同じ行を2回更新できないため）
+                buffer = self._buffers.setdefault(table, {})
+                row_key = str(item.get("id")) if item.get("id") is not None else f"__row_{len(buffer)}"
+                buffer[row_key] = item
+                buffered += 1
+                if buffered < self.batch_size and time.monotonic() < deadline:
+                    continue
+
+            # バッチサイズ・時間経過・flush/closeのいずれかで書き込む
+            self._flush_buffers()
+            buffered = 0
+            deadline = time.monotonic() + self.flush_interval
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif table is None and item is None:
+                return
+
+    def _flush_buffers(self) -> None:
+        """バッファの行をテーブル順にupsert"""
+        tables = list(TABLE_ORDER) + [table for table in self._buffers if table not in TABLE_ORDER]
+        for table in tables:
+            buffer = self._buffers.pop(table, None)
+            if not buffer:
+                continue
+            rows = list(buffer.values())
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    self.written[table] = self.written.get(table, 0) + self.writer(table, batch)
+                except Exception as e:
+                    self.failed[table] = self.failed.get(table, 0) + len(batch)
+                    print(f"[WriteQueue] {table}への{len(batch)}件の書き込みに失敗しました: {e}")
+                    if self.on_failure:
+                        self.on_failure(table, batch, e)
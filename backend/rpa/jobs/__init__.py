@@ -0,0 +1,3 @@
+"""
+RPAジョブ管理モジュール
+"""
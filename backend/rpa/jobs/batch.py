@@ -0,0 +1,172 @@
+"""
+RPAバッチ実行
+複数のターゲットURL・プラットフォームを (ユーザー, プラットフォーム) ごとにまとめ、
+1グループ1ブラウザ（1回のログイン）でワーカープール上で実行する
+"""
+import json
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from rpa.jobs.fairness import PRIORITY_INTERACTIVE, normalize_priority
+from rpa.jobs.pool import WorkerPool, dispatch_job
+from rpa.jobs.registry import Job, get_job_registry
+from rpa.platforms import PLATFORM_RPA_MODULES, get_platform_runner
+
+
+def generic_dedupe_key(user_id: Optional[str], platform: Optional[str], login_url: Optional[str], target_urls: List[str]) -> Tuple:
+    """
+    汎用RPAのジョブの重複判定キー（/run-generic-rpaと定期実行で共通にし、同じ取得を重ねて実行しない）
+
+    Args:
+        user_id: ユーザーID
+        platform: プラットフォーム名
+        login_url: ログイン後のURL
+        target_urls: データ取得対象のURLのリスト
+
+    Returns:
+        Tuple: JobRegistry.get_or_create()のdedupe_key
+    """
+    return ("generic", user_id, (platform or "").lower() or None, login_url, tuple(target_urls))
+
+
+def group_targets(targets: List[Dict[str, Any]], user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    ターゲットを (ユーザー, プラットフォーム) ごとのグループにまとめる
+
+    Args:
+        targets: ターゲットのリスト（platform, target_url, login_url, user_id）
+            target_urlがある場合は汎用RPA、ない場合はプラットフォーム固有RPAで実行する
+        user_id: ターゲットにuser_idがない場合に使うユーザーID
+
+    Returns:
+        List[Dict[str, Any]]: グループのリスト {kind, user_id, platform, login_url, target_urls}
+
+    Raises:
+        ValueError: サポートされていないプラットフォーム、またはlogin_urlのないグループがある場合
+    """
+    groups: "OrderedDict[Tuple[Optional[str], Optional[str], str], Dict[str, Any]]" = OrderedDict()
+    for target in targets:
+        target_user_id = target.get("user_id") or user_id
+        platform = (target.get("platform") or "").lower() or None
+        if target.get("target_url"):
+            group = groups.setdefault((target_user_id, platform, "generic_batch"), {
+                "kind": "generic_batch",
+                "user_id": target_user_id,
+                "platform": platform,
+                "login_url": None,
+                "target_urls": [],
+            })
+            group["login_url"] = group["login_url"] or target.get("login_url")
+            # 同じURLは1回だけ取得する
+            if target["target_url"] not in group["target_urls"]:
+                group["target_urls"].append(target["target_url"])
+        else:
+            if platform not in PLATFORM_RPA_MODULES:
+                raise ValueError(f"サポートされていないプラットフォーム: {platform}")
+            groups.setdefault((target_user_id, platform, "rpa"), {
+                "kind": "rpa",
+                "user_id": target_user_id,
+                "platform": platform,
+                "login_url": None,
+                "target_urls": [],
+            })
+
+    for group in groups.values():
+        if group["kind"] == "generic_batch" and not group["login_url"]:
+            raise ValueError(f"login_urlが指定されていません（platform: {group['platform']}, user_id: {group['user_id']}）")
+    return list(groups.values())
+
+
+def run_group(group: Dict[str, Any], job_id: str, headless: bool = False) -> Any:
+    """
+    1グループを現在のスレッドで実行（ワーカープール・ワーカープロセスから呼び出す）
+
+    Args:
+        group: group_targets()で作成したグループ（kindがgenericの場合はtarget_urlsの1件目だけを取得する）
+            unattendedがTrueの場合（定期実行）は手動ログインを待機しない
+        job_id: グループのジョブID
+        headless: ヘッドレスモードで実行するか（汎用RPAのみ）
+
+    Returns:
+        Any: 汎用RPAの場合は実行結果のdict、プラットフォーム固有RPAの場合は成否
+        （汎用RPAのバッチと同じく、取得・保存が終わったらブラウザを閉じてワーカーの枠を空ける）
+    """
+    if group["kind"] == "generic":
+        from rpa.generic.main import run_generic_rpa
+        return run_generic_rpa(
+            login_url=group["login_url"],
+            target_url=group["target_urls"][0],
+            headless=headless,
+            platform=group["platform"],
+            user_id=group["user_id"],
+            job_id=job_id
+        )
+    if group["kind"] == "generic_batch":
+        from rpa.generic.main import run_generic_rpa_batch
+        return run_generic_rpa_batch(
+            login_url=group["login_url"],
+            target_urls=group["target_urls"],
+            headless=headless,
+            platform=group["platform"],
+            user_id=group["user_id"],
+            job_id=job_id,
+            unattended=bool(group.get("unattended"))
+        )
+    run_rpa_func = get_platform_runner(group["platform"])
+    if not run_rpa_func:
+        raise RuntimeError(f"RPA関数が見つかりません: run_{group['platform']}_rpa")
+    return run_rpa_func(job_id=job_id, user_id=group["user_id"], keep_open=False)
+
+
+def submit_batch(
+    targets: List[Dict[str, Any]],
+    user_id: Optional[str] = None,
+    headless: bool = False,
+    pool: Optional[WorkerPool] = None,
+    idempotency_key: Optional[str] = None,
+    priority: str = PRIORITY_INTERACTIVE
+) -> Tuple[Job, bool]:
+    """
+    ターゲットをグループにまとめてワーカープールに追加し、バッチのジョブを返す
+    バッチのジョブは子ジョブ（グループ）の進捗を集計し、すべてのグループが終了したら終了する
+    同じ内容のバッチが実行中の場合、または同じ冪等キーのバッチがある場合は新しく実行せずにそれを返す
+
+    Args:
+        targets: ターゲットのリスト（platform, target_url, login_url, user_id）
+        user_id: ターゲットにuser_idがない場合に使うユーザーID
+        headless: ヘッドレスモードで実行するか
+        pool: 実行するワーカープール（未指定の場合はプロセス共通のプール、RPA_EXECUTION_MODE=queueの場合は使用しない）
+        idempotency_key: クライアントが指定した冪等キー
+        priority: 優先度クラス（interactive, scheduled, backfill、過去分の大量取り込みはbackfillを指定する）
+
+    Returns:
+        Tuple[Job, bool]: (バッチのジョブ（childrenに各グループのジョブ）, 新しく登録した場合True)
+
+    Raises:
+        ValueError: ターゲットが空、グループにまとめられない、優先度が不明、または冪等キーが別の内容で使用済みの場合
+    """
+    priority = normalize_priority(priority)
+    groups = group_targets(targets, user_id)
+    if not groups:
+        raise ValueError("ターゲットが指定されていません")
+
+    registry = get_job_registry()
+    dedupe_key = ("batch", user_id, headless, json.dumps(groups, sort_keys=True))
+    batch, created = registry.get_or_create(
+        str(uuid.uuid4()), "batch", user_id=user_id, dedupe_key=dedupe_key, idempotency_key=idempotency_key
+    )
+    if not created:
+        return batch, False
+    # 先にすべての子ジョブを登録してから実行する（途中で集計が完了とみなされないように）
+    children = [
+        (registry.create(str(uuid.uuid4()), group["kind"], group["platform"], group["user_id"], parent=batch), group)
+        for group in groups
+    ]
+    target_count = sum(len(group["target_urls"]) or 1 for group in groups)
+    batch.emit("queued", f"{len(groups)}グループ（{target_count}件）を登録しました", groups=len(groups), targets=target_count)
+
+    for job, group in children:
+        dispatch_job(job, dict(group, headless=headless, priority=priority), pool)
+    print(f"[Batch] バッチを登録しました (Batch ID: {batch.job_id}, {len(groups)}グループ, {target_count}件)")
+    return batch, True
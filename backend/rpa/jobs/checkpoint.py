@@ -0,0 +1,173 @@
+"""
+RPA実行のチェックポイント
+ログイン後・データ取得後・保存のまとまりごとに進捗をローカルのSQLiteに記録し、
+ブラウザのクラッシュやプロセスの停止で中断した実行を、次の実行で最後のチェックポイントから再開する
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from rpa.jobs.registry import report
+
+
+# チェックポイントのステージ
+STAGE_LOGGED_IN = "logged_in"  # ログイン済み
+STAGE_EXTRACTED = "extracted"  # データを取得済み（未保存）
+STAGE_SAVED = "saved"  # 保存済み（バッチの場合は保存済みのターゲットまで）
+
+
+def checkpoint_key(kind: str, user_id: Optional[str], platform: Optional[str], *parts: Any) -> str:
+    """
+    同じ内容の実行を表すチェックポイントのキー（ジョブIDが変わっても再実行で同じキーになる）
+
+    Args:
+        kind: 実行方法（rpa, generic, generic_batch）
+        user_id: ユーザーID
+        platform: プラットフォーム名
+        *parts: URLなどの実行内容
+
+    Returns:
+        str: キー
+    """
+    serialized = json.dumps([kind, user_id, platform, list(parts)], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """SQLiteに保存するチェックポイント"""
+
+    def __init__(self, db_path: Optional[str] = None, ttl: Optional[float] = None):
+        """
+        初期化
+
+        Args:
+            db_path: SQLiteファイルのパス（未指定の場合は環境変数RPA_CHECKPOINT_DB、デフォルト: checkpoints.sqlite3）
+            ttl: 再開に使う期間（秒、環境変数RPA_CHECKPOINT_TTL、デフォルト: 3600）
+                これより古いチェックポイントは使わずに最初から実行する（取得したデータが古くなっているため）
+        """
+        self.db_path = db_path or os.getenv("RPA_CHECKPOINT_DB", "checkpoints.sqlite3")
+        self.ttl = ttl or float(os.getenv("RPA_CHECKPOINT_TTL", "3600"))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " key TEXT PRIMARY KEY,"
+            " job_id TEXT,"
+            " stage TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        チェックポイントを取得
+
+        Args:
+            key: checkpoint_key()で作成したキー
+
+        Returns:
+            Optional[Dict[str, Any]]: {job_id, stage, state, updated_at}（ない場合・期限切れの場合はNone）
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, stage, state, updated_at FROM checkpoints WHERE key = ?", (key,)
+            ).fetchone()
+        if not row or row[3] < time.time() - self.ttl:
+            return None
+        return {"job_id": row[0], "stage": row[1], "state": json.loads(row[2]), "updated_at": row[3]}
+
+    def save(self, key: str, job_id: Optional[str], stage: str, state: Dict[str, Any]) -> None:
+        """
+        チェックポイントを記録（同じキーの記録は上書き）
+
+        Args:
+            key: checkpoint_key()で作成したキー
+            job_id: 記録したジョブID
+            stage: ステージ（logged_in, extracted, saved）
+            state: 再開に必要な情報（JSONに変換できる値）
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, job_id, stage, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (key, job_id, stage, json.dumps(state, ensure_ascii=False, default=str), time.time())
+            )
+            self._conn.commit()
+
+    def clear(self, key: str) -> None:
+        """チェックポイントを削除（実行が最後まで終わった場合）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+class Checkpoint:
+    """1回の実行のチェックポイント（記録のたびにジョブの進捗イベントも通知する）"""
+
+    def __init__(self, key: str, job_id: Optional[str] = None, store: Optional["CheckpointStore"] = None):
+        """
+        初期化（前回の実行が途中で終わっていれば、そのチェックポイントを読み込む）
+
+        Args:
+            key: checkpoint_key()で作成したキー
+            job_id: ジョブID
+            store: 保存先（未指定の場合はプロセス共通のもの）
+        """
+        self.key = key
+        self.job_id = job_id
+        self.store = store or get_checkpoint_store()
+        previous = self.store.load(key)
+        self.stage: Optional[str] = previous["stage"] if previous else None
+        self.state: Dict[str, Any] = previous["state"] if previous else {}
+        if previous:
+            print(f"[Checkpoint] 前回の実行（Job ID: {previous['job_id']}）のチェックポイント {self.stage} から再開します")
+            report(job_id, "checkpoint_resumed", f"前回の実行のチェックポイント（{self.stage}）から再開します", checkpoint=self.stage)
+
+    def mark(self, stage: str, **state: Any) -> None:
+        """
+        チェックポイントを記録
+
+        Args:
+            stage: ステージ（logged_in, extracted, saved）
+            **state: 再開に必要な情報（これまでの情報に上書きする）
+        """
+        self.stage = stage
+        self.state.update(state)
+        try:
+            self.store.save(self.key, self.job_id, stage, self.state)
+        except Exception as e:
+            # チェックポイントの記録に失敗しても実行は続ける
+            print(f"[Checkpoint] チェックポイントの記録に失敗しました: {e}")
+        report(self.job_id, "checkpoint", f"チェックポイント: {stage}", checkpoint=stage)
+
+    def clear(self) -> None:
+        """実行が最後まで終わったのでチェックポイントを削除"""
+        self.stage = None
+        self.state = {}
+        try:
+            self.store.clear(self.key)
+        except Exception as e:
+            print(f"[Checkpoint] チェックポイントの削除に失敗しました: {e}")
+
+
+_checkpoint_store: Optional[CheckpointStore] = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """
+    プロセス共通のCheckpointStoreを取得
+
+    Returns:
+        CheckpointStore: 共有インスタンス
+    """
+    global _checkpoint_store
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore()
+        return _checkpoint_store
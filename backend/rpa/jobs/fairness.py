@@ -0,0 +1,154 @@
+"""
+ユーザー（テナント）間の公平なジョブの取り出し
+実行待ちのジョブから次に実行するものを、優先度クラス → ユーザーごとの重み付きの実行数 → 登録順 で選ぶ
+ワーカープール（スレッド実行）と永続キュー（ワーカープロセス）の両方で同じ規則を使う
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Any, List, Optional, Deque
+
+
+# 優先度クラス（先頭ほど優先）
+PRIORITY_INTERACTIVE = "interactive"  # APIから起動した実行（画面で結果を待っている）
+PRIORITY_SCHEDULED = "scheduled"  # 定期実行
+PRIORITY_BACKFILL = "backfill"  # 過去分の取り込みなどの大量の実行
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_SCHEDULED, PRIORITY_BACKFILL)
+
+
+def normalize_priority(priority: Optional[str]) -> str:
+    """
+    優先度クラスを検証
+
+    Args:
+        priority: 優先度クラス（未指定の場合はinteractive）
+
+    Returns:
+        str: 優先度クラス
+
+    Raises:
+        ValueError: 不明な優先度クラスの場合
+    """
+    priority = (priority or PRIORITY_INTERACTIVE).lower()
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"不明な優先度です: {priority}（{', '.join(PRIORITY_CLASSES)}のいずれか）")
+    return priority
+
+
+def _parse_user_values(value: str) -> Dict[str, float]:
+    """"user1:3,user2:0.5" 形式の環境変数をdictに変換"""
+    values = {}
+    for part in value.split(","):
+        if ":" not in part:
+            continue
+        user_id, number = part.rsplit(":", 1)
+        try:
+            values[user_id.strip()] = float(number)
+        except ValueError:
+            print(f"[FairPolicy] 設定値を読み込めません: {part}")
+    return values
+
+
+class FairPolicy:
+    """ユーザーごとの重み・同時実行数の上限を使って次に実行するジョブを選ぶ"""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        caps: Optional[Dict[str, float]] = None,
+        default_cap: Optional[int] = None,
+        window: Optional[float] = None
+    ):
+        """
+        初期化
+
+        Args:
+            weights: ユーザーIDごとの重み（未指定の場合は環境変数RPA_TENANT_WEIGHTS "user:3,user2:0.5"、その他のユーザーは1）
+            caps: ユーザーIDごとの同時実行数の上限（未指定の場合は環境変数RPA_TENANT_CONCURRENCY "user:4"）
+            default_cap: その他のユーザーの同時実行数の上限（未指定の場合は環境変数RPA_TENANT_MAX_CONCURRENCY、デフォルト: 0 = 上限なし）
+            window: 実行数を数える期間（秒、未指定の場合は環境変数RPA_FAIR_WINDOW、デフォルト: 3600）
+        """
+        self.weights = weights if weights is not None else _parse_user_values(os.getenv("RPA_TENANT_WEIGHTS", ""))
+        self.caps = caps if caps is not None else _parse_user_values(os.getenv("RPA_TENANT_CONCURRENCY", ""))
+        self.default_cap = default_cap if default_cap is not None else int(os.getenv("RPA_TENANT_MAX_CONCURRENCY", "0"))
+        self.window = window or float(os.getenv("RPA_FAIR_WINDOW", "3600"))
+        self._started: Dict[Optional[str], Deque[float]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def weight(self, user_id: Optional[str]) -> float:
+        """ユーザーの重み（大きいほど多く実行される）"""
+        return max(0.01, self.weights.get(user_id or "", 1.0))
+
+    def cap(self, user_id: Optional[str]) -> int:
+        """ユーザーの同時実行数の上限（0は上限なし）"""
+        return int(self.caps.get(user_id or "", self.default_cap))
+
+    def record_start(self, user_id: Optional[str], at: Optional[float] = None) -> None:
+        """ジョブの開始を記録（select()でservedを省略した場合に使う）"""
+        with self._lock:
+            self._started[user_id].append(at or time.time())
+
+    def served(self, now: Optional[float] = None) -> Dict[Optional[str], int]:
+        """期間内に開始したジョブ数（ユーザーごと）"""
+        cutoff = (now or time.time()) - self.window
+        with self._lock:
+            for started in self._started.values():
+                while started and started[0] < cutoff:
+                    started.popleft()
+            return {user_id: len(started) for user_id, started in self._started.items() if started}
+
+    def select(
+        self,
+        pending: List[Dict[str, Any]],
+        running: Dict[Optional[str], int],
+        served: Optional[Dict[Optional[str], int]] = None
+    ) -> Optional[int]:
+        """
+        次に実行するジョブを選ぶ
+        1. 優先度クラスが高いもの（interactive → scheduled → backfill）
+        2. (実行中の数 + 期間内に開始した数) / 重み が最も小さいユーザー（大量に登録したユーザーが他のユーザーを待たせない）
+        3. 登録が古いもの
+        同時実行数の上限に達しているユーザーのジョブは選ばない
+
+        Args:
+            pending: 実行待ちのジョブ {user_id, priority, enqueued_at}
+            running: ユーザーごとの実行中のジョブ数
+            served: ユーザーごとの期間内に開始したジョブ数（未指定の場合はrecord_start()の記録）
+
+        Returns:
+            Optional[int]: 選んだジョブのpending内の位置（実行できるジョブがない場合はNone）
+        """
+        served = self.served() if served is None else served
+        best = None
+        best_key = None
+        for index, entry in enumerate(pending):
+            user_id = entry.get("user_id")
+            cap = self.cap(user_id)
+            if cap and running.get(user_id, 0) >= cap:
+                continue
+            priority = entry.get("priority") or PRIORITY_INTERACTIVE
+            rank = PRIORITY_CLASSES.index(priority) if priority in PRIORITY_CLASSES else len(PRIORITY_CLASSES)
+            usage = (running.get(user_id, 0) + served.get(user_id, 0)) / self.weight(user_id)
+            key = (rank, usage, entry.get("enqueued_at") or 0)
+            if best_key is None or key < best_key:
+                best, best_key = index, key
+        return best
+
+
+_fair_policy: Optional[FairPolicy] = None
+_fair_policy_lock = threading.Lock()
+
+
+def get_fair_policy() -> FairPolicy:
+    """
+    プロセス共通のFairPolicyを取得
+
+    Returns:
+        FairPolicy: 共有インスタンス
+    """
+    global _fair_policy
+    with _fair_policy_lock:
+        if _fair_policy is None:
+            _fair_policy = FairPolicy()
+        return _fair_policy
@@ -0,0 +1,159 @@
+"""
+RPAワーカープール
+同時に起動するブラウザ数を上限までに抑え、超えた分のジョブは空きが出るまで待たせる
+空きが出たときは、優先度クラスとユーザーごとの公平性（rpa.jobs.fairness）に従って次のジョブを選ぶ
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, List, Optional
+
+from rpa.jobs.fairness import FairPolicy, get_fair_policy, normalize_priority
+from rpa.jobs.registry import Job, run_job
+
+
+class WorkerPool:
+    """ブラウザを使うジョブを実行するスレッドプール（実行待ちのジョブは公平に取り出す）"""
+
+    def __init__(self, max_workers: Optional[int] = None, policy: Optional[FairPolicy] = None):
+        """
+        初期化
+
+        Args:
+            max_workers: 同時に実行するジョブ数（未指定の場合は環境変数RPA_MAX_BROWSERS、デフォルト: 4）
+            policy: 次に実行するジョブを選ぶ規則（未指定の場合はプロセス共通のもの）
+        """
+        self.max_workers = max_workers or int(os.getenv("RPA_MAX_BROWSERS", "4"))
+        self.policy = policy or get_fair_policy()
+        self._pending: List[Dict[str, Any]] = []
+        self._running: Dict[Optional[str], int] = defaultdict(int)
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, job: Job, target: Callable[[], Any], priority: Optional[str] = None) -> Future:
+        """
+        ジョブをプールに追加（空きがない場合はqueuedのまま待つ）
+
+        Args:
+            job: get_job_registry().create()で登録したジョブ
+            target: 実行する関数（戻り値がdictの場合はsuccessキー、それ以外は真偽値で成否を判定）
+            priority: 優先度クラス（interactive, scheduled, backfill、デフォルト: interactive）
+
+        Returns:
+            Future: 実行の完了を表すFuture
+
+        Raises:
+            ValueError: 不明な優先度クラスの場合
+        """
+        priority = normalize_priority(priority)
+        future: Future = Future()
+        job.emit("queued", f"実行待ちです（同時実行数: {self.max_workers}, 優先度: {priority}）", priority=priority)
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("ワーカープールは停止しています")
+            self._pending.append({
+                "job": job,
+                "target": target,
+                "future": future,
+                "user_id": job.user_id,
+                "priority": priority,
+                "enqueued_at": time.time(),
+            })
+            # 実行中のスレッドが上限に達していなければ増やす
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, name=f"rpa-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify_all()
+        return future
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """実行待ちのジョブ（job_id, user_id, priority, enqueued_at）"""
+        with self._cond:
+            return [
+                {"job_id": entry["job"].job_id, "user_id": entry["user_id"], "priority": entry["priority"], "enqueued_at": entry["enqueued_at"]}
+                for entry in self._pending
+            ]
+
+    def _work(self) -> None:
+        """実行待ちのジョブを取り出して実行する（ワーカーのスレッド）"""
+        while True:
+            with self._cond:
+                index = None
+                while not self._shutdown:
+                    index = self.policy.select(self._pending, self._running)
+                    if index is not None:
+                        break
+                    # 実行できるジョブがない（待ちがない、または全員が上限）間は、ジョブの追加・終了を待つ
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                entry = self._pending.pop(index)
+                self._running[entry["user_id"]] += 1
+                self.policy.record_start(entry["user_id"])
+            try:
+                if entry["future"].set_running_or_notify_cancel():
+                    run_job(entry["job"], entry["target"])
+                    entry["future"].set_result(None)
+            finally:
+                with self._cond:
+                    self._running[entry["user_id"]] -= 1
+                    self._cond.notify_all()
+
+    def shutdown(self, wait: bool = False) -> None:
+        """プールを停止（実行待ちのジョブは実行しない）"""
+        with self._cond:
+            self._shutdown = True
+            pending, self._pending = self._pending, []
+            threads = list(self._threads)
+            self._cond.notify_all()
+        for entry in pending:
+            entry["future"].cancel()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+
+_worker_pool: Optional[WorkerPool] = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """
+    プロセス共通のWorkerPoolを取得
+
+    Returns:
+        WorkerPool: 共有インスタンス
+    """
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool()
+        return _worker_pool
+
+
+def dispatch_job(job: Job, spec: Dict[str, Any], pool: Optional[WorkerPool] = None) -> Optional[Future]:
+    """
+    ジョブを実行方法（環境変数RPA_EXECUTION_MODE）に応じて登録する
+    threadの場合はこのプロセスのワーカープール、queueの場合は永続キュー（ワーカープロセスが実行する）に追加する
+
+    Args:
+        job: get_job_registry()で登録したジョブ
+        spec: 実行内容（batch.group_targets()のグループ + headless, priority）
+        pool: threadの場合に使うワーカープール（未指定の場合はプロセス共通のプール）
+
+    Returns:
+        Optional[Future]: threadの場合は実行の完了を表すFuture、queueの場合はNone
+    """
+    from rpa.jobs.queue import execution_mode, get_job_queue
+    if execution_mode() == "queue":
+        get_job_queue().enqueue(job, spec)
+        return None
+    from rpa.jobs.batch import run_group
+    return (pool or get_worker_pool()).submit(
+        job, lambda: run_group(spec, job.job_id, bool(spec.get("headless"))), spec.get("priority")
+    )
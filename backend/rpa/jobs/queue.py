@@ -0,0 +1,424 @@
+"""
+RPAジョブの永続キュー
+APIサーバーはジョブの内容（spec）をローカルのSQLiteに登録するだけにし、ブラウザの操作は
+別プロセスのワーカー（python -m rpa.worker）が取り出して実行する（RPA_EXECUTION_MODE=queue）
+ワーカーの進捗イベントと結果も同じSQLiteに書き込み、APIサーバーのリレーがジョブ一覧（SSE）に反映する
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from rpa.jobs.fairness import FairPolicy, get_fair_policy, normalize_priority
+from rpa.jobs.registry import Job, JobRegistry, JOB_CANCELLED, JOB_SUCCEEDED, get_job_registry
+
+
+# キュー上のジョブの状態
+QUEUE_QUEUED = "queued"
+QUEUE_RUNNING = "running"
+QUEUE_DONE = "done"
+
+# queued_jobs.cancel_requestedの値（0: キャンセルされていない）
+CANCEL_BY_USER = 1
+CANCEL_TIMED_OUT = 2
+
+
+def execution_mode() -> str:
+    """
+    ジョブの実行方法（環境変数RPA_EXECUTION_MODE）
+
+    Returns:
+        str: thread（APIサーバー内のスレッドで実行、デフォルト） または queue（ワーカープロセスで実行）
+    """
+    return os.getenv("RPA_EXECUTION_MODE", "thread").lower()
+
+
+class JobQueue:
+    """SQLiteに保存するジョブキュー（複数プロセスから同じファイルを共有する）"""
+
+    def __init__(self, db_path: Optional[str] = None, policy: Optional[FairPolicy] = None):
+        """
+        初期化
+
+        Args:
+            db_path: SQLiteファイルのパス（未指定の場合は環境変数RPA_QUEUE_DB、デフォルト: jobs.sqlite3）
+            policy: 次に実行するジョブを選ぶ規則（未指定の場合はプロセス共通のもの）
+        """
+        self.db_path = db_path or os.getenv("RPA_QUEUE_DB", "jobs.sqlite3")
+        self.policy = policy or get_fair_policy()
+        self._lock = threading.Lock()
+        self._relay: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # 取り出しのトランザクションを明示的に制御するためautocommitで接続する
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queued_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " platform TEXT,"
+            " user_id TEXT,"
+            " spec TEXT NOT NULL,"
+            " priority TEXT NOT NULL DEFAULT 'interactive',"
+            " status TEXT NOT NULL,"
+            " worker_id TEXT,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " enqueued_at REAL NOT NULL,"
+            " claimed_at REAL,"
+            " heartbeat_at REAL,"
+            " finished_at REAL)"
+        )
+        # 優先度を追加する前に作成したファイルの場合は列を追加する
+        columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(queued_jobs)").fetchall()]
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE queued_jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'interactive'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS queued_jobs_status ON queued_jobs (status, enqueued_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " job_id TEXT NOT NULL,"
+            " event TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+
+    def enqueue(self, job: Job, spec: Dict[str, Any]) -> None:
+        """
+        ジョブをキューに登録（APIサーバー側）
+        APIサーバーでジョブがキャンセルされた場合は、ワーカーにキャンセルを伝える
+
+        Args:
+            job: get_job_registry()で登録したジョブ
+            spec: 実行内容（batch.run_group()に渡すグループ + headless, priority）
+
+        Raises:
+            ValueError: 不明な優先度クラスの場合
+        """
+        priority = normalize_priority(spec.get("priority"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queued_jobs (job_id, kind, platform, user_id, spec, priority, status, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.job_id, spec["kind"], spec.get("platform"), spec.get("user_id"),
+                 json.dumps(spec, ensure_ascii=False), priority, QUEUE_QUEUED, time.time())
+            )
+        job.listeners.append(lambda event: self._forward_cancel(job.job_id, event))
+        job.emit("queued", f"ワーカーの空きを待っています（優先度: {priority}）", priority=priority)
+        print(f"[JobQueue] ジョブをキューに登録しました (Job ID: {job.job_id}, {spec['kind']})")
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        次に実行するジョブを取り出して実行中にする（ワーカー側、複数プロセスから同時に呼び出してよい）
+        すべてのワーカーの実行中・期間内に開始したジョブ数をもとに、FairPolicyの規則で選ぶ
+
+        Args:
+            worker_id: ワーカーID
+
+        Returns:
+            Optional[Dict[str, Any]]: {job_id, kind, platform, user_id, spec, cancel_requested}（待機中のジョブがない場合はNone）
+        """
+        with self._lock:
+            # BEGIN IMMEDIATEで書き込みロックを取ってから選ぶ（同じジョブを2つのワーカーが取り出さないように）
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                pending = self._conn.execute(
+                    "SELECT * FROM queued_jobs WHERE status = ? ORDER BY enqueued_at LIMIT 1000", (QUEUE_QUEUED,)
+                ).fetchall()
+                running = dict(self._conn.execute(
+                    "SELECT user_id, COUNT(*) FROM queued_jobs WHERE status = ? GROUP BY user_id", (QUEUE_RUNNING,)
+                ).fetchall())
+                served = dict(self._conn.execute(
+                    "SELECT user_id, COUNT(*) FROM queued_jobs WHERE claimed_at >= ? GROUP BY user_id", (now - self.policy.window,)
+                ).fetchall())
+                index = self.policy.select([dict(row) for row in pending], running, served) if pending else None
+                row = pending[index] if index is not None else None
+                if row:
+                    self._conn.execute(
+                        "UPDATE queued_jobs SET status = ?, worker_id = ?, claimed_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                        (QUEUE_RUNNING, worker_id, now, now, row["job_id"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        claimed = dict(row)
+        claimed["spec"] = json.loads(claimed["spec"])
+        return claimed
+
+    def add_event(self, job_id: str, event: Dict[str, Any]) -> None:
+        """
+        ワーカーで記録した進捗イベントを追加（ワーカー側）
+
+        Args:
+            job_id: ジョブID
+            event: {stage, message, data, status, result}
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, event, created_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(event, ensure_ascii=False, default=str), time.time())
+            )
+
+    def complete(self, job_id: str) -> None:
+        """ジョブを終了済みにする（ワーカー側）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queued_jobs SET status = ?, finished_at = ? WHERE job_id = ?",
+                (QUEUE_DONE, time.time(), job_id)
+            )
+
+    def heartbeat(self, job_ids: List[str]) -> Dict[str, bool]:
+        """
+        実行中のジョブの生存を記録し、キャンセルが要求されたジョブを返す（ワーカー側）
+
+        Args:
+            job_ids: ワーカーで実行中のジョブID
+
+        Returns:
+            Dict[str, bool]: キャンセルが要求されたジョブID → 制限時間の超過によるキャンセルか
+        """
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE queued_jobs SET heartbeat_at = ? WHERE job_id IN ({placeholders})", [time.time()] + job_ids
+            )
+            rows = self._conn.execute(
+                f"SELECT job_id, cancel_requested FROM queued_jobs WHERE cancel_requested != 0 AND job_id IN ({placeholders})", job_ids
+            ).fetchall()
+        return {row["job_id"]: row["cancel_requested"] == CANCEL_TIMED_OUT for row in rows}
+
+    def _forward_cancel(self, job_id: str, event: Dict[str, Any]) -> None:
+        """APIサーバーでキャンセルされたジョブのキャンセルをワーカーに伝える（ジョブのlistener）"""
+        if event["stage"] == "cancelling":
+            self.request_cancel(job_id, timed_out=bool(event["data"].get("timed_out")))
+
+    def request_cancel(self, job_id: str, timed_out: bool = False) -> None:
+        """
+        ジョブのキャンセルを要求（APIサーバー側）
+        まだ取り出されていないジョブはその場でキャンセル済みにし、実行中のジョブはワーカーが次の確認時に中断する
+
+        Args:
+            job_id: ジョブID
+            timed_out: 制限時間の超過によるキャンセルの場合True（ワーカー側でチェックポイントを残す）
+        """
+        cancel_requested = CANCEL_TIMED_OUT if timed_out else CANCEL_BY_USER
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queued_jobs SET cancel_requested = ? WHERE job_id = ? AND status != ? AND cancel_requested = 0",
+                (cancel_requested, job_id, QUEUE_DONE)
+            )
+            # 状態を条件に更新し、同時にワーカーが取り出した場合はワーカー側で中断させる
+            cursor = self._conn.execute(
+                "UPDATE queued_jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                (QUEUE_DONE, time.time(), job_id, QUEUE_QUEUED)
+            )
+        if cursor.rowcount:
+            self.add_event(job_id, {
+                "stage": "finished", "message": "実行前にキャンセルされました", "data": {},
+                "status": JOB_CANCELLED, "result": {"success": False, "message": "実行前にキャンセルされました"},
+            })
+
+    def events_after(self, seq: int, limit: int = 500) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        指定した番号より後の進捗イベント（APIサーバー側）
+
+        Returns:
+            List[Tuple[int, str, Dict[str, Any]]]: (番号, ジョブID, イベント) のリスト
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, job_id, event FROM job_events WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+            ).fetchall()
+        return [(row["seq"], row["job_id"], json.loads(row["event"])) for row in rows]
+
+    def last_seq(self) -> int:
+        """最後の進捗イベントの番号"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) AS seq FROM job_events").fetchone()
+        return row["seq"] or 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """キュー上のジョブを取得（登録されていない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM queued_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        """状態ごとのジョブ数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS count FROM queued_jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def fail_stale(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        生存の記録が途絶えた実行中のジョブ（ワーカーが停止した）を失敗にする
+        ブラウザ操作の途中から再開できないため、自動では再実行しない
+
+        Args:
+            timeout: 最後の生存記録からの時間（秒、未指定の場合は環境変数RPA_WORKER_STALE_TIMEOUT、デフォルト: 120）
+
+        Returns:
+            List[str]: 失敗にしたジョブID
+        """
+        timeout = timeout or float(os.getenv("RPA_WORKER_STALE_TIMEOUT", "120"))
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, worker_id FROM queued_jobs WHERE status = ? AND heartbeat_at < ?", (QUEUE_RUNNING, now - timeout)
+            ).fetchall()
+            for row in rows:
+                self._conn.execute(
+                    "UPDATE queued_jobs SET status = ?, finished_at = ? WHERE job_id = ?", (QUEUE_DONE, now, row["job_id"])
+                )
+        for row in rows:
+            message = f"ワーカー（{row['worker_id']}）からの応答がなくなりました"
+            print(f"[JobQueue] {message} (Job ID: {row['job_id']})")
+            self.add_event(row["job_id"], {
+                "stage": "finished", "message": message, "data": {},
+                "status": "failed", "result": {"success": False, "message": message},
+            })
+        return [row["job_id"] for row in rows]
+
+    def purge(self, retention: Optional[float] = None) -> None:
+        """
+        終了してから一定時間が過ぎたジョブとイベントを削除
+
+        Args:
+            retention: 保持期間（秒、未指定の場合は環境変数RPA_QUEUE_RETENTION、デフォルト: 604800 = 7日）
+        """
+        retention = retention or float(os.getenv("RPA_QUEUE_RETENTION", "604800"))
+        cutoff = time.time() - retention
+        with self._lock:
+            self._conn.execute("DELETE FROM job_events WHERE created_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM queued_jobs WHERE status = ? AND finished_at < ?", (QUEUE_DONE, cutoff))
+
+    def restore_jobs(self, registry: JobRegistry, until_seq: int) -> int:
+        """
+        APIサーバーの起動時に、実行中・待機中のジョブと最近終了したジョブをキューの内容から登録し直す
+        （APIサーバーが停止している間に進んだ・終了したジョブも/jobs/{job_id}で参照できるようにする）
+
+        Args:
+            registry: 登録先のジョブ一覧
+            until_seq: この番号までの進捗イベントを反映する（以降のイベントはリレーが反映する）
+
+        Returns:
+            int: 登録し直したジョブ数
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM queued_jobs WHERE status != ?"
+                " UNION ALL SELECT * FROM (SELECT * FROM queued_jobs WHERE status = ? ORDER BY finished_at DESC LIMIT ?)",
+                (QUEUE_DONE, QUEUE_DONE, registry.history_size)
+            ).fetchall()
+        restored = 0
+        for row in sorted(rows, key=lambda row: row["enqueued_at"]):
+            if registry.get(row["job_id"]) is not None:
+                continue
+            job = registry.create(row["job_id"], row["kind"], row["platform"], row["user_id"])
+            job.created_at = row["enqueued_at"]
+            job.started_at = row["claimed_at"]
+            with self._lock:
+                events = self._conn.execute(
+                    "SELECT event FROM job_events WHERE job_id = ? AND seq <= ? ORDER BY seq", (row["job_id"], until_seq)
+                ).fetchall()
+            for event in events:
+                self._apply_event(registry, row["job_id"], json.loads(event["event"]))
+            if job.finished:
+                job.finished_at = row["finished_at"] or job.finished_at
+            else:
+                job.listeners.append(lambda event, job_id=row["job_id"]: self._forward_cancel(job_id, event))
+            restored += 1
+        if restored:
+            print(f"[JobQueue] キューから{restored}件のジョブを登録し直しました")
+        return restored
+
+    def start_relay(self, registry: Optional[JobRegistry] = None, interval: Optional[float] = None) -> None:
+        """
+        ワーカーの進捗イベントをジョブ一覧に反映するバックグラウンドスレッドを起動（APIサーバー側）
+        起動時に、キューに残っているジョブと最近終了したジョブを登録し直してから新しいイベントを反映する
+
+        Args:
+            registry: 反映先のジョブ一覧（未指定の場合はプロセス共通のもの）
+            interval: 新しいイベントを確認する間隔（秒、未指定の場合は環境変数RPA_QUEUE_POLL、デフォルト: 0.5）
+        """
+        if self._relay and self._relay.is_alive():
+            return
+        registry = registry or get_job_registry()
+        interval = interval or float(os.getenv("RPA_QUEUE_POLL", "0.5"))
+        self._stop.clear()
+
+        def run():
+            seq = self.last_seq()
+            try:
+                self.restore_jobs(registry, seq)
+            except Exception as e:
+                print(f"[JobQueue] ジョブの復元エラー: {e}")
+                import traceback
+                traceback.print_exc()
+            last_maintenance = 0.0
+            while not self._stop.is_set():
+                try:
+                    for seq, job_id, event in self.events_after(seq):
+                        self._apply_event(registry, job_id, event)
+                    if time.time() - last_maintenance > 60:
+                        last_maintenance = time.time()
+                        self.fail_stale()
+                        self.purge()
+                except Exception as e:
+                    print(f"[JobQueue] 進捗イベントの反映エラー: {e}")
+                    import traceback
+                    traceback.print_exc()
+                self._stop.wait(interval)
+
+        self._relay = threading.Thread(target=run, name="job-queue-relay", daemon=True)
+        self._relay.start()
+        print(f"[JobQueue] ワーカーの進捗の反映を開始しました ({self.db_path})")
+
+    def stop_relay(self) -> None:
+        """リレーを停止"""
+        self._stop.set()
+
+    def _apply_event(self, registry: JobRegistry, job_id: str, event: Dict[str, Any]) -> None:
+        """ワーカーの進捗イベント1件をジョブに反映（APIサーバーの再起動後は、キューの内容からジョブを登録し直す）"""
+        job = registry.get(job_id)
+        if job is None:
+            row = self.get(job_id)
+            if row is None:
+                return
+            job = registry.create(job_id, row["kind"], row["platform"], row["user_id"])
+        if job.finished:
+            return
+        if event["stage"] == "cancelling" and job.cancelled:
+            # APIサーバーでキャンセルしたジョブは記録済み
+            return
+        if event["stage"] != "finished":
+            job.emit(event["stage"], event.get("message", ""), **(event.get("data") or {}))
+            return
+        if event.get("status") == JOB_CANCELLED and not job.cancelled:
+            job.cancel(event.get("message") or "キャンセルされました")
+        job.finish(event.get("status") == JOB_SUCCEEDED, event.get("result"), event.get("message", ""))
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    プロセス共通のJobQueueを取得
+
+    Returns:
+        JobQueue: 共有インスタンス
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
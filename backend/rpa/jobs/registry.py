@@ -0,0 +1,687 @@
+"""
+RPAジョブの状態管理
+スレッドで動くRPAジョブの進捗（ステージの遷移・件数）を記録し、
+APIサーバーのイベントループ上で待つ購読者（Server-Sent Events）に通知する
+キャンセル・ステージごとの制限時間もここで管理し、RPA側の待機ループは協調的に中断する
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable
+
+
+# ジョブの状態
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされた（またはタイムアウトした）ことを表す例外"""
+
+
+def browser_close_timeout() -> int:
+    """
+    RPA実行後、ユーザーがブラウザを閉じるまで待つ最大時間（汎用RPA・各プラットフォーム共通）
+
+    Returns:
+        int: 待機時間（秒、環境変数RPA_BROWSER_CLOSE_TIMEOUT、デフォルト: 300）
+    """
+    return int(os.getenv("RPA_BROWSER_CLOSE_TIMEOUT", "300"))
+
+
+def stage_timeout(stage: str) -> float:
+    """
+    ステージごとの制限時間（この時間内に次のイベントが記録されない場合はジョブをキャンセルする）
+
+    Args:
+        stage: ステージ名
+
+    Returns:
+        float: 制限時間（秒、環境変数RPA_STAGE_TIMEOUT、デフォルト: 300）
+            ログイン待ち（driver_ready）は + RPA_LOGIN_TIMEOUT、ブラウザを閉じる待ち（waiting_for_browser）は + RPA_BROWSER_CLOSE_TIMEOUT
+    """
+    timeout = float(os.getenv("RPA_STAGE_TIMEOUT", "300"))
+    if stage == "driver_ready":
+        timeout += float(os.getenv("RPA_LOGIN_TIMEOUT", "120"))
+    elif stage == "waiting_for_browser":
+        timeout += browser_close_timeout()
+    return timeout
+
+
+class Job:
+    """1回のRPA実行の状態と進捗イベント"""
+
+    def __init__(self, job_id: str, kind: str, platform: Optional[str] = None, user_id: Optional[str] = None, parent: Optional["Job"] = None):
+        """
+        初期化
+
+        Args:
+            job_id: ジョブID
+            kind: 実行方法（rpa, generic, generic_batch, batch）
+            platform: プラットフォーム名
+            user_id: ユーザーID
+            parent: 親ジョブ（バッチの一部として実行する場合）
+        """
+        self.job_id = job_id
+        self.kind = kind
+        self.platform = platform
+        self.user_id = user_id
+        self.status = JOB_RUNNING
+        self.stage = "queued"
+        self.counts: Dict[str, int] = {}
+        self.result: Optional[Dict[str, Any]] = None
+        self.parent = parent
+        self.children: List[Job] = []
+        self.dedupe_key: Optional[Tuple] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.stage_started_at = self.created_at
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.cancel_reason: Optional[str] = None
+        # 制限時間の超過によるキャンセルか（ユーザーによるキャンセルと区別し、チェックポイントを残す）
+        self.timed_out = False
+        self.driver = None
+        # ブラウザのリソース使用量の最大値（rpa.core.telemetryが計測する）{peak_rss_bytes, peak_cpu_percent, peak_processes}
+        self.resources: Dict[str, float] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+        # イベントを記録するたびに呼び出す関数（ワーカープロセスからキューへの転送など）
+        self.listeners: List[Callable[[Dict[str, Any]], Any]] = []
+
+    @property
+    def finished(self) -> bool:
+        """ジョブが終了しているか"""
+        return self.status in FINISHED_STATUSES
+
+    def emit(self, stage: str, message: str = "", **data: Any) -> Dict[str, Any]:
+        """
+        進捗イベントを記録し、購読者に通知
+
+        Args:
+            stage: ステージ名（driver_ready, login_detected, orders_extracted, rows_saved, finishedなど）
+            message: 表示用のメッセージ
+            **data: 件数などの付加情報（int値はcountsにも反映）
+
+        Returns:
+            Dict[str, Any]: 記録したイベント
+        """
+        with self._lock:
+            # イベントを記録するたびに制限時間を延ばす（同じステージが続く場合も進捗があれば止めない）
+            self.stage_started_at = time.time()
+            if self.started_at is None and stage != "queued":
+                self.started_at = self.stage_started_at
+            self.stage = stage
+            for key, value in data.items():
+                if isinstance(value, int) and not isinstance(value, bool):
+                    self.counts[key] = value
+            event = {
+                "id": len(self.events) + 1,
+                "job_id": self.job_id,
+                "stage": stage,
+                "status": self.status,
+                "message": message,
+                "data": data,
+                "timestamp": time.time(),
+            }
+            self.events.append(event)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # イベントループが終了している購読者は無視する
+                pass
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"[JobRegistry] イベントの通知エラー (Job ID: {self.job_id}): {e}")
+        if self.parent:
+            self.parent._on_child_event(self, event)
+        return event
+
+    def _on_child_event(self, child: "Job", event: Dict[str, Any]) -> None:
+        """
+        子ジョブの進捗を集計してイベントを通知し、すべての子ジョブが終了したら終了する（バッチ用）
+
+        Args:
+            child: イベントを記録した子ジョブ
+            event: 記録されたイベント
+        """
+        if event["stage"] not in ("target_done", "rows_saved", "finished"):
+            return
+        with self._lock:
+            children = list(self.children)
+        totals = {"targets_done": 0, "customers": 0, "orders": 0, "items": 0}
+        for job in children:
+            counts = job.snapshot()["counts"]
+            for key in totals:
+                totals[key] += counts.get(key, 0)
+        finished = [job for job in children if job.finished]
+        self.emit(
+            "progress",
+            f"{len(finished)}/{len(children)}グループが終了しました（{child.platform or '-'}: {event['stage']}）",
+            groups=len(children), groups_done=len(finished), **totals
+        )
+        if len(finished) == len(children):
+            succeeded = [job for job in finished if job.status == JOB_SUCCEEDED]
+            self.finish(
+                len(succeeded) == len(finished),
+                {
+                    "success": len(succeeded) == len(finished),
+                    "saved_records": {key: totals[key] for key in ("customers", "orders", "items")},
+                    "groups": [job.snapshot() for job in finished],
+                    "message": f"{len(finished)}グループの実行が終了しました（成功: {len(succeeded)}）",
+                }
+            )
+
+    @property
+    def cancelled(self) -> bool:
+        """キャンセルが要求されているか"""
+        return self.cancel_event.is_set()
+
+    def attach_driver(self, driver) -> None:
+        """キャンセル時に終了させるWebDriverを登録"""
+        with self._lock:
+            self.driver = driver
+        if self.cancelled:
+            self._quit_driver()
+
+    def record_resources(self, rss_bytes: int, cpu_percent: float, processes: int) -> None:
+        """
+        ブラウザのリソース使用量の計測値を記録（最大値を保持する）
+
+        Args:
+            rss_bytes: メモリ使用量（バイト）
+            cpu_percent: CPU使用率
+            processes: プロセス数
+        """
+        with self._lock:
+            for key, value in (("peak_rss_bytes", rss_bytes), ("peak_cpu_percent", cpu_percent), ("peak_processes", processes)):
+                self.resources[key] = max(self.resources.get(key, 0), value)
+
+    def cancel(self, reason: str = "キャンセルされました", timed_out: bool = False) -> bool:
+        """
+        ジョブのキャンセルを要求し、ブラウザを終了する
+        RPA側の待機ループはcancel_eventを見て中断し、ブラウザ操作中の場合は操作がエラーになって終了する
+
+        Args:
+            reason: キャンセルの理由
+            timed_out: 制限時間の超過によるキャンセルの場合True（RPA側はチェックポイントを残し、次の実行で再開する）
+
+        Returns:
+            bool: キャンセルを要求した場合True（すでに終了している場合はFalse）
+        """
+        with self._lock:
+            if self.finished:
+                return False
+            if self.cancel_event.is_set():
+                return True
+            self.cancel_reason = reason
+            self.timed_out = timed_out
+            self.cancel_event.set()
+            children = list(self.children)
+        print(f"[JobRegistry] ジョブをキャンセルします (Job ID: {self.job_id}): {reason}")
+        self.emit("cancelling", reason, timed_out=timed_out)
+        self._quit_driver()
+        for child in children:
+            child.cancel(reason, timed_out)
+        return True
+
+    def _quit_driver(self) -> None:
+        """登録されたWebDriverを終了（ブラウザとChromeDriverのプロセスを解放する）"""
+        with self._lock:
+            driver, self.driver = self.driver, None
+        if driver is None:
+            return
+        try:
+            driver.quit()
+            print(f"[JobRegistry] ブラウザを終了しました (Job ID: {self.job_id})")
+        except Exception as e:
+            print(f"[JobRegistry] ブラウザの終了エラー: {e}")
+
+    def finish(self, success: bool, result: Optional[Dict[str, Any]] = None, message: str = "") -> None:
+        """
+        ジョブを終了状態にして最終イベントを通知（キャンセルが要求されていた場合はcancelled）
+
+        Args:
+            success: 成功した場合True
+            result: 実行結果（saved_recordsなど）
+            message: 表示用のメッセージ
+        """
+        with self._lock:
+            if self.finished:
+                return
+            if self.cancel_event.is_set():
+                self.status = JOB_CANCELLED
+                message = message or self.cancel_reason or ""
+            else:
+                self.status = JOB_SUCCEEDED if success else JOB_FAILED
+            self.driver = None
+            self.result = result
+            self.finished_at = time.time()
+            resources = dict(self.resources)
+        if resources:
+            print(
+                f"[JobRegistry] ブラウザの最大使用量 (Job ID: {self.job_id}): "
+                f"メモリ {resources['peak_rss_bytes'] / (1024 * 1024):.0f}MB, CPU {resources['peak_cpu_percent']}%, プロセス {int(resources['peak_processes'])}"
+            )
+        saved_records = (result or {}).get("saved_records") or {}
+        self.emit("finished", message or (result or {}).get("message", ""), **saved_records)
+
+    def subscribe(self, after: int = 0) -> Tuple[List[Dict[str, Any]], asyncio.Queue]:
+        """
+        現在のイベントループで進捗イベントを購読（イベントループ上から呼び出す）
+
+        Args:
+            after: このイベントIDより後のイベントだけを返す（再接続時のLast-Event-ID）
+
+        Returns:
+            Tuple[List[Dict[str, Any]], asyncio.Queue]: (記録済みのイベント, 以降のイベントが届くキュー)
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+            return [event for event in self.events if event["id"] > after], queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """購読を解除"""
+        with self._lock:
+            self._subscribers = {(loop, q) for loop, q in self._subscribers if q is not queue}
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        ジョブの終了をイベントループ上で待つ（スレッドをブロックしない）
+
+        Args:
+            timeout: 最大待機時間（秒）
+
+        Returns:
+            bool: 時間内に終了した場合True
+        """
+        _, queue = self.subscribe()
+        try:
+            if self.finished:
+                return True
+
+            async def wait_finished():
+                while (await queue.get())["stage"] != "finished":
+                    pass
+
+            await asyncio.wait_for(wait_finished(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.unsubscribe(queue)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        ジョブの現在の状態
+
+        Returns:
+            Dict[str, Any]: {job_id, kind, platform, user_id, parent_id, status, stage, counts, resources, result, cancel_reason, created_at, finished_at}
+        """
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "platform": self.platform,
+                "user_id": self.user_id,
+                "parent_id": self.parent.job_id if self.parent else None,
+                "status": self.status,
+                "stage": self.stage,
+                "counts": dict(self.counts),
+                "resources": dict(self.resources),
+                "result": self.result,
+                "cancel_reason": self.cancel_reason,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobRegistry:
+    """プロセス内のジョブ一覧（終了したジョブは上限件数まで保持）"""
+
+    def __init__(self, history_size: Optional[int] = None, idempotency_ttl: Optional[float] = None):
+        """
+        初期化
+
+        Args:
+            history_size: 保持する終了済みジョブ数（未指定の場合は環境変数RPA_JOB_HISTORY、デフォルト: 200）
+            idempotency_ttl: 冪等キーを保持する時間（秒、環境変数RPA_IDEMPOTENCY_TTL、デフォルト: 86400）
+        """
+        self.history_size = history_size or int(os.getenv("RPA_JOB_HISTORY", "200"))
+        self.idempotency_ttl = idempotency_ttl or float(os.getenv("RPA_IDEMPOTENCY_TTL", "86400"))
+        # 単発の実行全体の制限時間（generic_batchは対象外）
+        self.job_timeout = float(os.getenv("RPA_JOB_TIMEOUT", "1800"))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # 実行中のジョブ: 同じ内容のリクエスト（dedupe_key） → ジョブID
+        self._inflight: Dict[Tuple, str] = {}
+        # 冪等キー: (ユーザーID, キー) → (ジョブID, dedupe_key, 有効期限)
+        self._idempotency: Dict[Tuple[Optional[str], str], Tuple[str, Optional[Tuple], float]] = {}
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def create(self, job_id: str, kind: str, platform: Optional[str] = None, user_id: Optional[str] = None, parent: Optional[Job] = None) -> Job:
+        """
+        ジョブを登録
+
+        Args:
+            job_id: ジョブID
+            kind: 実行方法（rpa, generic, generic_batch, batch）
+            platform: プラットフォーム名
+            user_id: ユーザーID
+            parent: 親ジョブ（バッチの一部として実行する場合、親ジョブの子に追加する）
+
+        Returns:
+            Job: 登録したジョブ
+        """
+        job = Job(job_id, kind, platform, user_id, parent)
+        if parent:
+            with parent._lock:
+                parent.children.append(job)
+        with self._lock:
+            self._register(job)
+        return job
+
+    def get_or_create(
+        self,
+        job_id: str,
+        kind: str,
+        platform: Optional[str] = None,
+        user_id: Optional[str] = None,
+        dedupe_key: Optional[Tuple] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Tuple[Job, bool]:
+        """
+        同じ冪等キーのジョブ、または同じ内容で実行中のジョブがあればそれを返し、なければ登録する
+        （ダブルクリックやクライアントの再送で同じブラウザ操作・書き込みを重複させないため）
+
+        Args:
+            job_id: 新しく登録する場合のジョブID
+            kind: 実行方法（rpa, generic, batch）
+            platform: プラットフォーム名
+            user_id: ユーザーID
+            dedupe_key: リクエストの内容を表すキー（同じキーの実行中のジョブに合流する）
+            idempotency_key: クライアントが指定した冪等キー（有効期限内は終了したジョブも同じものを返す）
+
+        Returns:
+            Tuple[Job, bool]: (ジョブ, 新しく登録した場合True)
+
+        Raises:
+            ValueError: 冪等キーが別の内容のリクエストで使用済みの場合
+        """
+        now = time.time()
+        with self._lock:
+            self._expire_idempotency_keys(now)
+            if idempotency_key:
+                entry = self._idempotency.get((user_id, idempotency_key))
+                if entry and entry[0] in self._jobs:
+                    if entry[1] != dedupe_key:
+                        raise ValueError("Idempotency-Keyはすでに別の内容のリクエストで使用されています")
+                    return self._jobs[entry[0]], False
+
+            existing = self._jobs.get(self._inflight.get(dedupe_key)) if dedupe_key else None
+            if existing and (existing.finished or existing.cancelled):
+                existing = None
+            job = existing or Job(job_id, kind, platform, user_id)
+            if existing is None:
+                job.dedupe_key = dedupe_key
+                if dedupe_key:
+                    self._inflight[dedupe_key] = job_id
+                self._register(job)
+            if idempotency_key:
+                self._idempotency[(user_id, idempotency_key)] = (job.job_id, dedupe_key, now + self.idempotency_ttl)
+        if existing:
+            print(f"[JobRegistry] 実行中の同じジョブに合流します (Job ID: {existing.job_id})")
+        return job, existing is None
+
+    def _register(self, job: Job) -> None:
+        """ジョブを一覧に追加し、初回は制限時間の監視スレッドを起動（ロックを取得した状態で呼び出す）"""
+        self._jobs[job.job_id] = job
+        self._prune()
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch_deadlines, name="job-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _expire_idempotency_keys(self, now: float) -> None:
+        """有効期限切れ・ジョブが削除済みの冪等キーを削除（ロックを取得した状態で呼び出す）"""
+        expired = [key for key, (job_id, _, expires_at) in self._idempotency.items() if expires_at < now or job_id not in self._jobs]
+        for key in expired:
+            del self._idempotency[key]
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        """ジョブを取得（登録されていない場合はNone）"""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def running_jobs(self) -> List[Job]:
+        """ブラウザを使っている実行中のジョブ"""
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.finished and job.driver is not None]
+
+    def status_counts(self) -> Dict[str, int]:
+        """ステータスごとのジョブ数"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts: Dict[str, int] = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def cancel(self, job_id: str, reason: str = "キャンセルされました") -> Optional[Job]:
+        """
+        ジョブをキャンセル
+
+        Args:
+            job_id: ジョブID
+            reason: キャンセルの理由
+
+        Returns:
+            Optional[Job]: 対象のジョブ（登録されていない場合はNone）
+        """
+        job = self.get(job_id)
+        if job:
+            job.cancel(reason)
+        return job
+
+    def _watch_deadlines(self, interval: float = 5.0) -> None:
+        """制限時間を過ぎた実行中のジョブをキャンセルする（バックグラウンドスレッド）"""
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            with self._lock:
+                # 空き待ち（queued）のジョブとバッチ自体は対象外（バッチの子ジョブごとに判定する）
+                running = [
+                    job for job in self._jobs.values()
+                    if not job.finished and not job.cancelled and job.started_at is not None and not job.children
+                ]
+            for job in running:
+                # 全体の制限時間は単発の実行のみ（複数URLのバッチはURLごとの進捗で延びるステージの制限時間で判定する）
+                if job.kind != "generic_batch" and now - job.started_at > self.job_timeout:
+                    job.cancel(f"ジョブの制限時間（{int(self.job_timeout)}秒）を超えました", timed_out=True)
+                elif now - job.stage_started_at > stage_timeout(job.stage):
+                    job.cancel(f"ステージ {job.stage} の制限時間（{int(stage_timeout(job.stage))}秒）を超えました", timed_out=True)
+
+    def _prune(self) -> None:
+        """古い終了済みジョブを削除（実行中のジョブは残す）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished and not (job.parent and not job.parent.finished)]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+        self._inflight = {key: job_id for key, job_id in self._inflight.items() if job_id in self._jobs and not self._jobs[job_id].finished}
+
+
+_registry = JobRegistry()
+
+
+def get_job_registry() -> JobRegistry:
+    """
+    プロセス共通のJobRegistryを取得
+
+    Returns:
+        JobRegistry: 共有インスタンス
+    """
+    return _registry
+
+
+def report(job_id: Optional[str], stage: str, message: str = "", **data: Any) -> None:
+    """
+    ジョブの進捗を記録（APIサーバー以外から実行された場合など、ジョブが登録されていなければ何もしない）
+
+    Args:
+        job_id: ジョブID
+        stage: ステージ名
+        message: 表示用のメッセージ
+        **data: 件数などの付加情報
+    """
+    job = _registry.get(job_id)
+    if job:
+        job.emit(stage, message, **data)
+
+
+def run_job(job: Job, target: Callable[[], Any]) -> None:
+    """
+    ジョブを現在のスレッドで実行し、終了時にジョブの状態を更新する
+    開始前にキャンセルされていた場合は実行しない
+
+    Args:
+        job: 対象のジョブ
+        target: 実行する関数（戻り値がdictの場合はsuccessキー、それ以外は真偽値で成否を判定）
+    """
+    if job.cancelled:
+        job.finish(False, {"success": False, "message": job.cancel_reason})
+        return
+    job.emit("started", "実行を開始しました")
+    try:
+        result = target()
+        if isinstance(result, dict):
+            job.finish(bool(result.get("success")), result)
+        else:
+            job.finish(bool(result), {"success": bool(result)})
+    except Exception as e:
+        print(f"[JobRegistry] ジョブの実行エラー (Job ID: {job.job_id}): {e}")
+        import traceback
+        traceback.print_exc()
+        job.finish(False, {"success": False, "message": f"エラーが発生しました: {str(e)}"})
+
+
+def attach_driver(job_id: Optional[str], driver) -> None:
+    """
+    ジョブのWebDriverを登録（キャンセル時に終了させる、ジョブが登録されていなければ何もしない）
+
+    Args:
+        job_id: ジョブID
+        driver: WebDriverインスタンス
+    """
+    job = _registry.get(job_id)
+    if job:
+        job.attach_driver(driver)
+
+
+def is_cancelled(job_id: Optional[str]) -> bool:
+    """ジョブのキャンセルが要求されているか（ジョブが登録されていなければFalse）"""
+    job = _registry.get(job_id)
+    return bool(job and job.cancelled)
+
+
+def wait_unless_cancelled(job_id: Optional[str], seconds: float) -> bool:
+    """
+    time.sleep()の代わりに、キャンセルされたらすぐに戻る待機
+
+    Args:
+        job_id: ジョブID
+        seconds: 待機時間（秒）
+
+    Returns:
+        bool: 待機中にキャンセルされた場合True
+    """
+    job = _registry.get(job_id)
+    if job is None:
+        time.sleep(seconds)
+        return False
+    return job.cancel_event.wait(seconds)
+
+
+def cancelled_by_user(job_id: Optional[str]) -> bool:
+    """
+    ユーザー（DELETE /jobs/{job_id}）によってキャンセルされたか
+    制限時間の超過によるキャンセルはFalse（中断した実行はチェックポイントから再開する）
+
+    Args:
+        job_id: ジョブID
+
+    Returns:
+        bool: ユーザーによってキャンセルされた場合True（ジョブが登録されていなければFalse）
+    """
+    job = _registry.get(job_id)
+    return bool(job and job.cancelled and not job.timed_out)
+
+
+def raise_if_cancelled(job_id: Optional[str]) -> None:
+    """
+    キャンセルが要求されていればJobCancelledを送出（ステージの区切りで呼び出す）
+
+    Args:
+        job_id: ジョブID
+    """
+    job = _registry.get(job_id)
+    if job and job.cancelled:
+        raise JobCancelled(job.cancel_reason or "キャンセルされました")
+
+
+def format_sse(event: Dict[str, Any], event_name: Optional[str] = None) -> str:
+    """
+    イベントをServer-Sent Eventsの形式に変換
+
+    Args:
+        event: Job.emit()で記録したイベント
+        event_name: SSEのイベント名（未指定の場合はステージ名）
+
+    Returns:
+        str: "id: ...\\nevent: ...\\ndata: ...\\n\\n"
+    """
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event_name or event['stage']}\ndata: {data}\n\n"
+
+
+async def stream_events(job: Job, after: int = 0, heartbeat: float = 15.0):
+    """
+    ジョブの進捗イベントをSSE形式で順に返す（ジョブが終了したら終わる）
+    スレッドを使わずにイベントループ上で待つため、接続中もワーカーを占有しない
+
+    Args:
+        job: 対象のジョブ
+        after: このイベントIDより後のイベントから返す
+        heartbeat: イベントがない間にコメント行を送る間隔（秒、プロキシによる切断を防ぐ）
+
+    Yields:
+        str: SSEのメッセージ
+    """
+    backlog, queue = job.subscribe(after)
+    try:
+        for event in backlog:
+            yield format_sse(event)
+            if event["stage"] == "finished":
+                return
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+            if event["stage"] == "finished":
+                return
+    finally:
+        job.unsubscribe(queue)
@@ -0,0 +1,425 @@
+"""
+RPAの定期実行スケジューラー
+(ユーザー, プラットフォーム) ごとにcron式または実行間隔を登録し、実行時刻になったら同期ジョブをワーカープールに追加する
+定期実行は操作する人がいないため、ログイン後URL（クッキーが有効な状態）で取得する汎用RPAのみ登録できる
+（プラットフォーム固有RPAは手動ログインが必要なため登録しない）
+登録内容と前回・次回の実行時刻はローカルのSQLiteに保存し、サーバーを再起動しても引き継ぐ
+保存時は変更のあった行だけを書き込む（RPA_SKIP_UNCHANGED）ため、定期実行は差分の同期になる
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from rpa.jobs.batch import generic_dedupe_key, group_targets
+from rpa.jobs.fairness import PRIORITY_SCHEDULED
+from rpa.jobs.pool import WorkerPool, dispatch_job
+from rpa.jobs.registry import get_job_registry
+
+
+# cron式の各フィールドの範囲（分, 時, 日, 月, 曜日（0と7は日曜日））
+CRON_FIELD_RANGES: List[Tuple[int, int]] = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> Set[int]:
+    """
+    cron式の1フィールド（*, 5, 1-5, */15, 1-10/2, 1,3,5）を値の集合に変換
+
+    Raises:
+        ValueError: 書式が正しくない、または範囲外の値がある場合
+    """
+    values: Set[int] = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"cron式の間隔が正しくありません: {field}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"cron式の値が範囲外です: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expression: str) -> Tuple[List[Set[int]], bool, bool]:
+    """
+    5フィールドのcron式（分 時 日 月 曜日）を解析
+
+    Args:
+        expression: cron式（例: "*/30 9-18 * * 1-5"）
+
+    Returns:
+        Tuple[List[Set[int]], bool, bool]: (フィールドごとの値の集合, 日が指定されているか, 曜日が指定されているか)
+
+    Raises:
+        ValueError: cron式が正しくない場合
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"cron式は5フィールド（分 時 日 月 曜日）で指定してください: {expression}")
+    try:
+        parsed = [_parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELD_RANGES)]
+    except ValueError as e:
+        raise ValueError(f"cron式が正しくありません: {expression} ({e})")
+    # 曜日の7は日曜日（0）として扱う
+    if 7 in parsed[4]:
+        parsed[4] = (parsed[4] - {7}) | {0}
+    return parsed, fields[2] != "*", fields[4] != "*"
+
+
+def next_cron_time(expression: str, after: float) -> float:
+    """
+    cron式に一致する、指定時刻より後の最初の時刻（ローカル時刻で判定）
+
+    Args:
+        expression: cron式
+        after: 基準時刻（UNIX時刻）
+
+    Returns:
+        float: 次の実行時刻（UNIX時刻）
+
+    Raises:
+        ValueError: cron式が正しくない、または4年以内に一致する時刻がない場合
+    """
+    (minutes, hours, days, months, weekdays), day_restricted, weekday_restricted = parse_cron(expression)
+    t = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    # うるう日（2月29日）の指定にも対応できるよう4年先まで探す
+    limit = t + timedelta(days=366 * 4)
+    while t < limit:
+        if t.month not in months:
+            t = datetime(t.year + t.month // 12, t.month % 12 + 1, 1)
+            continue
+        day_match = t.day in days
+        weekday_match = (t.weekday() + 1) % 7 in weekdays
+        # 日と曜日の両方が指定されている場合は、どちらかに一致すればよい（cronの仕様）
+        if day_restricted and weekday_restricted:
+            matched = day_match or weekday_match
+        else:
+            matched = day_match and weekday_match
+        if not matched:
+            t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+            continue
+        if t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minutes:
+            t += timedelta(minutes=1)
+            continue
+        return t.timestamp()
+    raise ValueError(f"4年以内に実行時刻がありません: {expression}")
+
+
+class Scheduler:
+    """定期実行の登録内容を保持し、実行時刻になったジョブをワーカープールに追加する"""
+
+    def __init__(self, db_path: Optional[str] = None, pool: Optional[WorkerPool] = None):
+        """
+        初期化
+
+        Args:
+            db_path: SQLiteファイルのパス（未指定の場合は環境変数RPA_SCHEDULER_DB、デフォルト: scheduler.sqlite3）
+            pool: 実行するワーカープール（未指定の場合はプロセス共通のプール）
+        """
+        self.db_path = db_path or os.getenv("RPA_SCHEDULER_DB", "scheduler.sqlite3")
+        # 実行時刻を確認する間隔（秒、環境変数RPA_SCHEDULER_TICK、デフォルト: 30）
+        self.tick = float(os.getenv("RPA_SCHEDULER_TICK", "30"))
+        # 実行時刻に加えるランダムな遅延の上限（秒、環境変数RPA_SCHEDULE_JITTER、デフォルト: 120）
+        self.default_jitter = float(os.getenv("RPA_SCHEDULE_JITTER", "120"))
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS schedules ("
+            " id TEXT PRIMARY KEY,"
+            " user_id TEXT,"
+            " platform TEXT,"
+            " cron TEXT,"
+            " interval_seconds REAL,"
+            " login_url TEXT,"
+            " target_urls TEXT NOT NULL,"
+            " headless INTEGER NOT NULL,"
+            " jitter REAL,"
+            " enabled INTEGER NOT NULL,"
+            " next_run_at REAL NOT NULL,"
+            " last_run_at REAL,"
+            " last_job_id TEXT,"
+            " last_status TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add(
+        self,
+        platform: str,
+        user_id: Optional[str] = None,
+        cron: Optional[str] = None,
+        interval_seconds: Optional[float] = None,
+        login_url: Optional[str] = None,
+        target_urls: Optional[List[str]] = None,
+        headless: bool = True,
+        jitter: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        定期実行を登録
+
+        Args:
+            platform: プラットフォーム名
+            user_id: ユーザーID
+            cron: cron式（interval_secondsとどちらか一方を指定）
+            interval_seconds: 実行間隔（秒）
+            login_url: 汎用RPAのログイン後URL（クッキーが有効な状態）
+            target_urls: 汎用RPAで取得するURL（1件以上）
+            headless: ヘッドレスモードで実行するか
+            jitter: 実行時刻に加えるランダムな遅延の上限（秒、未指定の場合はRPA_SCHEDULE_JITTER）
+
+        Returns:
+            Dict[str, Any]: 登録した定期実行
+
+        Raises:
+            ValueError: cron式・実行間隔・プラットフォーム・URLの指定が正しくない場合、
+                またはtarget_urlsがない（手動ログインが必要なプラットフォーム固有RPAの）場合
+        """
+        if not target_urls:
+            raise ValueError(
+                "プラットフォーム固有RPAは手動ログインが必要なため定期実行できません。login_urlとtarget_urlsを指定してください"
+            )
+        if bool(cron) == bool(interval_seconds):
+            raise ValueError("cronとinterval_secondsのどちらか一方を指定してください")
+        if interval_seconds is not None and interval_seconds < 60:
+            raise ValueError("interval_secondsは60秒以上を指定してください")
+        # バッチと同じ規則でターゲットを検証する（1件の定期実行 = 1グループ）
+        self._group({"platform": platform, "user_id": user_id, "login_url": login_url, "target_urls": json.dumps(target_urls or [])})
+
+        now = time.time()
+        schedule = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "platform": platform.lower(),
+            "cron": cron,
+            "interval_seconds": interval_seconds,
+            "login_url": login_url,
+            "target_urls": json.dumps(target_urls or []),
+            "headless": int(bool(headless)),
+            "jitter": jitter,
+            "enabled": 1,
+            "next_run_at": 0.0,
+            "last_run_at": None,
+            "last_job_id": None,
+            "last_status": None,
+            "created_at": now,
+        }
+        schedule["next_run_at"] = self._next_run_at(schedule, now)
+        with self._lock:
+            columns = ", ".join(schedule)
+            self._conn.execute(
+                f"INSERT INTO schedules ({columns}) VALUES ({', '.join('?' * len(schedule))})",
+                list(schedule.values())
+            )
+            self._conn.commit()
+        print(f"[Scheduler] 定期実行を登録しました (ID: {schedule['id']}, {platform}, 次回: {datetime.fromtimestamp(schedule['next_run_at'])})")
+        return self._to_dict(schedule)
+
+    def list_schedules(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        定期実行の一覧
+
+        Args:
+            user_id: 指定した場合はそのユーザーの定期実行のみ
+
+        Returns:
+            List[Dict[str, Any]]: 定期実行のリスト（次回の実行時刻順）
+        """
+        with self._lock:
+            if user_id:
+                rows = self._conn.execute("SELECT * FROM schedules WHERE user_id = ? ORDER BY next_run_at", (user_id,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM schedules ORDER BY next_run_at").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def get(self, schedule_id: str) -> Optional[Dict[str, Any]]:
+        """定期実行を取得（登録されていない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def set_enabled(self, schedule_id: str, enabled: bool) -> bool:
+        """
+        定期実行の有効・無効を切り替える（有効にした場合は次回の実行時刻を現在から計算し直す）
+
+        Returns:
+            bool: 対象の定期実行があった場合True
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+            if not row:
+                return False
+            next_run_at = self._next_run_at(dict(row), time.time()) if enabled else row["next_run_at"]
+            self._conn.execute(
+                "UPDATE schedules SET enabled = ?, next_run_at = ? WHERE id = ?",
+                (int(enabled), next_run_at, schedule_id)
+            )
+            self._conn.commit()
+        return True
+
+    def remove(self, schedule_id: str) -> bool:
+        """
+        定期実行を削除
+
+        Returns:
+            bool: 削除した場合True
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def run_due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        実行時刻を過ぎた定期実行をワーカープールに追加する
+        停止中に複数回分の時刻が過ぎていても1回だけ実行し、次回の実行時刻は現在から計算する
+
+        Args:
+            now: 現在時刻（UNIX時刻、未指定の場合は現在）
+
+        Returns:
+            List[Dict[str, Any]]: 実行した（またはスキップした）定期実行 {id, job_id, status}
+        """
+        now = now or time.time()
+        with self._lock:
+            due = self._conn.execute(
+                "SELECT * FROM schedules WHERE enabled = 1 AND next_run_at <= ? ORDER BY next_run_at", (now,)
+            ).fetchall()
+        runs = []
+        for row in due:
+            schedule = dict(row)
+            try:
+                job_id, status = self._enqueue(schedule)
+            except Exception as e:
+                print(f"[Scheduler] 定期実行の登録に失敗しました (ID: {schedule['id']}): {e}")
+                import traceback
+                traceback.print_exc()
+                job_id, status = None, f"error: {e}"
+            next_run_at = self._next_run_at(schedule, now)
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE schedules SET next_run_at = ?, last_run_at = ?, last_job_id = COALESCE(?, last_job_id), last_status = ? WHERE id = ?",
+                    (next_run_at, now, job_id, status, schedule["id"])
+                )
+                self._conn.commit()
+            runs.append({"id": schedule["id"], "job_id": job_id, "status": status})
+        return runs
+
+    def start(self) -> None:
+        """実行時刻を確認するバックグラウンドスレッドを起動（起動済みの場合は何もしない）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="rpa-scheduler", daemon=True)
+            self._thread.start()
+        print(f"[Scheduler] 定期実行を開始しました（確認間隔: {int(self.tick)}秒）")
+
+    def stop(self) -> None:
+        """バックグラウンドスレッドを停止"""
+        self._stop.set()
+
+    def _loop(self) -> None:
+        """実行時刻になった定期実行を登録し続ける（バックグラウンドスレッド）"""
+        while not self._stop.is_set():
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"[Scheduler] 定期実行の確認中にエラーが発生しました: {e}")
+                import traceback
+                traceback.print_exc()
+            self._stop.wait(self.tick)
+
+    def _enqueue(self, schedule: Dict[str, Any]) -> Tuple[Optional[str], str]:
+        """
+        定期実行1件をジョブとしてワーカープールに追加
+        同じ内容（ユーザー, プラットフォーム, URL）のジョブが実行中の場合（前回の定期実行・/run-generic-rpaからの実行を含む）はスキップする
+
+        Returns:
+            Tuple[Optional[str], str]: (ジョブID, queued・skipped・rejected（プラットフォーム固有RPAの場合）)
+        """
+        group = self._group(schedule)
+        headless = bool(schedule["headless"])
+        if group["kind"] == "rpa":
+            # 以前に登録されたプラットフォーム固有RPAの定期実行は、ログインを待つブラウザで枠を占有するため実行しない
+            print(f"[Scheduler] プラットフォーム固有RPAは定期実行できないためスキップします (ID: {schedule['id']})")
+            return None, "rejected: login_urlとtarget_urlsを指定して登録し直してください"
+        # /run-generic-rpaと同じキーにして、手動の実行と重ならないようにする
+        dedupe_key = generic_dedupe_key(group["user_id"], group["platform"], group["login_url"], group["target_urls"])
+        job, created = get_job_registry().get_or_create(
+            str(uuid.uuid4()), group["kind"], platform=group["platform"], user_id=group["user_id"], dedupe_key=dedupe_key
+        )
+        if not created:
+            print(f"[Scheduler] 前回のジョブが実行中のためスキップします (ID: {schedule['id']}, Job ID: {job.job_id})")
+            return job.job_id, "skipped"
+        job.emit("scheduled", f"定期実行を開始します (Schedule ID: {schedule['id']})", schedule_id=schedule["id"])
+        dispatch_job(job, dict(group, headless=headless, priority=PRIORITY_SCHEDULED, unattended=True), self.pool)
+        print(f"[Scheduler] 定期実行をワーカープールに追加しました (ID: {schedule['id']}, Job ID: {job.job_id})")
+        return job.job_id, "queued"
+
+    def _group(self, schedule: Dict[str, Any]) -> Dict[str, Any]:
+        """定期実行の登録内容を実行グループ（group_targets()の1件）に変換"""
+        target_urls = json.loads(schedule["target_urls"] or "[]")
+        targets = [
+            {"platform": schedule["platform"], "target_url": url, "login_url": schedule["login_url"]}
+            for url in target_urls
+        ] or [{"platform": schedule["platform"]}]
+        return group_targets(targets, schedule["user_id"])[0]
+
+    def _next_run_at(self, schedule: Dict[str, Any], now: float) -> float:
+        """次回の実行時刻（ジョブが同時に集中しないようにランダムな遅延を加える）"""
+        if schedule["cron"]:
+            next_run_at = next_cron_time(schedule["cron"], now)
+        else:
+            next_run_at = now + float(schedule["interval_seconds"])
+        jitter = schedule["jitter"] if schedule["jitter"] is not None else self.default_jitter
+        return next_run_at + random.uniform(0, max(0.0, jitter))
+
+    @staticmethod
+    def _to_dict(row) -> Dict[str, Any]:
+        """SQLiteの行をAPIで返す形式に変換"""
+        schedule = dict(row)
+        schedule["target_urls"] = json.loads(schedule["target_urls"] or "[]")
+        schedule["headless"] = bool(schedule["headless"])
+        schedule["enabled"] = bool(schedule["enabled"])
+        return schedule
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """
+    プロセス共通のSchedulerを取得
+
+    Returns:
+        Scheduler: 共有インスタンス
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -1,4 +1,32 @@
 """
 プラットフォーム別RPAモジュール
 """
+import importlib
+from typing import Callable, Optional
 
+
+# プラットフォームとRPAモジュールのマッピング
+PLATFORM_RPA_MODULES = {
+    "base": "rpa.platforms.base_rpa",
+    "shopify": "rpa.platforms.shopify_rpa",
+    "rakuten": "rpa.platforms.rakuten_rpa",
+    "furusato": "rpa.platforms.furusato_rpa",
+    "tabechoku": "rpa.platforms.tabechoku_rpa",
+}
+
+
+def get_platform_runner(platform: str) -> Optional[Callable[..., bool]]:
+    """
+    プラットフォームのRPA実行関数（run_<platform>_rpa）を取得
+
+    Args:
+        platform: プラットフォーム名
+
+    Returns:
+        Optional[Callable[..., bool]]: 実行関数（サポートされていない場合はNone）
+    """
+    if platform not in PLATFORM_RPA_MODULES:
+        return None
+    # 動的にモジュールをインポート
+    module = importlib.import_module(PLATFORM_RPA_MODULES[platform])
+    return getattr(module, f"run_{platform}_rpa", None)
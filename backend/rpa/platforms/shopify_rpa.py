@@ -6,11 +6,14 @@ from typing import List, Dict, Any, Optional
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
-from rpa.core.browser import create_driver
+from rpa.core.browser import create_driver, run_with_driver_recovery, save_session
+from rpa.core.telemetry import mark_recycled, recycle_requested
 from rpa.core.login import LoginBase
 from rpa.core.scraper_base import ScraperBase
 from rpa.utils.config_loader import get_credentials, validate_config
 from rpa.utils.data_saver import save_orders_to_supabase
+from rpa.jobs.checkpoint import Checkpoint, STAGE_EXTRACTED, STAGE_LOGGED_IN, checkpoint_key
+from rpa.jobs.registry import JobCancelled, attach_driver, browser_close_timeout, cancelled_by_user, raise_if_cancelled, report, wait_unless_cancelled
 
 
 class ShopifyLogin(LoginBase):
@@ -40,7 +43,9 @@ class ShopifyLogin(LoginBase):
             time.sleep(3)
             
             # 手動ログインを待機
-            return self.wait_for_manual_login(driver, wait_time=120)
+            return self.wait_for_manual_login(driver)
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"[Shopify RPA] ログインページの読み込みエラー: {e}")
             return False
@@ -164,15 +169,20 @@ class ShopifyScraper(ScraperBase):
 def run_shopify_rpa(
     job_id: Optional[str] = None,
     user_id: Optional[str] = None,
-    credentials: Optional[Dict[str, Any]] = None
+    credentials: Optional[Dict[str, Any]] = None,
+    keep_open: bool = True
 ) -> bool:
     """
     Shopify RPAを実行
+    ログイン後・注文の取得後にチェックポイントを記録し、ブラウザがクラッシュした場合は起動し直してログイン状態を復元する
+    前回の実行が注文の取得後にクラッシュ・エラー・制限時間の超過で中断していた場合は、ブラウザを起動せずに取得済みの注文を保存する
+    （ユーザーがキャンセルした実行のチェックポイントは削除するため再開しない）
     
     Args:
         job_id: ジョブID
         user_id: ユーザーID
         credentials: ログイン情報（未指定の場合は環境変数から取得）
+        keep_open: 完了後にブラウザを開いたまま、閉じられるまで待機するか（バッチではFalse）
     
     Returns:
         bool: 実行成功時True
@@ -189,26 +199,51 @@ def run_shopify_rpa(
         credentials = get_credentials(user_id)
     
     driver = None
+    checkpoint = None
     try:
+        checkpoint = Checkpoint(checkpoint_key("rpa", user_id, "shopify"), job_id)
+        if checkpoint.stage == STAGE_EXTRACTED and checkpoint.state.get("orders"):
+            print("[Shopify RPA] 前回取得した注文を保存します（ブラウザは起動しません）")
+            save_orders_to_supabase(
+                orders=checkpoint.state["orders"],
+                platform="shopify",
+                user_id=user_id,
+                job_id=job_id
+            )
+            checkpoint.clear()
+            return True
+        
         # ChromeDriverを起動
         print("[Shopify RPA] ChromeDriverを起動しています...")
         driver = create_driver(headless=False)
         print("[Shopify RPA] ChromeDriverの起動に成功しました")
+        attach_driver(job_id, driver)
+        report(job_id, "driver_ready", "ブラウザを起動しました")
         
         # ログイン処理
-        login_handler = ShopifyLogin()
+        login_handler = ShopifyLogin(job_id=job_id)
         if not login_handler.login(driver, credentials):
             print("[Shopify RPA] ログインに失敗しました。")
             return False
+        report(job_id, "login_detected", "ログインしました")
+        session = save_session(driver)
+        checkpoint.mark(STAGE_LOGGED_IN)
+        raise_if_cancelled(job_id)
         
-        # 注文ページに遷移
-        scraper = ShopifyScraper(driver)
-        if not scraper.navigate_to_orders_page():
+        # 注文ページに遷移して注文データをスクレイピング（ブラウザがクラッシュした場合は起動し直してやり直す）
+        def scrape(current_driver):
+            scraper = ShopifyScraper(current_driver)
+            if not scraper.navigate_to_orders_page():
+                return None
+            return scraper.scrape_orders(max_orders=10)
+        
+        orders, driver = run_with_driver_recovery(driver, scrape, session, job_id=job_id)
+        if orders is None:
             print("[Shopify RPA] 注文ページへの遷移に失敗しました。")
             return False
-        
-        # 注文データをスクレイピング
-        orders = scraper.scrape_orders(max_orders=10)
+        report(job_id, "orders_extracted", f"{len(orders)}件の注文を取得しました", orders=len(orders))
+        checkpoint.mark(STAGE_EXTRACTED, orders=orders)
+        raise_if_cancelled(job_id)
         
         # Supabaseに保存
         if orders:
@@ -220,16 +255,29 @@ def run_shopify_rpa(
             )
         else:
             print("[Shopify RPA] 取得できる注文がありませんでした")
+        checkpoint.clear()
         
         print("\n[Shopify RPA] RPA実行が完了しました")
+        if not keep_open:
+            # 確認する人がいない実行は待機せずに終了する（ブラウザはfinallyで閉じてワーカーの枠を空ける）
+            return True
         print("[Shopify RPA] ブラウザを開いたままにします。結果を確認してから、ブラウザを手動で閉じてください。")
         
-        # ブラウザが閉じられるまで待機（最大5分）
+        # ブラウザが閉じられるまで待機（RPA_BROWSER_CLOSE_TIMEOUT、キャンセルされたら終了）
+        close_timeout = browser_close_timeout()
+        report(job_id, "waiting_for_browser", f"ブラウザが閉じられるまで待機しています（最大{close_timeout}秒）")
         try:
-            for i in range(300):
+            for i in range(close_timeout):
                 try:
                     driver.current_url
-                    time.sleep(1)
+                    if wait_unless_cancelled(job_id, 1):
+                        break
+                    if recycle_requested(job_id):
+                        # 確認用に開いているだけのブラウザは、メモリ使用量などの上限を超えたら閉じる
+                        print("[Shopify RPA] ブラウザのリソース使用量が上限を超えたため、ブラウザを閉じます。")
+                        driver.quit()
+                        mark_recycled(job_id)
+                        break
                 except:
                     print("[Shopify RPA] ブラウザが閉じられました。")
                     break
@@ -238,9 +286,23 @@ def run_shopify_rpa(
         
         return True
         
+    except JobCancelled as e:
+        print(f"\n[Shopify RPA] ジョブがキャンセルされました: {e}")
+        if checkpoint and cancelled_by_user(job_id):
+            # ユーザーがキャンセルした実行は再開しない（次の実行で取得済みの古いデータを保存しないようにする）
+            # 制限時間の超過で中断した実行はチェックポイントを残し、次の実行で続きから処理する
+            checkpoint.clear()
+        if driver:
+            # キャンセルされたジョブはブラウザを閉じて解放する
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        return False
+        
     except KeyboardInterrupt:
         print("\n[Shopify RPA] ユーザーによって中断されました。")
-        if driver:
+        if driver and keep_open:
             print("[Shopify RPA] ブラウザを開いたままにします。手動で閉じてください。")
         return False
         
@@ -248,9 +310,17 @@ def run_shopify_rpa(
         print(f"\n[Shopify RPA] エラーが発生しました: {e}")
         import traceback
         traceback.print_exc()
-        if driver:
+        if driver and keep_open:
             print("[Shopify RPA] ブラウザを開いたままにします。手動で閉じてください。")
         return False
+    
+    finally:
+        if driver and not keep_open:
+            print("[Shopify RPA] ブラウザを閉じます。")
+            try:
+                driver.quit()
+            except Exception:
+                pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+"""
+デバッグ用アーティファクト保存モジュール
+取得したJSONやページソースをjob_id単位で圧縮保存する
+書き込みはバックグラウンドスレッドで行い、サンプリングと容量/期間による削除を行う
+"""
+import gzip
+import json
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from typing import Any, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstdは任意依存（未インストールの場合はgzipを使用）
+    zstandard = None
+
+
+class ArtifactStore:
+    """job_id単位の圧縮アーティファクトストア"""
+
+    def __init__(
+        self,
+        base_dir: Optional[str] = None,
+        compression: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        max_total_bytes: Optional[int] = None,
+        max_age_seconds: Optional[int] = None,
+        queue_size: int = 100
+    ):
+        """
+        初期化
+
+        Args:
+            base_dir: 保存先ディレクトリ（未指定の場合は環境変数RPA_ARTIFACT_DIR、デフォルト: artifacts）
+            compression: 圧縮方式（zstd または gzip、未指定の場合は環境変数RPA_ARTIFACT_COMPRESSION）
+            sample_rate: JSONペイロードを保存する割合（0.0〜1.0、デフォルト: 1.0）
+            max_total_bytes: 保存領域の上限バイト数（デフォルト: 200MB）
+            max_age_seconds: アーティファクトの保持期間（秒、デフォルト: 7日）
+            queue_size: 書き込み待ちキューの最大件数
+        """
+        self.base_dir = base_dir or os.getenv("RPA_ARTIFACT_DIR", "artifacts")
+        compression = (compression or os.getenv("RPA_ARTIFACT_COMPRESSION", "zstd")).lower()
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        self.compression = compression
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("RPA_ARTIFACT_SAMPLE_RATE", "1.0"))
+        self.max_total_bytes = max_total_bytes or int(os.getenv("RPA_ARTIFACT_MAX_BYTES", str(200 * 1024 * 1024)))
+        self.max_age_seconds = max_age_seconds or int(os.getenv("RPA_ARTIFACT_MAX_AGE", str(7 * 24 * 3600)))
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self._eviction_interval = 60
+
+    def save_json(self, job_id: Optional[str], name: str, data: Any, force: bool = False) -> Optional[str]:
+        """
+        JSONデータを保存キューに追加（シリアライズと圧縮は書き込みスレッドで行う）
+
+        Args:
+            job_id: RPA実行ジョブID
+            name: ファイル名（拡張子なし）
+            data: JSONシリアライズ可能なデータ
+            force: Trueの場合はサンプリングを無視して必ず保存
+
+        Returns:
+            Optional[str]: 保存予定のパス、サンプリングで除外・キューが満杯の場合はNone
+        """
+        if not force and random.random() >= self.sample_rate:
+            return None
+        return self._enqueue(job_id, f"{name}.json", "json", data)
+
+    def save_text(self, job_id: Optional[str], name: str, text: str) -> Optional[str]:
+        """
+        テキストデータ（ページソースなど）を保存キューに追加
+        失敗時の調査用データのため、サンプリングは適用しない
+
+        Args:
+            job_id: RPA実行ジョブID
+            name: ファイル名（拡張子付き、例: page_source.html）
+            text: 保存するテキスト
+
+        Returns:
+            Optional[str]: 保存予定のパス、キューが満杯の場合はNone
+        """
+        return self._enqueue(job_id, name, "text", text)
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """
+        書き込み待ちのアーティファクトがなくなるまで待機
+
+        Args:
+            timeout: 最大待機時間（秒）
+        """
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    def _enqueue(self, job_id: Optional[str], filename: str, kind: str, payload: Any) -> Optional[str]:
+        """書き込みジョブをキューに追加（リクエストスレッドをブロックしない）"""
+        self._ensure_worker()
+        job_dir = os.path.join(self.base_dir, self._safe_name(job_id or "no_job"))
+        path = os.path.join(job_dir, f"{int(time.time() * 1000)}_{self._safe_name(filename)}{self._extension()}")
+        try:
+            self._queue.put_nowait((path, kind, payload))
+        except queue.Full:
+            print(f"[ArtifactStore] 書き込みキューが満杯のため、アーティファクトを破棄しました: {filename}")
+            return None
+        return path
+
+    def _ensure_worker(self) -> None:
+        """書き込みスレッドを起動（未起動の場合のみ）"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="artifact-store-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        """書き込みスレッドのメインループ"""
+        while True:
+            path, kind, payload = self._queue.get()
+            try:
+                self._write(path, kind, payload)
+                if time.time() - self._last_eviction >= self._eviction_interval:
+                    self._evict()
+            except Exception as e:
+                print(f"[ArtifactStore] アーティファクトの保存エラー: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: str, kind: str, payload: Any) -> None:
+        """アーティファクトを圧縮して書き込み"""
+        if kind == "json":
+            raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        else:
+            raw = (payload or "").encode("utf-8")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        if self.compression == "zstd":
+            data = zstandard.ZstdCompressor(level=3).compress(raw)
+        else:
+            data = gzip.compress(raw, compresslevel=6)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _evict(self) -> None:
+        """保持期間を過ぎたアーティファクトを削除し、容量上限を超えた場合は古いジョブから削除"""
+        self._last_eviction = time.time()
+        if not os.path.isdir(self.base_dir):
+            return
+
+        now = time.time()
+        job_dirs = []
+        total_bytes = 0
+        for entry in os.scandir(self.base_dir):
+            if not entry.is_dir():
+                continue
+            dir_bytes = 0
+            newest = 0.0
+            for file_entry in os.scandir(entry.path):
+                stat = file_entry.stat()
+                if now - stat.st_mtime > self.max_age_seconds:
+                    os.remove(file_entry.path)
+                    continue
+                dir_bytes += stat.st_size
+                newest = max(newest, stat.st_mtime)
+            if dir_bytes == 0:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            job_dirs.append((newest, dir_bytes, entry.path))
+            total_bytes += dir_bytes
+
+        # 容量上限を超えている場合は、最終更新が古いジョブから削除
+        for _, dir_bytes, dir_path in sorted(job_dirs):
+            if total_bytes <= self.max_total_bytes:
+                break
+            shutil.rmtree(dir_path, ignore_errors=True)
+            total_bytes -= dir_bytes
+            print(f"[ArtifactStore] 容量上限のため、古いアーティファクトを削除しました: {dir_path}")
+
+    def _extension(self) -> str:
+        """圧縮方式に応じた拡張子を返す"""
+        return ".zst" if self.compression == "zstd" else ".gz"
+
+    @staticmethod
+    def _safe_name(name: str) -> str:
+        """ファイル名に使えない文字を置換"""
+        return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+
+
+def read_artifact(path: str) -> bytes:
+    """
+    保存済みのアーティファクトを読み込んで展開
+
+    Args:
+        path: アーティファクトのパス（.gz / .zst / 非圧縮）
+
+    Returns:
+        bytes: 展開後のデータ
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".gz"):
+        return gzip.decompress(data)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstdで圧縮されたアーティファクトを読むには zstandard パッケージが必要です")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+_artifact_store: Optional[ArtifactStore] = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    プロセス共通のArtifactStoreを取得
+
+    Returns:
+        ArtifactStore: 共有インスタンス
+    """
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore()
+        return _artifact_store
@@ -0,0 +1,200 @@
+"""
+非同期PostgRESTクライアント
+httpxのAsyncClient（コネクションプール・HTTP/2）でSupabaseのREST APIに直接書き込む
+プロセス共通のイベントループスレッドで動かし、スレッドで動くジョブからも共有できるようにする
+"""
+import asyncio
+import importlib.util
+import os
+import threading
+from typing import Dict, Any, List, Optional, Tuple, Coroutine
+
+from rpa.utils.config_loader import get_supabase_config
+from rpa.utils.request_policy import RequestPolicy, get_request_policy
+
+try:
+    import httpx
+except ImportError:  # 非同期保存を使う場合のみ必要
+    httpx = None
+
+# HTTP/2はh2がインストールされている場合のみ有効（httpxが内部でimportするため、ここでは有無だけを確認する）
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class AsyncPostgrestClient:
+    """SupabaseのREST API（PostgREST）への非同期書き込みクライアント"""
+
+    def __init__(
+        self,
+        supabase_url: str,
+        supabase_key: str,
+        request_policy: Optional[RequestPolicy] = None,
+        max_connections: Optional[int] = None,
+        timeout: float = 30.0
+    ):
+        """
+        初期化
+
+        Args:
+            supabase_url: Supabase URL
+            supabase_key: Supabase Key
+            request_policy: リトライ・流量制限のポリシー（未指定の場合はプロセス共通のポリシー）
+            max_connections: 最大同時接続数（未指定の場合は環境変数RPA_ASYNC_MAX_CONNECTIONS、デフォルト: 20）
+            timeout: リクエストのタイムアウト（秒）
+        """
+        if httpx is None:
+            raise ImportError("非同期保存にはhttpxが必要です: pip install 'httpx[http2]'")
+        self.rest_url = f"{supabase_url.rstrip('/')}/rest/v1"
+        self.request_policy = request_policy or get_request_policy()
+        max_connections = max_connections or int(os.getenv("RPA_ASYNC_MAX_CONNECTIONS", "20"))
+        self.http = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            headers={
+                "apikey": supabase_key,
+                "Authorization": f"Bearer {supabase_key}",
+                "Content-Type": "application/json",
+            },
+        )
+
+    async def write_rows(self, table: str, rows: List[Dict[str, Any]], mode: str = "upsert") -> int:
+        """
+        複数行を1リクエストで書き込む（失敗時は例外を送出）
+
+        Args:
+            table: テーブル名
+            rows: 行のリスト
+            mode: upsert または insert
+
+        Returns:
+            int: 書き込んだ行数
+        """
+        if not rows:
+            return 0
+        # 行ごとに列が異なる場合があるため、全行の列を指定し、ない列は既定値にする
+        columns = []
+        for row in rows:
+            for column in row:
+                if column not in columns:
+                    columns.append(column)
+        prefer = ["return=minimal", "missing=default"]
+        if mode == "upsert":
+            prefer.insert(0, "resolution=merge-duplicates")
+
+        async def send():
+            response = await self.http.post(
+                f"{self.rest_url}/{table}",
+                params={"columns": ",".join(columns)},
+                json=rows,
+                headers={"Prefer": ",".join(prefer)},
+            )
+            response.raise_for_status()
+            return response
+
+        await self.request_policy.call_async(send, f"{table}の{mode}")
+        return len(rows)
+
+    async def delete_rows(self, table: str, filters: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        条件に一致する行を削除する（失敗時は例外を送出）
+
+        Args:
+            table: テーブル名
+            filters: PostgRESTの絞り込み条件（例: {"order_id": "eq.123", "id": 'not.in.("a","b")'}）
+
+        Returns:
+            List[Dict[str, Any]]: 削除した行（idのみ）
+        """
+        async def send():
+            response = await self.http.delete(
+                f"{self.rest_url}/{table}",
+                params=dict(filters, select="id"),
+                headers={"Prefer": "return=representation"},
+            )
+            response.raise_for_status()
+            return response
+
+        response = await self.request_policy.call_async(send, f"{table}の削除")
+        return response.json() if response.content else []
+
+    async def rpc(self, function: str, params: Dict[str, Any]) -> Any:
+        """
+        Postgres関数を呼び出す（失敗時は例外を送出）
+
+        Args:
+            function: 関数名
+            params: 引数
+
+        Returns:
+            Any: 関数の戻り値（JSON）
+        """
+        async def send():
+            response = await self.http.post(f"{self.rest_url}/rpc/{function}", json=params)
+            response.raise_for_status()
+            return response
+
+        response = await self.request_policy.call_async(send, f"{function}のRPC")
+        return response.json() if response.content else None
+
+    async def aclose(self) -> None:
+        """コネクションプールを閉じる"""
+        await self.http.aclose()
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_clients: Dict[Tuple[str, str], AsyncPostgrestClient] = {}
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    非同期保存用のプロセス共通イベントループを取得（初回呼び出し時にスレッドを起動）
+
+    Returns:
+        asyncio.AbstractEventLoop: バックグラウンドスレッドで動くイベントループ
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-postgrest", daemon=True).start()
+        return _loop
+
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    コルーチンを共通イベントループで実行し、結果を待つ（スレッドから呼び出す用）
+
+    Args:
+        coro: 実行するコルーチン
+        timeout: 最大待機時間（秒）
+
+    Returns:
+        Any: コルーチンの結果
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+
+def get_async_postgrest_client(supabase_url: Optional[str] = None, supabase_key: Optional[str] = None) -> AsyncPostgrestClient:
+    """
+    Supabase URL・Keyごとに共有するAsyncPostgrestClientを取得（コネクションプールを全ジョブで共有する）
+
+    Args:
+        supabase_url: Supabase URL（未指定の場合は環境変数から取得）
+        supabase_key: Supabase Key（未指定の場合は環境変数から取得）
+
+    Returns:
+        AsyncPostgrestClient: 共有インスタンス
+    """
+    if not supabase_url or not supabase_key:
+        config = get_supabase_config()
+        supabase_url = supabase_url or config["url"]
+        supabase_key = supabase_key or config["key"]
+    if not supabase_url or not supabase_key:
+        raise ValueError("Supabaseの設定が見つかりません。環境変数を確認してください。")
+    with _loop_lock:
+        key = (supabase_url, supabase_key)
+        if key not in _clients:
+            _clients[key] = AsyncPostgrestClient(supabase_url, supabase_key)
+        return _clients[key]
@@ -1,9 +1,13 @@
 """
 データ保存モジュール（Supabase）
 """
+import os
 from typing import List, Dict, Any, Optional
 from supabase import create_client, Client
 from rpa.utils.config_loader import get_supabase_config
+from rpa.utils.request_policy import get_request_policy
+from rpa.utils.write_spool import get_write_spool
+from rpa.jobs.registry import report
 
 
 def save_orders_to_supabase(
@@ -22,12 +26,13 @@ def save_orders_to_supabase(
         job_id: ジョブID（オプション）
     
     Returns:
-        bool: 保存成功時True
+        bool: 保存成功時True（保存に失敗した注文はスプールに退避し、バックグラウンドで再送する）
     """
     if not orders:
         print(f"[DataSaver] 保存する注文データがありません。")
         return False
     
+    pending_rows = []
     try:
         config = get_supabase_config()
         if not config["url"] or not config["key"]:
@@ -54,16 +59,34 @@ def save_orders_to_supabase(
                 order_data["order_date"] = order["order_date"]
             if "status" in order:
                 order_data["status"] = order["status"]
-            
-            supabase.table("orders").insert(order_data).execute()
+            pending_rows.append(order_data)
+        
+        if os.getenv("RPA_PERSISTENCE_BACKEND", "sync").lower() == "async":
+            # 共通のイベントループ・コネクションプールで1リクエストにまとめて書き込む
+            from rpa.utils.async_postgrest import get_async_postgrest_client, run_coroutine
+            postgrest = get_async_postgrest_client(config["url"], config["key"])
+            run_coroutine(postgrest.write_rows("orders", pending_rows, mode="insert"))
+            pending_rows = []
+        
+        request_policy = get_request_policy()
+        while pending_rows:
+            request_policy.execute(supabase.table("orders").insert(pending_rows[0]), "ordersのinsert")
+            pending_rows.pop(0)
         
         print(f"[DataSaver] Supabaseへの保存が完了しました")
+        report(job_id, "rows_saved", f"{len(orders)}件の注文を保存しました", orders=len(orders))
         return True
         
     except Exception as e:
         print(f"[DataSaver] Supabase保存エラー: {e}")
         import traceback
         traceback.print_exc()
-        print(f"[DataSaver] 取得した注文データ: {orders}")
+        # 未保存の注文はスプールに退避（ブラウザ操作をやり直さずに再送できるようにする）
+        spool = get_write_spool() if pending_rows else None
+        if spool:
+            spool.append("orders", pending_rows, mode="insert", error=e)
+            report(job_id, "rows_spooled", f"{len(pending_rows)}件の注文をスプールに退避しました（後で再送します）", spooled=len(pending_rows))
+        else:
+            print(f"[DataSaver] 取得した注文データ: {orders}")
         return False
 
@@ -0,0 +1,366 @@
+"""
+Supabase（PostgREST）呼び出しの共通リクエストポリシー
+リトライ（ジッター付き指数バックオフ・Retry-After対応）、トークンバケットによる流量制限、
+サーキットブレーカーをまとめて適用する
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+# リトライ対象のHTTPステータス
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+# ステータスコードを持たない例外のうち、通信エラーとしてリトライする例外名
+RETRYABLE_ERROR_NAMES = ("Timeout", "Connect", "Network", "Transport", "Protocol", "RemoteDisconnected")
+
+# postgrestのAPIError（レスポンスを持たず、codeはPGRSTのエラーコードまたはSQLSTATE）のうちリトライするコード
+# PGRST000〜003: データベースへの接続・スキーマキャッシュの読み込み・接続プールの取得の失敗（503・504）
+# 57014: statement_timeoutによるクエリのキャンセル
+RETRYABLE_POSTGREST_CODES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014")
+
+# コードを持たないAPIError（APIゲートウェイの429・503など）のうち、リトライするメッセージ（小文字で比較）
+RETRYABLE_ERROR_MESSAGES = (
+    "rate limit", "too many requests", "timeout", "timed out", "temporarily unavailable",
+    "connection", "connect error", "upstream", "service unavailable",
+)
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+
+class TokenBucket:
+    """トークンバケットによる流量制限"""
+
+    def __init__(self, rate: float, burst: int):
+        """
+        初期化
+
+        Args:
+            rate: 1秒あたりに補充するトークン数（0以下の場合は制限なし）
+            burst: バケットの最大トークン数
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ予約し、使えるようになるまでの待機時間を返す
+
+        Returns:
+            float: 待機が必要な秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # 先にトークンを予約し、不足分の補充時間だけロックの外で待つ
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        """
+        トークンを1つ取得（足りない場合は補充されるまで待機）
+
+        Returns:
+            float: 待機した秒数
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """連続失敗時に呼び出しを一時停止するサーキットブレーカー"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        初期化
+
+        Args:
+            failure_threshold: 開くまでの連続失敗回数（0以下の場合は無効）
+            reset_timeout: 開いてから試行を再開するまでの秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """状態（closed, open, half_open）"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """
+        呼び出し前の確認
+
+        Raises:
+            CircuitOpenError: ブレーカーが開いている場合
+        """
+        if self.failure_threshold > 0 and self.state == "open":
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(f"Supabaseへの呼び出しを停止中です（残り{remaining:.0f}秒）")
+
+    def record_success(self) -> None:
+        """成功を記録（ブレーカーを閉じる）"""
+        with self._lock:
+            if self.opened_at is not None:
+                print("[RequestPolicy] Supabaseへの呼び出しを再開しました")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        """失敗を記録（しきい値を超えた場合、または試行再開後の失敗でブレーカーを開く）"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"[RequestPolicy] {self.failures}回連続で失敗したため、{self.reset_timeout:.0f}秒間Supabaseへの呼び出しを停止します")
+                self.opened_at = time.monotonic()
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """
+    例外からHTTPステータスコードを取り出す（postgrestのAPIError・httpxの例外に対応）
+    APIErrorのcodeは、JSON以外のレスポンスの場合のみHTTPステータス（それ以外はPGRSTのエラーコード・SQLSTATE）
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, str) and not (len(code) == 3 and code.isdigit()):
+        # 5桁のSQLSTATE（例: 23505）はステータスコードとして扱わない
+        code = None
+    for value in (
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+        code,
+    ):
+        try:
+            if value is not None and 100 <= int(value) < 600:
+                return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """例外のレスポンスヘッダーからRetry-After（秒）を取り出す"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    リトライで回復する可能性のある例外かどうか
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        bool: 429・5xx・タイムアウト・接続エラー（PostgRESTのPGRST000〜003・57014を含む）の場合True
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    code = getattr(error, "code", None)
+    if code is not None:
+        return str(code) in RETRYABLE_POSTGREST_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES):
+        return True
+    # ステータス・コードを持たないAPIErrorは、流量制限・接続エラーのメッセージの場合のみリトライする
+    message = getattr(error, "message", None)
+    if isinstance(message, str):
+        message = message.lower()
+        return any(pattern in message for pattern in RETRYABLE_ERROR_MESSAGES)
+    return False
+
+
+class RequestPolicy:
+    """リトライ・流量制限・サーキットブレーカーをまとめたリクエストポリシー"""
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None
+    ):
+        """
+        初期化（未指定の値は環境変数から取得）
+
+        Args:
+            max_attempts: 最大試行回数（RPA_REQUEST_MAX_ATTEMPTS、デフォルト: 4）
+            backoff_base: 最初のリトライまでの待機時間（秒、RPA_REQUEST_BACKOFF_BASE、デフォルト: 0.5）
+            backoff_max: リトライ間隔の上限（秒、RPA_REQUEST_BACKOFF_MAX、デフォルト: 30）
+            rate: 1秒あたりの最大リクエスト数（RPA_REQUEST_RATE、デフォルト: 20、0で無制限）
+            burst: 連続で送れる最大リクエスト数（RPA_REQUEST_BURST、デフォルト: 10）
+            failure_threshold: サーキットブレーカーが開く連続失敗回数（RPA_CIRCUIT_FAILURE_THRESHOLD、デフォルト: 5、0で無効）
+            reset_timeout: サーキットブレーカーが開いている秒数（RPA_CIRCUIT_RESET_TIMEOUT、デフォルト: 30）
+        """
+        self.max_attempts = max(max_attempts or int(os.getenv("RPA_REQUEST_MAX_ATTEMPTS", "4")), 1)
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.getenv("RPA_REQUEST_BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max if backoff_max is not None else float(os.getenv("RPA_REQUEST_BACKOFF_MAX", "30"))
+        self.limiter = TokenBucket(
+            rate if rate is not None else float(os.getenv("RPA_REQUEST_RATE", "20")),
+            burst or int(os.getenv("RPA_REQUEST_BURST", "10"))
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold if failure_threshold is not None else int(os.getenv("RPA_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout if reset_timeout is not None else float(os.getenv("RPA_CIRCUIT_RESET_TIMEOUT", "30"))
+        )
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        リトライまでの待機時間を計算（Retry-Afterがあればそれを優先）
+
+        Args:
+            attempt: 失敗した試行の回数（1始まり）
+            error: 発生した例外
+
+        Returns:
+            float: 待機秒数
+        """
+        retry_after = _retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # フルジッター: 0〜(base * 2^(attempt-1)) の一様乱数
+        return random.uniform(0, min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max))
+
+    def call(self, func: Callable[[], Any], description: str = "Supabase") -> Any:
+        """
+        ポリシーを適用して関数を呼び出す
+
+        Args:
+            func: 呼び出す関数（引数なし）
+            description: ログに表示する呼び出し内容
+
+        Returns:
+            Any: 関数の戻り値
+
+        Raises:
+            CircuitOpenError: サーキットブレーカーが開いている場合
+            Exception: リトライ対象外の例外、または最大試行回数まで失敗した場合の最後の例外
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_call()
+            self.limiter.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._after_failure(e, attempt, description))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, func: Callable[[], Awaitable[Any]], description: str = "Supabase") -> Any:
+        """
+        call()の非同期版（待機はasyncio.sleepで行い、イベントループを止めない）
+
+        Args:
+            func: 呼び出すたびに新しいコルーチンを返す関数（引数なし）
+            description: ログに表示する呼び出し内容
+
+        Returns:
+            Any: コルーチンの結果
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_call()
+            wait = self.limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await func()
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(e, attempt, description))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _before_call(self) -> None:
+        """サーキットブレーカーを確認して呼び出し回数を記録"""
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.stats["rejected"] += 1
+            raise
+        self.stats["calls"] += 1
+
+    def _after_failure(self, error: Exception, attempt: int, description: str) -> float:
+        """
+        失敗を記録してリトライまでの待機時間を返す（リトライしない場合は例外を再送出）
+        except節の中から呼び出すこと
+        """
+        retryable = is_retryable(error)
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            # 4xxなどはSupabase自体は応答しているため、ブレーカーの判定では成功扱い
+            self.breaker.record_success()
+        if not retryable or attempt >= self.max_attempts:
+            self.stats["failures"] += 1
+            raise error
+        wait = self.backoff(attempt, error)
+        self.stats["retries"] += 1
+        print(f"[RequestPolicy] {description}が失敗しました（{attempt}/{self.max_attempts}回目）。{wait:.2f}秒後にリトライします: {error}")
+        return wait
+
+    def execute(self, request, description: str = "Supabase") -> Any:
+        """
+        Supabaseのクエリ（table().upsert()などの戻り値）をポリシーを適用して実行
+
+        Args:
+            request: execute()を持つクエリビルダー
+            description: ログに表示する呼び出し内容
+
+        Returns:
+            Any: execute()の結果
+        """
+        return self.call(request.execute, description)
+
+
+_request_policy: Optional[RequestPolicy] = None
+_request_policy_lock = threading.Lock()
+
+
+def get_request_policy() -> RequestPolicy:
+    """
+    プロセス共通のRequestPolicyを取得（流量制限・サーキットブレーカーを全スレッドで共有する）
+
+    Returns:
+        RequestPolicy: 共有インスタンス
+    """
+    global _request_policy
+    with _request_policy_lock:
+        if _request_policy is None:
+            _request_policy = RequestPolicy()
+        return _request_policy
@@ -0,0 +1,372 @@
+"""
+Supabase書き込みスプール
+Supabaseへの保存に失敗した行をローカルのSQLiteに追記保存し、
+バックグラウンドスレッドが指数バックオフで再送する（スクレイピング結果を失わないため）
+"""
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional, Callable, Set, Tuple
+
+from rpa.utils.config_loader import get_supabase_config
+from rpa.utils.request_policy import CircuitOpenError, get_request_policy, is_retryable
+
+
+# 再送モード（upsertは何度送っても同じ結果になる。insertは旧形式のdata_saver用）
+SPOOL_MODES = ("upsert", "insert")
+
+# 注文グラフ（顧客・注文・注文商品のまとまり）をsave_order_graphs RPCで保存する場合のテーブル名
+ORDER_GRAPHS_TABLE = "order_graphs"
+
+
+def dependency_keys(table: str, rows: List[Dict[str, Any]]) -> Set[Tuple[str, Any]]:
+    """
+    エントリが保存・参照する顧客ID・注文IDを返す（共通のキーを持つエントリ同士は順序を保って再送する）
+
+    Args:
+        table: テーブル名
+        rows: 行（または注文グラフ）のリスト
+
+    Returns:
+        Set[Tuple[str, Any]]: ("customer", ID) / ("order", ID) の集合
+    """
+    keys: Set[Tuple[str, Any]] = set()
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        if table == ORDER_GRAPHS_TABLE:
+            customer = row.get("customer") or {}
+            values = (("order", row.get("id")), ("customer", customer.get("id")))
+        elif table == "customers":
+            values = (("customer", row.get("id")),)
+        elif table == "orders":
+            values = (("order", row.get("id")), ("customer", row.get("customer_id")))
+        elif table == "order_items":
+            values = (("order", row.get("order_id")),)
+        else:
+            values = ()
+        keys.update((kind, value) for kind, value in values if value)
+    return keys
+
+
+class WriteSpool:
+    """SQLiteに保存する書き込みスプール"""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+        max_attempts: Optional[int] = None
+    ):
+        """
+        初期化
+
+        Args:
+            db_path: SQLiteファイルのパス（未指定の場合は環境変数RPA_SPOOL_DB、デフォルト: write_spool.sqlite3）
+            backoff_base: 最初の再送までの待機時間（秒、環境変数RPA_SPOOL_BACKOFF_BASE、デフォルト: 5）
+            backoff_max: 再送間隔の上限（秒、環境変数RPA_SPOOL_BACKOFF_MAX、デフォルト: 600）
+            max_attempts: 一時的なエラーで失敗し続けたエントリをデッドレターに移すまでの再送回数
+                （環境変数RPA_SPOOL_MAX_ATTEMPTS、デフォルト: 20）
+        """
+        self.db_path = db_path or os.getenv("RPA_SPOOL_DB", "write_spool.sqlite3")
+        self.backoff_base = backoff_base or float(os.getenv("RPA_SPOOL_BACKOFF_BASE", "5"))
+        self.backoff_max = backoff_max or float(os.getenv("RPA_SPOOL_BACKOFF_MAX", "600"))
+        self.max_attempts = max(max_attempts or int(os.getenv("RPA_SPOOL_MAX_ATTEMPTS", "20")), 1)
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._replayer: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " table_name TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " rows TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL)"
+        )
+        # 再送しても成功しない見込みのエントリ（4xx・制約違反・RLS違反、または再送回数の上限到達）
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            " id INTEGER PRIMARY KEY,"
+            " table_name TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " rows TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " failed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def append(self, table: str, rows: List[Dict[str, Any]], mode: str = "upsert", error: Optional[Exception] = None) -> int:
+        """
+        保存に失敗した行をスプールに追加
+
+        Args:
+            table: テーブル名
+            rows: 行のリスト
+            mode: 再送方法（upsert, insert）
+            error: 失敗の原因となった例外
+
+        Returns:
+            int: スプールした行数
+        """
+        if not rows:
+            return 0
+        if mode not in SPOOL_MODES:
+            raise ValueError(f"不明なスプールモード: {mode}")
+        now = time.time()
+        payload = json.dumps(rows, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO spool (table_name, mode, rows, attempts, next_attempt_at, last_error, created_at)"
+                " VALUES (?, ?, ?, 0, ?, ?, ?)",
+                (table, mode, payload, now + self.backoff_base, str(error) if error else None, now)
+            )
+            self._conn.commit()
+        print(f"[WriteSpool] {table}の{len(rows)}件をスプールに保存しました（後で再送します）")
+        return len(rows)
+
+    def pending(self) -> Dict[str, int]:
+        """
+        再送待ちの行数をテーブルごとに返す
+
+        Returns:
+            Dict[str, int]: {テーブル名: 行数}
+        """
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for table, payload in self._conn.execute("SELECT table_name, rows FROM spool"):
+                counts[table] = counts.get(table, 0) + len(json.loads(payload))
+        return counts
+
+    def dead_letters(self) -> Dict[str, int]:
+        """
+        デッドレターに移した行数をテーブルごとに返す
+
+        Returns:
+            Dict[str, int]: {テーブル名: 行数}
+        """
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for table, payload in self._conn.execute("SELECT table_name, rows FROM dead_letters"):
+                counts[table] = counts.get(table, 0) + len(json.loads(payload))
+        return counts
+
+    def requeue_dead_letters(self) -> int:
+        """
+        デッドレターのエントリをスプールに戻す（原因を修正した後に再送するため）
+
+        Returns:
+            int: スプールに戻したエントリ数
+        """
+        with self._lock:
+            count = self._conn.execute(
+                "INSERT INTO spool (id, table_name, mode, rows, attempts, next_attempt_at, last_error, created_at)"
+                " SELECT id, table_name, mode, rows, 0, ?, last_error, created_at FROM dead_letters",
+                (time.time(),)
+            ).rowcount
+            self._conn.execute("DELETE FROM dead_letters")
+            self._conn.commit()
+        if count:
+            print(f"[WriteSpool] デッドレターの{count}件をスプールに戻しました")
+        return count
+
+    def drain(self, writer: Callable[[str, List[Dict[str, Any]], str], None], force: bool = False, limit: int = 100) -> Dict[str, int]:
+        """
+        再送時刻を過ぎたエントリを古い順に書き込む
+        一時的なエラー（request_policy.is_retryableと同じ判定）で失敗したエントリは指数バックオフで次回の再送時刻を延ばし、
+        再送回数が上限に達したエントリと、再送しても成功しないエラーで失敗したエントリはデッドレターに移す
+        失敗したエントリと同じ顧客・注文の後続エントリのみ順序を保つために延期し、それ以外は続けて再送する
+
+        Args:
+            writer: (テーブル名, 行のリスト, モード) を受け取って書き込む関数（失敗時は例外を送出）
+            force: Trueの場合は再送時刻に関係なくすべて対象にする
+            limit: 1回で処理する最大エントリ数
+
+        Returns:
+            Dict[str, int]: {"written": 再送できた行数, "failed": 再送に失敗した行数, "dead_lettered": デッドレターに移した行数}
+        """
+        summary = {"written": 0, "failed": 0, "dead_lettered": 0}
+        with self._drain_lock:
+            with self._lock:
+                entries = self._conn.execute(
+                    "SELECT id, table_name, mode, rows, attempts FROM spool"
+                    " WHERE ? OR next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (1 if force else 0, time.time(), limit)
+                ).fetchall()
+
+            blocked_keys = set()
+            for entry_id, table, mode, payload, attempts in entries:
+                rows = json.loads(payload)
+                keys = dependency_keys(table, rows)
+                # 先に失敗した顧客・注文に依存する行（顧客 → 注文 → 注文商品）は順序を保つため後回しにする
+                if keys & blocked_keys:
+                    blocked_keys |= keys
+                    self._reschedule(entry_id, attempts, "依存するエントリの再送に失敗したため延期")
+                    summary["failed"] += len(rows)
+                    continue
+                try:
+                    writer(table, rows, mode)
+                except CircuitOpenError as e:
+                    # Supabaseへの呼び出しが停止中のため、残りのエントリも含めて次回に回す（再送回数には数えない）
+                    print(f"[WriteSpool] 再送を中断しました: {e}")
+                    break
+                except Exception as e:
+                    blocked_keys |= keys
+                    summary["failed"] += len(rows)
+                    if not is_retryable(e) or attempts + 1 >= self.max_attempts:
+                        self._dead_letter(entry_id, attempts + 1, str(e))
+                        summary["dead_lettered"] += len(rows)
+                        print(f"[WriteSpool] {table}の{len(rows)}件をデッドレターに移しました（{attempts + 1}回目）: {e}")
+                    else:
+                        self._reschedule(entry_id, attempts + 1, str(e))
+                        print(f"[WriteSpool] {table}の{len(rows)}件の再送に失敗しました（{attempts + 1}回目）: {e}")
+                    continue
+                with self._lock:
+                    self._conn.execute("DELETE FROM spool WHERE id = ?", (entry_id,))
+                    self._conn.commit()
+                summary["written"] += len(rows)
+
+        if summary["written"]:
+            print(f"[WriteSpool] {summary['written']}件をSupabaseに再送しました")
+        return summary
+
+    def _dead_letter(self, entry_id: int, attempts: int, error: str) -> None:
+        """エントリをスプールからデッドレターに移す"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dead_letters (id, table_name, mode, rows, attempts, last_error, created_at, failed_at)"
+                " SELECT id, table_name, mode, rows, ?, ?, created_at, ? FROM spool WHERE id = ?",
+                (attempts, error, time.time(), entry_id)
+            )
+            self._conn.execute("DELETE FROM spool WHERE id = ?", (entry_id,))
+            self._conn.commit()
+
+    def _reschedule(self, entry_id: int, attempts: int, error: str) -> None:
+        """次回の再送時刻を指数バックオフ（ジッター付き）で設定"""
+        delay = min(self.backoff_base * (2 ** attempts), self.backoff_max) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE spool SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, error, entry_id)
+            )
+            self._conn.commit()
+
+    def start_replayer(self, writer: Optional[Callable[[str, List[Dict[str, Any]], str], None]] = None, interval: Optional[float] = None) -> None:
+        """
+        バックグラウンドの再送スレッドを起動（起動済みの場合は何もしない）
+
+        Args:
+            writer: 書き込み関数（未指定の場合は環境変数のSupabase設定で書き込む）
+            interval: スプールを確認する間隔（秒、環境変数RPA_SPOOL_REPLAY_INTERVAL、デフォルト: 10）
+        """
+        if self._replayer and self._replayer.is_alive():
+            return
+        writer = writer or supabase_writer
+        interval = interval or float(os.getenv("RPA_SPOOL_REPLAY_INTERVAL", "10"))
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.drain(writer)
+                except Exception as e:
+                    print(f"[WriteSpool] 再送処理でエラーが発生しました: {e}")
+                    import traceback
+                    traceback.print_exc()
+
+        self._replayer = threading.Thread(target=run, name="write-spool-replayer", daemon=True)
+        self._replayer.start()
+
+    def stop_replayer(self) -> None:
+        """再送スレッドを停止"""
+        self._stop.set()
+        if self._replayer:
+            self._replayer.join(timeout=5)
+            self._replayer = None
+
+    def close(self) -> None:
+        """再送スレッドを停止してSQLite接続を閉じる"""
+        self.stop_replayer()
+        with self._lock:
+            self._conn.close()
+
+
+_supabase_client = None
+
+
+def supabase_writer(table: str, rows: List[Dict[str, Any]], mode: str) -> None:
+    """
+    環境変数のSupabase設定で行を書き込む（再送スレッドのデフォルト）
+
+    Args:
+        table: テーブル名
+        rows: 行のリスト
+        mode: upsert または insert
+    """
+    global _supabase_client
+    if _supabase_client is None:
+        from supabase import create_client
+        config = get_supabase_config()
+        if not config["url"] or not config["key"]:
+            raise RuntimeError("Supabaseの設定が見つかりません。環境変数を確認してください。")
+        _supabase_client = create_client(config["url"], config["key"])
+    if table == ORDER_GRAPHS_TABLE:
+        request = _supabase_client.rpc("save_order_graphs", {"graphs": rows})
+    else:
+        query = _supabase_client.table(table)
+        request = query.insert(rows) if mode == "insert" else query.upsert(rows)
+    get_request_policy().execute(request, f"スプールからの{table}の再送")
+
+
+_write_spool: Optional[WriteSpool] = None
+_write_spool_lock = threading.Lock()
+
+
+def get_write_spool() -> Optional[WriteSpool]:
+    """
+    プロセス共通のWriteSpoolを取得（初回呼び出し時に再送スレッドを起動）
+    環境変数RPA_SPOOL_ENABLEDがfalseの場合はNone
+
+    Returns:
+        Optional[WriteSpool]: 共有インスタンス
+    """
+    global _write_spool
+    if os.getenv("RPA_SPOOL_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    with _write_spool_lock:
+        if _write_spool is None:
+            _write_spool = WriteSpool()
+            _write_spool.start_replayer()
+        return _write_spool
+
+
+if __name__ == "__main__":
+    if "--status" not in sys.argv and "--drain" not in sys.argv and "--requeue" not in sys.argv:
+        print("使用方法:")
+        print("  python -m rpa.utils.write_spool --status   # 再送待ち・デッドレターの件数を表示")
+        print("  python -m rpa.utils.write_spool --drain    # 再送時刻に関係なくすべて再送")
+        print("  python -m rpa.utils.write_spool --requeue  # デッドレターをスプールに戻す（--drainと併用可）")
+        sys.exit(1)
+
+    spool = WriteSpool()
+    if "--requeue" in sys.argv:
+        spool.requeue_dead_letters()
+    if "--drain" in sys.argv:
+        spool.drain(supabase_writer, force=True, limit=1000000)
+    pending = spool.pending()
+    dead = spool.dead_letters()
+    print(f"[WriteSpool] 再送待ち: {pending if pending else 'なし'}")
+    print(f"[WriteSpool] デッドレター: {dead if dead else 'なし'}")
+    sys.exit(0 if not pending and not dead else 1)
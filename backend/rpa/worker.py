@@ -0,0 +1,155 @@
+"""
+RPAワーカープロセス
+永続キュー（rpa.jobs.queue）からジョブを取り出してブラウザを操作し、進捗と結果をキューに書き戻す
+APIサーバーをRPA_EXECUTION_MODE=queueで起動し、同じRPA_QUEUE_DBを参照するワーカーを必要な数だけ起動する
+
+使用方法:
+    python -m rpa.worker [--concurrency N] [--worker-id ID]
+"""
+import os
+import socket
+import sys
+import threading
+from typing import Dict, Any, Optional
+
+from rpa.core.telemetry import get_driver_monitor
+from rpa.generic.order_export import get_order_exporter
+from rpa.jobs.batch import run_group
+from rpa.jobs.queue import JobQueue, get_job_queue
+from rpa.jobs.registry import Job, get_job_registry, run_job
+
+
+class QueueWorker:
+    """キューのジョブを実行するワーカー（1プロセスで複数のブラウザを同時に動かせる）"""
+
+    def __init__(self, concurrency: Optional[int] = None, worker_id: Optional[str] = None, queue: Optional[JobQueue] = None):
+        """
+        初期化
+
+        Args:
+            concurrency: 同時に実行するジョブ数（未指定の場合は環境変数RPA_MAX_BROWSERS、デフォルト: 4）
+            worker_id: ワーカーID（未指定の場合は ホスト名-PID）
+            queue: ジョブキュー（未指定の場合はプロセス共通のキュー）
+        """
+        self.concurrency = concurrency or int(os.getenv("RPA_MAX_BROWSERS", "4"))
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.queue = queue or get_job_queue()
+        # 新しいジョブを確認する間隔（秒、環境変数RPA_QUEUE_POLL、デフォルト: 0.5）
+        self.poll_interval = float(os.getenv("RPA_QUEUE_POLL", "0.5"))
+        # 生存を記録・キャンセルを確認する間隔（秒、環境変数RPA_WORKER_HEARTBEAT、デフォルト: 5）
+        self.heartbeat_interval = float(os.getenv("RPA_WORKER_HEARTBEAT", "5"))
+        self._running: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_forever(self) -> None:
+        """ジョブを取り出して実行し続ける（Ctrl+Cで実行中のジョブの終了を待って止まる）"""
+        print(f"[Worker] ワーカーを起動しました (ID: {self.worker_id}, 同時実行数: {self.concurrency}, キュー: {self.queue.db_path})")
+        # ブラウザのメモリ使用量を計測し、上限を超えたブラウザを再起動させる
+        get_driver_monitor().start()
+        slots = [
+            threading.Thread(target=self._run_slot, name=f"rpa-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for slot in slots:
+            slot.start()
+        try:
+            while not self._stop.is_set():
+                self._heartbeat()
+                self._stop.wait(self.heartbeat_interval)
+        except KeyboardInterrupt:
+            print("[Worker] 停止します（実行中のジョブの終了を待ちます）")
+            self._stop.set()
+        for slot in slots:
+            slot.join()
+        # 単発の実行で書き出し待ちになっている分析用の注文データを書き出す
+        get_order_exporter().flush()
+        print(f"[Worker] ワーカーを停止しました (ID: {self.worker_id})")
+
+    def stop(self) -> None:
+        """新しいジョブの取り出しを止める"""
+        self._stop.set()
+
+    def _run_slot(self) -> None:
+        """1件ずつジョブを取り出して実行する（ワーカーのスレッド）"""
+        while not self._stop.is_set():
+            try:
+                claimed = self.queue.claim(self.worker_id)
+            except Exception as e:
+                print(f"[Worker] ジョブの取り出しエラー: {e}")
+                import traceback
+                traceback.print_exc()
+                claimed = None
+            if claimed is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.execute(claimed)
+
+    def execute(self, claimed: Dict[str, Any]) -> None:
+        """
+        取り出したジョブを現在のスレッドで実行し、進捗イベントをキューに書き戻す
+
+        Args:
+            claimed: JobQueue.claim()の戻り値
+        """
+        job_id = claimed["job_id"]
+        spec = claimed["spec"]
+        # RPA側のreport()・attach_driver()・キャンセル確認がこのプロセスで動くように、ジョブ一覧に登録する
+        job = get_job_registry().create(job_id, claimed["kind"], claimed["platform"], claimed["user_id"])
+        job.listeners.append(lambda event: self._forward(job, event))
+        with self._lock:
+            self._running[job_id] = job
+        print(f"[Worker] ジョブを実行します (Job ID: {job_id}, {spec['kind']}, {spec.get('platform')})")
+        try:
+            if claimed.get("cancel_requested"):
+                job.cancel("実行前にキャンセルされました")
+            run_job(job, lambda: run_group(spec, job_id, bool(spec.get("headless"))))
+        finally:
+            self.queue.complete(job_id)
+            with self._lock:
+                self._running.pop(job_id, None)
+        print(f"[Worker] ジョブが終了しました (Job ID: {job_id}, {job.status})")
+
+    def _forward(self, job: Job, event: Dict[str, Any]) -> None:
+        """ジョブの進捗イベントをキューに書き込む（終了時は結果も含める）"""
+        self.queue.add_event(job.job_id, {
+            "stage": event["stage"],
+            "message": event["message"],
+            "data": event["data"],
+            "status": job.status,
+            "result": job.result if event["stage"] == "finished" else None,
+        })
+
+    def _heartbeat(self) -> None:
+        """実行中のジョブの生存を記録し、APIサーバーでキャンセルされたジョブを中断する"""
+        with self._lock:
+            running = dict(self._running)
+        try:
+            for job_id, timed_out in self.queue.heartbeat(list(running)).items():
+                if timed_out:
+                    running[job_id].cancel("APIサーバーで制限時間を超えました", timed_out=True)
+                else:
+                    running[job_id].cancel("ユーザーによってキャンセルされました")
+        except Exception as e:
+            print(f"[Worker] 生存の記録エラー: {e}")
+
+
+def main(argv=None) -> None:
+    """コマンドラインから起動"""
+    argv = sys.argv[1:] if argv is None else argv
+    concurrency = None
+    worker_id = None
+    for i, arg in enumerate(argv):
+        if arg == "--concurrency" and i + 1 < len(argv):
+            concurrency = int(argv[i + 1])
+        elif arg == "--worker-id" and i + 1 < len(argv):
+            worker_id = argv[i + 1]
+        elif arg in ("-h", "--help"):
+            print("使用方法:")
+            print("  python -m rpa.worker [--concurrency N] [--worker-id ID]")
+            return
+    QueueWorker(concurrency=concurrency, worker_id=worker_id).run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -299,3 +299,103 @@ COMMENT ON COLUMN orders.job_id IS 'RPA実行ジョブID。どのRPA実行で取
 COMMENT ON COLUMN order_items.unit IS '数量の単位（kg, 個, 箱など）';
 COMMENT ON COLUMN order_items.quantity IS '数量（DECIMAL型で小数点も対応）';
 
+
+-- ============================================
+-- 7. 注文の一括保存関数（RPC）
+-- ============================================
+
+-- 顧客・注文・注文商品のまとまり（注文グラフ）のJSON配列を1トランザクションでupsertする
+-- 呼び出し例: supabase.rpc("save_order_graphs", {"graphs": [{"customer": {...}, "order": {...}, "items": [...]}]})
+-- JSONにない列は既存の値を保持する（新規行の場合はテーブルの既定値）
+-- 既定値は既存の行がない場合のみ使う（既存の行はLEFT JOINで取得し、既定値で上書きしない）
+-- SECURITY INVOKERのため、呼び出したユーザーのRLSポリシーがそのまま適用される
+CREATE OR REPLACE FUNCTION save_order_graphs(graphs JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    customer_count INTEGER;
+    order_count INTEGER;
+    item_count INTEGER;
+    deleted_item_count INTEGER;
+BEGIN
+    -- 顧客（同じIDが複数ある場合は後のものを採用）
+    INSERT INTO customers AS t (id, name, email, phone, postal_code, address, platform, user_id)
+    SELECT DISTINCT ON (r.id) r.id, r.name, r.email, r.phone, r.postal_code, r.address, r.platform, r.user_id
+    FROM jsonb_array_elements(graphs) WITH ORDINALITY AS g(graph, position),
+         jsonb_populate_record(NULL::customers, g.graph->'customer') AS r
+    WHERE jsonb_typeof(g.graph->'customer') = 'object'
+    ORDER BY r.id, g.position DESC
+    ON CONFLICT (id) DO UPDATE SET
+        name = COALESCE(EXCLUDED.name, t.name),
+        email = COALESCE(EXCLUDED.email, t.email),
+        phone = COALESCE(EXCLUDED.phone, t.phone),
+        postal_code = COALESCE(EXCLUDED.postal_code, t.postal_code),
+        address = COALESCE(EXCLUDED.address, t.address),
+        platform = COALESCE(EXCLUDED.platform, t.platform),
+        user_id = COALESCE(EXCLUDED.user_id, t.user_id);
+    GET DIAGNOSTICS customer_count = ROW_COUNT;
+
+    -- 注文
+    INSERT INTO orders AS t (id, order_number, platform, customer_id, order_date, status, total_amount,
+                             payment_method, shipping_fee, tax, user_id, job_id)
+    SELECT DISTINCT ON (r.id) r.id, r.order_number, r.platform, r.customer_id, r.order_date,
+           COALESCE(r.status, e.status, '未処理'), COALESCE(r.total_amount, e.total_amount, 0), r.payment_method,
+           COALESCE(r.shipping_fee, e.shipping_fee, 0), COALESCE(r.tax, e.tax, 0), r.user_id, r.job_id
+    FROM jsonb_array_elements(graphs) WITH ORDINALITY AS g(graph, position)
+         CROSS JOIN LATERAL jsonb_populate_record(NULL::orders, g.graph->'order') AS r
+         LEFT JOIN orders AS e ON e.id = r.id
+    WHERE jsonb_typeof(g.graph->'order') = 'object'
+    ORDER BY r.id, g.position DESC
+    ON CONFLICT (id) DO UPDATE SET
+        order_number = COALESCE(EXCLUDED.order_number, t.order_number),
+        platform = COALESCE(EXCLUDED.platform, t.platform),
+        customer_id = COALESCE(EXCLUDED.customer_id, t.customer_id),
+        order_date = COALESCE(EXCLUDED.order_date, t.order_date),
+        status = COALESCE(EXCLUDED.status, t.status),
+        total_amount = COALESCE(EXCLUDED.total_amount, t.total_amount),
+        payment_method = COALESCE(EXCLUDED.payment_method, t.payment_method),
+        shipping_fee = COALESCE(EXCLUDED.shipping_fee, t.shipping_fee),
+        tax = COALESCE(EXCLUDED.tax, t.tax),
+        user_id = COALESCE(EXCLUDED.user_id, t.user_id),
+        job_id = COALESCE(EXCLUDED.job_id, t.job_id);
+    GET DIAGNOSTICS order_count = ROW_COUNT;
+
+    -- 商品一覧にない注文商品を削除（商品が1件以上ある注文のみ）
+    DELETE FROM order_items AS t
+    USING (
+        SELECT g.graph->'order'->>'id' AS order_id,
+               array_agg(i.item->>'id') AS keep_ids
+        FROM jsonb_array_elements(graphs) AS g(graph),
+             jsonb_array_elements(g.graph->'items') AS i(item)
+        WHERE jsonb_typeof(g.graph->'order') = 'object'
+          AND jsonb_typeof(g.graph->'items') = 'array'
+        GROUP BY 1
+    ) AS k
+    WHERE t.order_id = k.order_id
+      AND NOT (t.id = ANY (k.keep_ids));
+    GET DIAGNOSTICS deleted_item_count = ROW_COUNT;
+
+    -- 注文商品
+    INSERT INTO order_items AS t (id, order_id, product_id, product_name, quantity, unit, price, subtotal, sku)
+    SELECT DISTINCT ON (r.id) r.id, r.order_id, r.product_id, r.product_name,
+           COALESCE(r.quantity, e.quantity, 1), COALESCE(r.unit, e.unit, 'kg'), r.price, r.subtotal, r.sku
+    FROM jsonb_array_elements(graphs) WITH ORDINALITY AS g(graph, position)
+         CROSS JOIN LATERAL jsonb_array_elements(CASE WHEN jsonb_typeof(g.graph->'items') = 'array' THEN g.graph->'items' ELSE '[]'::jsonb END)
+             WITH ORDINALITY AS i(item, item_position)
+         CROSS JOIN LATERAL jsonb_populate_record(NULL::order_items, i.item) AS r
+         LEFT JOIN order_items AS e ON e.id = r.id
+    ORDER BY r.id, g.position DESC, i.item_position DESC
+    ON CONFLICT (id) DO UPDATE SET
+        order_id = EXCLUDED.order_id,
+        product_id = COALESCE(EXCLUDED.product_id, t.product_id),
+        product_name = COALESCE(EXCLUDED.product_name, t.product_name),
+        quantity = COALESCE(EXCLUDED.quantity, t.quantity),
+        unit = COALESCE(EXCLUDED.unit, t.unit),
+        price = COALESCE(EXCLUDED.price, t.price),
+        subtotal = COALESCE(EXCLUDED.subtotal, t.subtotal),
+        sku = COALESCE(EXCLUDED.sku, t.sku);
+    GET DIAGNOSTICS item_count = ROW_COUNT;
+
+    RETURN jsonb_build_object('customers', customer_count, 'orders', order_count, 'items', item_count,
+                              'deleted_items', deleted_item_count);
+END;
+$$ LANGUAGE plpgsql SECURITY INVOKER;
@@ -0,0 +1,7 @@
+"""
+テスト共通設定（backendディレクトリをインポートパスに追加）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,210 @@
+"""
+RequestPolicyのテスト
+Supabaseの代わりに、指定した順に失敗・成功するスタブのクエリで
+リトライ・Retry-After・サーキットブレーカー・postgrestのエラーの分類を確認する
+"""
+import pytest
+
+from rpa.utils import request_policy
+from rpa.utils.request_policy import CircuitOpenError, RequestPolicy
+
+
+class FakeClock:
+    """time.sleep/time.monotonicの代わり（待機せずに時刻だけ進める）"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    """httpxのレスポンスの代わり"""
+
+    def __init__(self, status_code: int, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPIError(Exception):
+    """postgrestのAPIErrorの代わり（responseにステータスコードとヘッダーを持つ）"""
+
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code, headers)
+
+
+class StubPostgrestError(Exception):
+    """postgrestのAPIErrorと同じ属性（message/code/hint/details、responseなし）を持つ例外"""
+
+    def __init__(self, error):
+        self._raw_error = error
+        self.message = error.get("message")
+        self.code = error.get("code")
+        self.hint = error.get("hint")
+        self.details = error.get("details")
+        super().__init__(str(error))
+
+
+class StubRequest:
+    """execute()のたびに指定した結果を順に返す（例外の場合は送出する）クエリ"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(request_policy, "time", fake)
+    return fake
+
+
+def make_policy(**overrides) -> RequestPolicy:
+    options = dict(max_attempts=4, backoff_base=0.5, backoff_max=30, rate=0, failure_threshold=3, reset_timeout=30)
+    options.update(overrides)
+    return RequestPolicy(**options)
+
+
+def test_429_waits_for_retry_after(clock):
+    policy = make_policy()
+    request = StubRequest(FakeAPIError(429, {"Retry-After": "7"}), "ok")
+
+    assert policy.execute(request) == "ok"
+    assert request.calls == 2
+    assert clock.sleeps == [7.0]
+    assert policy.stats["retries"] == 1
+
+
+def test_retry_after_is_capped_by_backoff_max(clock):
+    policy = make_policy(backoff_max=5)
+    request = StubRequest(FakeAPIError(429, {"retry-after": "120"}), "ok")
+
+    assert policy.execute(request) == "ok"
+    assert clock.sleeps == [5.0]
+
+
+def test_5xx_retries_with_exponential_backoff(clock, monkeypatch):
+    # フルジッターの上限値で待機させ、指数的に伸びることを確認する
+    monkeypatch.setattr(request_policy.random, "uniform", lambda low, high: high)
+    policy = make_policy(failure_threshold=0)
+    request = StubRequest(FakeAPIError(503), FakeAPIError(502), FakeAPIError(500), "ok")
+
+    assert policy.execute(request) == "ok"
+    assert request.calls == 4
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+
+
+def test_5xx_raises_after_max_attempts(clock):
+    policy = make_policy(failure_threshold=0)
+    request = StubRequest(*[FakeAPIError(503) for _ in range(4)])
+
+    with pytest.raises(FakeAPIError):
+        policy.execute(request)
+    assert request.calls == 4
+    assert policy.stats["failures"] == 1
+
+
+def test_non_retryable_4xx_fails_fast(clock):
+    policy = make_policy()
+    request = StubRequest(FakeAPIError(409), "ok")
+
+    with pytest.raises(FakeAPIError):
+        policy.execute(request)
+    assert request.calls == 1
+    assert clock.sleeps == []
+    # Supabase自体は応答しているため、ブレーカーの判定では失敗に数えない
+    assert policy.breaker.failures == 0
+
+
+def test_breaker_opens_and_recovers_after_half_open(clock):
+    policy = make_policy(max_attempts=1, failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        with pytest.raises(FakeAPIError):
+            policy.execute(StubRequest(FakeAPIError(503)))
+    assert policy.breaker.state == "open"
+
+    # 開いている間は呼び出さずに失敗する
+    blocked = StubRequest("ok")
+    with pytest.raises(CircuitOpenError):
+        policy.execute(blocked)
+    assert blocked.calls == 0
+    assert policy.stats["rejected"] == 1
+
+    # reset_timeoutが過ぎると試行を再開し、成功すれば閉じる
+    clock.now += 30
+    assert policy.breaker.state == "half_open"
+    assert policy.execute(StubRequest("ok")) == "ok"
+    assert policy.breaker.state == "closed"
+    assert policy.breaker.failures == 0
+
+
+def test_failure_while_half_open_reopens_breaker(clock):
+    policy = make_policy(max_attempts=1, failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        with pytest.raises(FakeAPIError):
+            policy.execute(StubRequest(FakeAPIError(500)))
+    clock.now += 30
+    assert policy.breaker.state == "half_open"
+
+    with pytest.raises(FakeAPIError):
+        policy.execute(StubRequest(FakeAPIError(500)))
+    assert policy.breaker.state == "open"
+
+
+@pytest.mark.parametrize("error", [
+    {"code": "PGRST000", "message": "Could not connect with the database due to an incorrect db-uri or due to the PostgreSQL service not running."},
+    {"code": "PGRST001", "message": "Database client error. Retrying the connection."},
+    {"code": "PGRST002", "message": "Could not query the database for the schema cache. Retrying."},
+    {"code": "PGRST003", "message": "Timed out acquiring connection from connection pool."},
+    {"code": "57014", "message": "canceling statement due to statement timeout"},
+    {"code": None, "message": "API rate limit exceeded"},
+    {"code": None, "message": "upstream connect error or disconnect/reset before headers"},
+    # JSON以外のレスポンスはcodeにHTTPステータスが入る
+    {"code": 503, "message": "JSON could not be generated"},
+])
+def test_postgrest_api_error_is_retried(clock, error):
+    policy = make_policy()
+    request = StubRequest(StubPostgrestError(error), "ok")
+
+    assert policy.execute(request) == "ok"
+    assert request.calls == 2
+    assert policy.breaker.failures == 0
+
+
+@pytest.mark.parametrize("error", [
+    {"code": "23505", "message": "duplicate key value violates unique constraint \"orders_pkey\""},
+    {"code": "42501", "message": "new row violates row-level security policy for table \"orders\""},
+    {"code": "PGRST204", "message": "Could not find the 'foo' column of 'orders' in the schema cache"},
+    {"code": None, "message": "invalid input syntax for type uuid"},
+])
+def test_postgrest_api_error_fails_fast(clock, error):
+    policy = make_policy()
+    request = StubRequest(StubPostgrestError(error), "ok")
+
+    with pytest.raises(StubPostgrestError):
+        policy.execute(request)
+    assert request.calls == 1
+    assert policy.breaker.failures == 0
+
+
+def test_postgrest_unavailable_opens_breaker(clock):
+    policy = make_policy(max_attempts=1, failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(StubPostgrestError):
+            policy.execute(StubRequest(StubPostgrestError({"code": "PGRST002", "message": "Could not query the database for the schema cache. Retrying."})))
+    assert policy.breaker.state == "open"